@@ -19,6 +19,39 @@ from rag_server.config import settings
 logger = logging.getLogger(__name__)
 
 
+# Стоп-слова (русские и английские)
+_STOP_WORDS = frozenset({
+    # Русские
+    'в', 'на', 'и', 'с', 'по', 'для', 'как', 'что', 'это', 'или', 'а', 'но',
+    'из', 'к', 'о', 'от', 'до', 'за', 'под', 'над', 'при', 'про', 'через',
+    'без', 'у', 'об', 'не', 'ни', 'то', 'же', 'бы', 'ли', 'уже', 'еще',
+    # Английские
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'were', 'be',
+    'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will',
+    'would', 'should', 'could', 'may', 'might', 'must', 'can', 'this',
+    'that', 'these', 'those', 'it', 'its', 'they', 'them', 'their'
+})
+
+# Слова (кириллица и латиница)
+_RE_WORD = re.compile(r'[а-яёa-z0-9]+')
+
+# Длинные тексты (PRF по топ документам) не кэшируются, чтобы не держать их в памяти
+_KEYWORDS_CACHE_MAX_TEXT = 2048
+
+
+def _extract_keywords_uncached(text: str, min_length: int) -> tuple:
+    """Извлекает ключевые слова без кэша."""
+    words = _RE_WORD.findall(text.lower())
+    return tuple(w for w in words if w not in _STOP_WORDS and len(w) >= min_length)
+
+
+@lru_cache(maxsize=4096)
+def _cached_extract_keywords(text: str, min_length: int) -> tuple:
+    """Кэширует ключевые слова (запросы, предложения, breadcrumbs повторяются)."""
+    return _extract_keywords_uncached(text, min_length)
+
+
 def extract_keywords(text: str, min_length: int = 3) -> list:
     """
     Извлекает ключевые слова из текста.
@@ -30,30 +63,15 @@ def extract_keywords(text: str, min_length: int = 3) -> list:
     Returns:
         Список ключевых слов
     """
-    # Приводим к нижнему регистру
-    text = text.lower()
-
-    # Стоп-слова (русские и английские)
-    stop_words = {
-        # Русские
-        'в', 'на', 'и', 'с', 'по', 'для', 'как', 'что', 'это', 'или', 'а', 'но',
-        'из', 'к', 'о', 'от', 'до', 'за', 'под', 'над', 'при', 'про', 'через',
-        'без', 'у', 'об', 'не', 'ни', 'то', 'же', 'бы', 'ли', 'уже', 'еще',
-        # Английские
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-        'of', 'with', 'by', 'from', 'as', 'is', 'was', 'are', 'were', 'be',
-        'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will',
-        'would', 'should', 'could', 'may', 'might', 'must', 'can', 'this',
-        'that', 'these', 'those', 'it', 'its', 'they', 'them', 'their'
-    }
-
-    # Извлекаем слова (кириллица и латиница)
-    words = re.findall(r'[а-яёa-z0-9]+', text)
-
-    # Фильтруем стоп-слова и короткие слова
-    keywords = [w for w in words if w not in stop_words and len(w) >= min_length]
-
-    return keywords
+    if len(text) > _KEYWORDS_CACHE_MAX_TEXT:
+        return list(_extract_keywords_uncached(text, min_length))
+    return list(_cached_extract_keywords(text, min_length))
+
+
+@lru_cache(maxsize=4096)
+def keyword_set(text: str, min_length: int = 3) -> frozenset:
+    """Множество ключевых слов текста (для overlap/Jaccard), кэшируется."""
+    return frozenset(extract_keywords(text, min_length))
 
 
 def pseudo_relevance_feedback(
@@ -20,6 +20,18 @@ class Settings(BaseSettings):
     qdrant_port: int = 6333
     qdrant_collection: str = "confluence"
     qdrant_api_key: Optional[str] = None
+    # gRPC транспорт вместо HTTP (меньше overhead на маленьких запросах; REST порт остается fallback)
+    qdrant_prefer_grpc: bool = False
+    qdrant_grpc_port: int = 6334
+    # Квантизация векторов при создании коллекции: None, "int8" (scalar), "binary"
+    qdrant_quantization: Optional[str] = None
+    # Поиск по квантованным векторам: пересчет топа по оригиналам и коэффициент oversampling
+    qdrant_quantization_rescore: bool = True
+    qdrant_quantization_oversampling: float = 2.0
+    # HNSW ef на запросе (0 = значение коллекции/сервера)
+    qdrant_hnsw_ef: int = 0
+    # Размер страницы scroll при полной выгрузке коллекции (индекс BM25, сканы)
+    qdrant_scroll_batch_size: int = 1000
     
     # --- Embeddings ---
     # huggingface, ollama, openai, openrouter
@@ -27,7 +39,57 @@ class Settings(BaseSettings):
     # Модель по умолчанию
     embed_model: str = "ai-forever/FRIDA"
     embedding_dimension: int = 1024
-    
+    # Batch size для SentenceTransformer.encode
+    embedding_batch_size: int = 64
+    # Кодировать короткие/длинные тексты раздельными батчами (бакеты по длине)
+    embedding_length_bucketing: bool = False
+    # Точность HuggingFace модели: auto (fp16 на GPU), fp32, fp16, bf16
+    embedding_precision: str = "auto"
+    # Максимальная длина последовательности в токенах (0 = по умолчанию модели)
+    embedding_max_seq_length: int = 256
+    # Backend SentenceTransformer: torch, onnx, openvino (требует sentence-transformers>=3.2)
+    embedding_backend: str = "torch"
+    # Квантизация ONNX модели: None или "int8" (экспортируется один раз и кэшируется)
+    embedding_quantize: Optional[str] = None
+    # Графовые оптимизации ONNX (optimum): None, O1, O2, O3, O4 (O4 = fp16, только GPU)
+    embedding_onnx_optimization: Optional[str] = None
+    embedding_onnx_cache_dir: str = "./data/onnx"
+    # Загрузка весов из safetensors (mmap: page cache общий для всех worker процессов)
+    embedding_use_safetensors: bool = True
+    # torch.compile для forward HuggingFace модели (только backend torch)
+    embedding_torch_compile: bool = False
+    # Прогрев модели при старте сервера (первый запрос без задержки на загрузку)
+    embedding_warmup: bool = True
+    # Автоподбор batch_size по измеренной пропускной способности (HuggingFace)
+    embedding_adaptive_batch: bool = False
+    # Через сколько batch вызовов пересматривать выбранный batch_size
+    embedding_adaptive_batch_interval: int = 20
+    # Сколько encode HuggingFace выполняется одновременно (async путь).
+    # 1 на CPU: один encode получает все ядра без конкуренции intra-op потоков; на GPU можно 2-4
+    embedding_hf_concurrency: int = 1
+    # Intra-op потоки torch для HuggingFace encode (0 = число CPU)
+    embedding_torch_threads: int = 0
+    # LRU кэш embeddings по хэшу текста (0 = отключен)
+    embedding_cache_size: int = 10000
+    # Dynamic batching одиночных запросов (HuggingFace и OpenAI-compatible API)
+    embedding_dynamic_batch: bool = False
+    embedding_dynamic_batch_max_size: int = 64
+    embedding_dynamic_batch_wait_ms: float = 5.0
+
+    # HTTP пул соединений для OpenAI-compatible API (keep-alive)
+    embedding_http_max_connections: int = 64
+    embedding_http_max_keepalive: int = 32
+    embedding_http_keepalive_expiry: float = 60.0
+    embedding_http_timeout: float = 30.0
+    embedding_http_connect_timeout: float = 5.0
+    # Retry batch запросов к API: экспоненциальный backoff, затем деление батча пополам
+    embedding_retry_attempts: int = 5
+    embedding_retry_max_wait: float = 10.0
+    # Максимальный размер батча одного запроса к API (Ollama / LM Studio ограничивают batch)
+    embedding_provider_max_batch: int = 96
+    # Сколько батчей отправляется к API одновременно (async)
+    embedding_api_concurrency: int = 8
+
     # --- Ollama ---
     use_ollama: bool = False
     ollama_url: str = "http://ollama:11434"
@@ -45,12 +107,39 @@ class Settings(BaseSettings):
     enable_mmr: bool = True
     mmr_diversity_weight: float = 0.3
     reranker_model: str = "DiTy/cross-encoder-russian-msmarco"
+    # Batch size CrossEncoder.predict (все кандидаты запроса скорятся одним вызовом)
+    reranker_batch_size: int = 32
+    # Дедупликация почти одинаковых чанков: макс. расстояние Хэмминга SimHash (0 = только точные)
+    dedup_simhash_max_distance: int = 6
     
     # === Hybrid Search Weights ===
     hybrid_vector_weight: float = 0.6
     hybrid_bm25_weight: float = 0.4
     hybrid_rrf_k: int = 60
     bm25_max_docs: int = 50000
+    # BM25 backend: auto (bm25s если установлен), bm25s, rank_bm25, qdrant (sparse векторы на сервере)
+    bm25_backend: str = "auto"
+    # Средняя длина документа в токенах для нормализации sparse BM25 векторов (backend qdrant)
+    bm25_avg_doc_length: float = 256.0
+    bm25_k1: float = 1.5
+    bm25_b: float = 0.75
+    # Токенизация BM25: simple (split), stopwords (без стоп-слов), lemma (+ pymorphy), stem (+ PyStemmer)
+    bm25_analyzer: str = "stopwords"
+    # Хранить TF postings в int16, idf/len_norm в float16 (rank_bm25 backend, меньше памяти)
+    bm25_quantize: bool = False
+    # LRU кэш результатов BM25 по токенам запроса (0 = отключен) и время жизни записи
+    bm25_cache_size: int = 512
+    bm25_cache_ttl: float = 60.0
+    # Потоки выделенного executor для BM25 scoring (async путь)
+    bm25_workers: int = 4
+    # Шардирование scoring одного запроса по ядрам CPU (numba, rank_bm25 backend): 1 = выкл, 0 = число CPU
+    bm25_shards: int = 1
+    # Micro-batching одновременных BM25 запросов в один проход по postings (async путь)
+    bm25_dynamic_batch: bool = False
+    bm25_dynamic_batch_max_size: int = 32
+    bm25_dynamic_batch_wait_ms: float = 5.0
+    # Каталог для BM25 индекса и кэша токенов документов (пусто = не сохранять)
+    bm25_index_dir: str = "./data/bm25"
     
     # Adaptive weights (Navigational)
     hybrid_vector_weight_navigational: float = 0.7
@@ -75,6 +164,9 @@ class Settings(BaseSettings):
     
     # --- Advanced Search ---
     use_ollama_for_query_expansion: bool = False
+    # LRU кэш expand_query по (запрос, space): размер (0 = отключен) и время жизни записи
+    query_expansion_cache_size: int = 2048
+    query_expansion_cache_ttl: float = 600.0
     enable_prf_fallback: bool = True
     
     # --- Observability ---
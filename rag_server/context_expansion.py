@@ -104,19 +104,16 @@ async def _get_page_chunks_async(collection: Any, page_id: str) -> Optional[Dict
         return None
 
 
-def _compute_similarity(emb1: List[float], emb2: List[float]) -> float:
-    """Cosine similarity с fallback."""
-    try:
-        import numpy as np
-        return float(np.dot(emb1, emb2) / (np.linalg.norm(emb1) * np.linalg.norm(emb2)))
-    except ImportError:
-        # Fallback без numpy
-        dot_product = sum(a * b for a, b in zip(emb1, emb2))
-        norm_a = sum(a * a for a in emb1) ** 0.5
-        norm_b = sum(b * b for b in emb2) ** 0.5
-        return dot_product / (norm_a * norm_b) if (norm_a * norm_b) > 0 else 0.0
-    except Exception:
-        return 0.0
+def _compute_similarities(query_emb: List[float], embeddings: Any) -> List[float]:
+    """Cosine similarity запроса со всеми чанками одним матричным умножением."""
+    import numpy as np
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    query = np.asarray(query_emb, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarities = np.where(norms > 0, (matrix @ query) / norms, 0.0)
+    return similarities.tolist()
 
 
 async def _find_similar_chunks_with_embeddings_async(
@@ -145,9 +142,9 @@ async def _find_similar_chunks_with_embeddings_async(
         if not chunk_texts:
             return []
 
-        # Пытаемся получить batch embeddings
+        # Пытаемся получить batch embeddings матрицей (N, D) без списков Python float
         try:
-            chunk_embeddings = await embeddings_model.get_text_embeddings_async(chunk_texts)
+            chunk_embeddings = await embeddings_model.get_text_embeddings_async(chunk_texts, return_numpy=True)
         except Exception:
             # Fallback to sequential
             chunk_embeddings = []
@@ -155,9 +152,10 @@ async def _find_similar_chunks_with_embeddings_async(
                 emb = await embeddings_model.get_query_embedding_async(t)
                 chunk_embeddings.append(emb)
             
-        for idx, embedding in enumerate(chunk_embeddings):
+        similarities = _compute_similarities(current_embedding, chunk_embeddings)
+
+        for idx, similarity in enumerate(similarities):
             original_idx = chunk_indices[idx]
-            similarity = _compute_similarity(current_embedding, embedding)
             
             chunk_meta = page_chunks['metadatas'][original_idx] if original_idx < len(page_chunks['metadatas']) else {}
             
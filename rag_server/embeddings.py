@@ -9,8 +9,15 @@ import threading
 import time
 import asyncio
 import atexit
-from typing import List, Any
-from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+from typing import List, Any, Optional, Tuple, Callable, Iterator, AsyncIterator, Union
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+
+import httpx
+import numpy as np
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
 
 # Отключаем избыточное логирование
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -23,12 +30,22 @@ logger = logging.getLogger(__name__)
 # Конфигурация из Pydantic
 from rag_server.config import settings
 
+try:
+    from utils.micro_batcher import MicroBatcher
+except ImportError:
+    from rag_server.utils.micro_batcher import MicroBatcher
+
 # Thread-safe кэширование
 _model_lock = threading.Lock()
 _embed_model = None
 
-# Executor для синхронных операций (HuggingFace)
-_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+# Executor для синхронных операций (HuggingFace).
+# Размер ограничивает число одновременных encode: параллельные encode на CPU
+# делят одни и те же ядра и замедляют друг друга переключением потоков.
+_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.embedding_hf_concurrency),
+    thread_name_prefix="embedding-hf"
+)
 
 def _shutdown_executor():
     """Graceful shutdown for executor."""
@@ -38,18 +55,380 @@ def _shutdown_executor():
 
 atexit.register(_shutdown_executor)
 
+# Бакеты по длине текста (символы) -> множитель batch_size.
+# Короткие тексты кодируются большими батчами: padding внутри батча минимален.
+_LENGTH_BUCKETS = ((128, 4), (256, 2), (512, 1))
+
+# Источник фиксируется при загрузке модуля: тяжелые SDK импортируются один раз
+# и только для выбранного backend, а не внутри фабрики на каждом вызове.
+_SOURCE = settings.embedding_source
+# Источники, работающие через OpenAI-compatible API
+_API_SOURCES = ('openai', 'openrouter', 'ollama')
+
+OpenAI = AsyncOpenAI = SentenceTransformer = None
+# Транзиентные ошибки API, которые имеет смысл повторять
+_RETRYABLE_ERRORS: tuple = ()
+# Транспортные ошибки, оставшиеся после retry, при которых батч имеет смысл делить
+# (большой батч не успевает обработаться за timeout). RateLimit делением не лечится
+_SPLITTABLE_TRANSPORT_ERRORS: tuple = ()
+if _SOURCE in _API_SOURCES:
+    try:
+        from openai import OpenAI, AsyncOpenAI, APITimeoutError, APIConnectionError, RateLimitError
+        _RETRYABLE_ERRORS = (APITimeoutError, APIConnectionError, RateLimitError)
+        _SPLITTABLE_TRANSPORT_ERRORS = (APITimeoutError, APIConnectionError)
+    except ImportError:
+        logger.warning("openai not installed, OpenAI-compatible embeddings unavailable")
+elif _SOURCE == 'huggingface':
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.warning("sentence-transformers not installed, HuggingFace embeddings unavailable")
+
+# Метрики (модуль observability доступен, когда rag_server в sys.path)
+try:
+    from observability import (
+        EMBEDDING_BATCH_SIZE,
+        EMBEDDING_BATCH_LATENCY,
+        EMBEDDING_QUEUE_DEPTH,
+        EMBEDDING_CACHE_HITS
+    )
+except ImportError:
+    EMBEDDING_CACHE_HITS = None
+    EMBEDDING_BATCH_SIZE = None
+    EMBEDDING_BATCH_LATENCY = None
+    EMBEDDING_QUEUE_DEPTH = None
+
+
+def _observe_cache_hits(hits: int) -> None:
+    if EMBEDDING_CACHE_HITS and hits:
+        EMBEDDING_CACHE_HITS.inc(hits)
+
+
+def _observe_batch(size: int, elapsed: float) -> None:
+    """Записывает размер и длительность одного batch вызова."""
+    if EMBEDDING_BATCH_SIZE:
+        EMBEDDING_BATCH_SIZE.observe(size)
+    if EMBEDDING_BATCH_LATENCY:
+        EMBEDDING_BATCH_LATENCY.observe(elapsed)
+
+
+# Переводы строк и табуляции заменяются пробелами одним C-проходом str.translate
+_NL_TABLE = str.maketrans({"\n": " ", "\r": " ", "\t": " "})
+
+
+def _clean_text(text: str) -> str:
+    """Подготовка одного текста для API (без копирования, если заменять нечего)."""
+    if "\n" in text or "\r" in text or "\t" in text:
+        return text.translate(_NL_TABLE)
+    return text
+
+
+def _clean_texts(texts: List[str]) -> List[str]:
+    """Подготовка текстов для API: translate только для строк с переводами строк."""
+    return [
+        t.translate(_NL_TABLE) if ("\n" in t or "\r" in t or "\t" in t) else t
+        for t in texts
+    ]
+
+
+# HTTP/2 доступен только при установленном пакете h2
+try:
+    import h2  # noqa: F401
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+# Сжатие ответов: br и zstd httpx декодирует только при установленных brotli / zstandard
+_ACCEPT_ENCODING = ["gzip", "deflate"]
+try:
+    import brotli  # noqa: F401
+    _ACCEPT_ENCODING.append("br")
+except ImportError:
+    pass
+try:
+    import zstandard  # noqa: F401
+    _ACCEPT_ENCODING.append("zstd")
+except ImportError:
+    pass
+
+
+_backoff = wait_random_exponential(multiplier=1, max=settings.embedding_retry_max_wait)
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Пауза перед повтором: Retry-After из ответа 429, иначе backoff с jitter."""
+    exc = retry_state.outcome.exception()
+    response = getattr(exc, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return _backoff(retry_state)
+
+
+# Признаки ошибок, зависящих от размера батча (413, лимит контекста/payload провайдера)
+_BATCH_SIZE_ERROR_MARKERS = (
+    'too large', 'too long', 'too many tokens', 'context length',
+    'maximum context', 'batch size'
+)
+
+
+def _is_batch_size_error(exc: Exception) -> bool:
+    """Ошибку API можно обойти делением батча (остальные - auth, модель, баги - нет)."""
+    if _SPLITTABLE_TRANSPORT_ERRORS and isinstance(exc, _SPLITTABLE_TRANSPORT_ERRORS):
+        return True
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status == 413:
+        return True
+    message = str(exc).lower()
+    return any(marker in message for marker in _BATCH_SIZE_ERROR_MARKERS)
+
+
+def _is_oom_error(exc: Exception) -> bool:
+    """Нехватка памяти при encode (torch.cuda.OutOfMemoryError или RuntimeError "out of memory")."""
+    if isinstance(exc, MemoryError) or type(exc).__name__ == 'OutOfMemoryError':
+        return True
+    return isinstance(exc, RuntimeError) and 'out of memory' in str(exc).lower()
+
+
+# Повтор одного запроса embeddings.create (работает и для sync, и для async методов)
+_api_retry = retry(
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(settings.embedding_retry_attempts),
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+    reraise=True
+)
+
+
+def _build_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Создает httpx клиенты с постоянным пулом соединений (keep-alive).
+
+    Без этого каждый запрос к embedding API может платить за TCP+TLS handshake.
+    """
+    limits = httpx.Limits(
+        max_connections=settings.embedding_http_max_connections,
+        max_keepalive_connections=settings.embedding_http_max_keepalive,
+        keepalive_expiry=settings.embedding_http_keepalive_expiry
+    )
+    timeout = httpx.Timeout(
+        settings.embedding_http_timeout,
+        connect=settings.embedding_http_connect_timeout
+    )
+    # Batch ответ (N x D float в JSON) хорошо сжимается
+    headers = {"Accept-Encoding": ", ".join(_ACCEPT_ENCODING)}
+
+    http_client = httpx.Client(limits=limits, timeout=timeout, http2=HAS_HTTP2, headers=headers)
+    async_http_client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=HAS_HTTP2, headers=headers)
+    return http_client, async_http_client
+
+
+class _EmbeddingCache:
+    """
+    Thread-safe LRU кэш embeddings.
+
+    Ключ - 16-байтный blake2b хэш текста: память не зависит от длины текстов.
+    Возвращаемые списки общие для всех вызывающих и не должны изменяться.
+    """
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._data: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[List[float]]:
+        with self._lock:
+            embedding = self._data.get(key)
+            if embedding is not None:
+                self._data.move_to_end(key)
+            return embedding
+
+    def put(self, key: bytes, embedding: List[float]) -> None:
+        with self._lock:
+            self._data[key] = embedding
+            self._data.move_to_end(key)
+            if len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+
+class _BatchSizeTuner:
+    """
+    Подбор batch_size по измеренной пропускной способности.
+
+    Для каждого кандидата (batch_size / 2, batch_size, batch_size * 2) хранится
+    EWMA символов в секунду (приближение токенов/сек). Сначала каждый кандидат
+    измеряется, затем используется лучший; каждые interval вызовов оценки
+    остальных кандидатов сбрасываются и они измеряются заново.
+    """
+
+    def __init__(self, base_batch_size: int, interval: int, alpha: float = 0.3):
+        self.candidates = tuple(sorted({max(1, base_batch_size // 2), base_batch_size, base_batch_size * 2}))
+        self._interval = max(1, interval)
+        self._alpha = alpha
+        self._scores: dict = {}
+        self._best = base_batch_size
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        """batch_size для следующего вызова."""
+        with self._lock:
+            for candidate in self.candidates:
+                if candidate not in self._scores:
+                    return candidate
+            return self._best
+
+    def record(self, batch_size: int, n_chars: int, elapsed: float) -> None:
+        """Учитывает результат вызова encode с данным batch_size."""
+        if elapsed <= 0:
+            return
+        throughput = n_chars / elapsed
+        with self._lock:
+            previous = self._scores.get(batch_size)
+            self._scores[batch_size] = (
+                throughput if previous is None
+                else self._alpha * throughput + (1 - self._alpha) * previous
+            )
+            self._calls += 1
+            if self._calls % self._interval == 0:
+                self._best = max(self._scores, key=self._scores.get)
+                # Повторно измеряем остальных кандидатов: оптимум зависит от нагрузки
+                self._scores = {self._best: self._scores[self._best]}
+
+
+class _EmbeddingBatcher(MicroBatcher):
+    """
+    Dynamic micro-batching для одиночных запросов.
+
+    Запросы, пришедшие одновременно из разных обработчиков, собираются в
+    окне max_wait_ms (до max_batch штук) и кодируются одним вызовом encode.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch: int, max_wait_ms: float):
+        super().__init__(encode_fn, max_batch, max_wait_ms, name="embedding-batcher")
+
+    def submit(self, text: str) -> Future:
+        """Ставит текст в очередь, во Future придет строка результата encode_fn."""
+        future = super().submit(text)
+        if EMBEDDING_QUEUE_DEPTH:
+            EMBEDDING_QUEUE_DEPTH.set(self.qsize())
+        return future
+
 
 class UnifiedEmbeddingModel:
     """
     Унифицированный класс для работы с различными моделями embeddings.
     Заменяет LlamaIndex BaseEmbedding.
     """
-    def __init__(self, source: str, model_name: str, dimension: int, client: Any = None, async_client: Any = None):
+    def __init__(
+        self,
+        source: str,
+        model_name: str,
+        dimension: int,
+        client: Any = None,
+        async_client: Any = None,
+        http_client: Optional[httpx.Client] = None,
+        async_http_client: Optional[httpx.AsyncClient] = None
+    ):
         self.source = source
         self.model_name = model_name
         self._dimension = dimension
+        # Нулевой вектор для пустого ввода (строится один раз, только для чтения)
+        self._zero_vec = [0.0] * dimension
         self.client = client
         self.async_client = async_client
+        # HTTP клиенты храним для закрытия пула при shutdown
+        self.http_client = http_client
+        self.async_http_client = async_http_client
+
+        self._cache = _EmbeddingCache(settings.embedding_cache_size) if settings.embedding_cache_size > 0 else None
+
+        self._tuner = None
+        if source == 'huggingface' and settings.embedding_adaptive_batch:
+            self._tuner = _BatchSizeTuner(
+                settings.embedding_batch_size,
+                settings.embedding_adaptive_batch_interval
+            )
+
+        # Реализация выбирается один раз по источнику, без ветвления на каждом вызове
+        if source in _API_SOURCES:
+            self._compute_embedding = self._compute_embedding_api
+            self._compute_embedding_async = self._compute_embedding_api_async
+            self._compute_text_embeddings = self._compute_text_embeddings_api
+            self._compute_text_embeddings_async = self._compute_text_embeddings_api_async
+        elif source == 'huggingface':
+            self._compute_embedding = self._compute_embedding_hf
+            self._compute_embedding_async = self._compute_embedding_hf_async
+            self._compute_text_embeddings = self._compute_text_embeddings_hf
+            self._compute_text_embeddings_async = self._compute_text_embeddings_hf_async
+
+        # Dynamic batching выгоден только под конкурентной нагрузкой:
+        # одиночные запросы объединяются в один encode / embeddings.create
+        self._batcher = None
+        if settings.embedding_dynamic_batch:
+            max_batch = settings.embedding_dynamic_batch_max_size
+            if source == 'huggingface':
+                encode_fn = lambda texts: self._encode_batch(texts, len(texts))
+            else:
+                max_batch = min(max_batch, settings.embedding_provider_max_batch)
+                encode_fn = lambda texts: self._embed_with_split(_clean_texts(texts))
+            self._batcher = _EmbeddingBatcher(
+                encode_fn,
+                max_batch=max_batch,
+                max_wait_ms=settings.embedding_dynamic_batch_wait_ms
+            )
+
+    def _close_http_client(self) -> None:
+        if self.http_client is not None:
+            try:
+                self.http_client.close()
+            except Exception as e:
+                logger.debug(f"Error closing HTTP client: {e}")
+            self.http_client = None
+
+    async def aclose(self) -> None:
+        """Закрывает HTTP пулы соединений из async shutdown (внутри event loop)."""
+        self._close_http_client()
+
+        if self.async_http_client is not None:
+            client, self.async_http_client = self.async_http_client, None
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.debug(f"Error closing async HTTP client: {e}")
+
+    def close(self) -> None:
+        """
+        Закрывает HTTP пулы соединений из синхронного shutdown (atexit).
+
+        Внутри работающего event loop async пул закрыть нельзя: используйте
+        await aclose() (так делает lifespan сервера).
+        """
+        if self.async_http_client is not None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                logger.warning("close() вызван внутри event loop: async HTTP пул не закрыт, используйте await aclose()")
+                self._close_http_client()
+                return
+            try:
+                asyncio.run(self.async_http_client.aclose())
+            except Exception as e:
+                logger.debug(f"Error closing async HTTP client: {e}")
+            self.async_http_client = None
+
+        self._close_http_client()
 
     def get_query_embedding(self, query: str) -> List[float]:
         """Генерация embedding для запроса."""
@@ -68,146 +447,391 @@ class UnifiedEmbeddingModel:
         return await self._generate_embedding_async(text)
 
     def _generate_embedding(self, text: str) -> List[float]:
-        """Внутренний метод генерации."""
+        """Внутренний метод генерации (через LRU кэш)."""
         if not text:
-            return [0.0] * self._dimension
+            return self._zero_vec
 
         try:
-            if self.source in ('openai', 'openrouter', 'ollama'):
-                # Используем OpenAI client
-                text = text.replace("\n", " ")
-                response = self.client.embeddings.create(
-                    model=self.model_name,
-                    input=[text]
-                )
-                return response.data[0].embedding
-
-            elif self.source == 'huggingface':
-                # Используем SentenceTransformer
-                embedding = self.client.encode(text, normalize_embeddings=False)
-                return embedding.tolist()
-
-            else:
-                raise ValueError(f"Unknown source: {self.source}")
+            if self._cache is None:
+                return self._compute_embedding(text)
+
+            key = self._cache.key(text)
+            embedding = self._cache.get(key)
+            if embedding is not None:
+                _observe_cache_hits(1)
+                return embedding
+            embedding = self._compute_embedding(text)
+            self._cache.put(key, embedding)
+            return embedding
 
         except Exception as e:
             logger.error(f"Error generating embedding ({self.source}): {e}")
             raise e
 
     async def _generate_embedding_async(self, text: str) -> List[float]:
-        """Внутренний асинхронный метод генерации."""
+        """Внутренний асинхронный метод генерации (через LRU кэш)."""
         if not text:
-            return [0.0] * self._dimension
+            return self._zero_vec
 
         try:
-            if self.source in ('openai', 'openrouter', 'ollama'):
-                # Используем AsyncOpenAI client
-                text = text.replace("\n", " ")
-                if self.async_client:
-                    response = await self.async_client.embeddings.create(
-                        model=self.model_name,
-                        input=[text]
-                    )
-                    return response.data[0].embedding
-                else:
-                    # Fallback to sync in thread
-                    logger.warning("Async client not available for OpenAI, falling back to sync")
-                    try:
-                        loop = asyncio.get_running_loop()
-                    except RuntimeError:
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                    return await loop.run_in_executor(None, self._generate_embedding, text)
-
-            elif self.source == 'huggingface':
-                # SentenceTransformer is sync, run in executor
-                try:
-                    loop = asyncio.get_running_loop()
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                return await loop.run_in_executor(_executor, self._generate_embedding, text)
-
-            else:
-                raise ValueError(f"Unknown source: {self.source}")
+            if self._cache is None:
+                return await self._compute_embedding_async(text)
+
+            key = self._cache.key(text)
+            embedding = self._cache.get(key)
+            if embedding is not None:
+                _observe_cache_hits(1)
+                return embedding
+            embedding = await self._compute_embedding_async(text)
+            self._cache.put(key, embedding)
+            return embedding
 
         except Exception as e:
             logger.error(f"Error generating async embedding ({self.source}): {e}")
             raise e
 
-    def get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Batch генерация embeddings."""
+    # Реализации без кэша. В __init__ атрибуты _compute_* привязываются к
+    # вариантам _api / _hf; методы класса срабатывают только для неизвестного источника.
+
+    def _compute_embedding(self, text: str) -> List[float]:
+        raise ValueError(f"Unknown source: {self.source}")
+
+    async def _compute_embedding_async(self, text: str) -> List[float]:
+        raise ValueError(f"Unknown source: {self.source}")
+
+    def _compute_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        raise ValueError(f"Unknown source: {self.source}")
+
+    async def _compute_text_embeddings_async(self, texts: List[str]) -> List[List[float]]:
+        raise ValueError(f"Unknown source: {self.source}")
+
+    def _compute_embedding_api(self, text: str) -> List[float]:
+        """OpenAI-compatible API: один текст."""
+        if self._batcher is not None:
+            return self._batcher.submit(text).result()
+        return self._create_embeddings([_clean_text(text)])[0]
+
+    async def _compute_embedding_api_async(self, text: str) -> List[float]:
+        """OpenAI-compatible API: один текст (async)."""
+        if self._batcher is not None:
+            return await asyncio.wrap_future(self._batcher.submit(text))
+        if self.async_client:
+            return (await self._create_embeddings_async([_clean_text(text)]))[0]
+        # Fallback to sync in thread
+        logger.warning("Async client not available for OpenAI, falling back to sync")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._compute_embedding_api, text)
+
+    def _compute_embedding_hf(self, text: str) -> List[float]:
+        """SentenceTransformer: один текст."""
+        if self._batcher is not None:
+            return self._batcher.submit(text).result().tolist()
+        embedding = self.client.encode(text, normalize_embeddings=False, convert_to_numpy=True)
+        return embedding.astype(np.float32, copy=False).tolist()
+
+    async def _compute_embedding_hf_async(self, text: str) -> List[float]:
+        """SentenceTransformer: один текст (async)."""
+        if self._batcher is not None:
+            # Ожидаем Future батчера без занятия потока executor
+            embedding = await asyncio.wrap_future(self._batcher.submit(text))
+            return embedding.tolist()
+        # SentenceTransformer is sync, run in executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, self._compute_embedding_hf, text)
+
+    def get_text_embeddings(
+        self,
+        texts: List[str],
+        return_numpy: bool = False
+    ) -> Union[List[List[float]], np.ndarray]:
+        """
+        Batch генерация embeddings.
+
+        return_numpy=True возвращает матрицу float32 (N, D) без построения списков
+        Python float (см. get_text_embeddings_array).
+        """
+        if return_numpy:
+            return self.get_text_embeddings_array(texts)
         if not texts:
             return []
 
         try:
-            if self.source in ('openai', 'openrouter', 'ollama'):
-                # OpenAI поддерживает batch
-                cleaned_texts = [t.replace("\n", " ") for t in texts]
-                response = self.client.embeddings.create(
-                    model=self.model_name,
-                    input=cleaned_texts
-                )
-                # Гарантируем порядок
-                return [item.embedding for item in response.data]
-
-            elif self.source == 'huggingface':
-                # SentenceTransformer поддерживает batch
-                embeddings = self.client.encode(texts, normalize_embeddings=False)
-                return [emb.tolist() for emb in embeddings]
+            if self._cache is None:
+                return self._compute_text_embeddings(texts)
 
-            else:
-                return [self._generate_embedding(t) for t in texts]
+            # Кодируем только тексты, которых нет в кэше, и раскладываем по исходным позициям
+            results, missing, keys = self._lookup_cached(texts)
+            if missing:
+                computed = self._compute_text_embeddings([texts[i] for i in missing])
+                self._store_cached(results, missing, keys, computed)
+            return results
 
         except Exception as e:
+            # Упавшие части уже повторены в _embed_with_split / _encode_with_split
             logger.error(f"Error generating batch embeddings: {e}")
-            # Fallback to sequential
-            return [self._generate_embedding(t) for t in texts]
-
-    async def get_text_embeddings_async(self, texts: List[str]) -> List[List[float]]:
-        """Batch асинхронная генерация embeddings."""
+            raise
+
+    def _lookup_cached(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[int], List[bytes]]:
+        """Результаты из кэша (None для промахов), индексы промахов и ключи."""
+        keys = [self._cache.key(t) for t in texts]
+        results = [self._cache.get(k) for k in keys]
+        missing = [i for i, emb in enumerate(results) if emb is None]
+        _observe_cache_hits(len(texts) - len(missing))
+        return results, missing, keys
+
+    def _store_cached(
+        self,
+        results: List[Optional[List[float]]],
+        missing: List[int],
+        keys: List[bytes],
+        computed: List[List[float]]
+    ) -> None:
+        for i, embedding in zip(missing, computed):
+            self._cache.put(keys[i], embedding)
+            results[i] = embedding
+
+    def _compute_text_embeddings_api(self, texts: List[str]) -> List[List[float]]:
+        """OpenAI-compatible API: batch."""
+        cleaned_texts = _clean_texts(texts)
+        # Провайдеры ограничивают размер батча: режем на части
+        max_batch = settings.embedding_provider_max_batch
+        embeddings = []
+        for start in range(0, len(cleaned_texts), max_batch):
+            embeddings.extend(self._embed_with_split(cleaned_texts[start:start + max_batch]))
+        return embeddings
+
+    async def _compute_text_embeddings_api_async(self, texts: List[str]) -> List[List[float]]:
+        """OpenAI-compatible API: batch (async)."""
+        if self.async_client:
+            return await self._embed_chunks_async(_clean_texts(texts))
+        # Sync client в default executor: _executor ограничен под HuggingFace encode
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._compute_text_embeddings_api, texts)
+
+    def _compute_text_embeddings_hf(self, texts: List[str]) -> List[List[float]]:
+        """SentenceTransformer: batch; tolist() одним вызовом на всю матрицу."""
+        return self._encode_with_split(texts).tolist()
+
+    async def _compute_text_embeddings_hf_async(self, texts: List[str]) -> List[List[float]]:
+        """SentenceTransformer: batch (async). CPU-bound, выполняется в executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, self._compute_text_embeddings_hf, texts)
+
+    def get_text_embeddings_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Batch генерация embeddings в виде матрицы float32 формы (N, D).
+
+        Для HuggingFace encode вызывается только для промахов LRU кэша; без кэша
+        результат encode возвращается как есть, без конвертации в списки Python float.
+        """
+        if not texts:
+            return np.empty((0, self._dimension), dtype=np.float32)
+
+        if self.source == 'huggingface':
+            if self._cache is None:
+                return self._encode_with_split(texts)
+            results, missing, keys = self._lookup_cached(texts)
+            if missing:
+                computed = self._encode_with_split([texts[i] for i in missing])
+                self._store_cached(results, missing, keys, computed.tolist())
+            return np.asarray(results, dtype=np.float32)
+
+        return np.asarray(self.get_text_embeddings(texts), dtype=np.float32)
+
+    @_api_retry
+    def _create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Один запрос embeddings.create с retry транзиентных ошибок."""
+        start = time.perf_counter()
+        response = self.client.embeddings.create(
+            model=self.model_name,
+            input=texts
+        )
+        _observe_batch(len(texts), time.perf_counter() - start)
+        # Гарантируем порядок
+        return [item.embedding for item in response.data]
+
+    @_api_retry
+    async def _create_embeddings_async(self, texts: List[str]) -> List[List[float]]:
+        """Асинхронный запрос embeddings.create с retry транзиентных ошибок."""
+        start = time.perf_counter()
+        response = await self.async_client.embeddings.create(
+            model=self.model_name,
+            input=texts
+        )
+        _observe_batch(len(texts), time.perf_counter() - start)
+        return [item.embedding for item in response.data]
+
+    def _embed_with_split(self, texts: List[str]) -> List[List[float]]:
+        """
+        Batch запрос к API. Если батч не удался и после retry из-за своего размера
+        (413, лимит контекста, timeout), он делится пополам и повторяются только
+        упавшие половины. Остальные ошибки пробрасываются сразу.
+        """
+        try:
+            return self._create_embeddings(texts)
+        except Exception as e:
+            if len(texts) == 1 or not _is_batch_size_error(e):
+                raise
+            logger.warning(f"Embedding batch of {len(texts)} failed, splitting: {e}")
+            mid = len(texts) // 2
+            return self._embed_with_split(texts[:mid]) + self._embed_with_split(texts[mid:])
+
+    async def _embed_chunks_async(self, texts: List[str]) -> List[List[float]]:
+        """
+        Делит тексты на батчи по embedding_provider_max_batch и отправляет их
+        конкурентно, не более embedding_api_concurrency запросов одновременно.
+        """
+        max_batch = settings.embedding_provider_max_batch
+        if len(texts) <= max_batch:
+            return await self._embed_with_split_async(texts)
+
+        semaphore = asyncio.Semaphore(settings.embedding_api_concurrency)
+
+        async def embed_chunk(chunk: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._embed_with_split_async(chunk)
+
+        chunks = await asyncio.gather(*(
+            embed_chunk(texts[start:start + max_batch])
+            for start in range(0, len(texts), max_batch)
+        ))
+        return [emb for chunk in chunks for emb in chunk]
+
+    async def _embed_with_split_async(self, texts: List[str]) -> List[List[float]]:
+        """Асинхронный вариант _embed_with_split: половины повторяются конкурентно."""
+        try:
+            return await self._create_embeddings_async(texts)
+        except Exception as e:
+            if len(texts) == 1 or not _is_batch_size_error(e):
+                raise
+            logger.warning(f"Embedding batch of {len(texts)} failed, splitting: {e}")
+            mid = len(texts) // 2
+            left, right = await asyncio.gather(
+                self._embed_with_split_async(texts[:mid]),
+                self._embed_with_split_async(texts[mid:])
+            )
+            return left + right
+
+    def _encode_with_split(self, texts: List[str]) -> np.ndarray:
+        """
+        HuggingFace batch encode. При нехватке памяти (GPU OOM) батч делится
+        пополам вместо перехода на кодирование по одному тексту.
+        Остальные ошибки пробрасываются сразу.
+        """
+        try:
+            return self._encode_sorted_by_length(texts)
+        except Exception as e:
+            if len(texts) == 1 or not _is_oom_error(e):
+                raise
+            logger.warning(f"Encoding batch of {len(texts)} failed, splitting: {e}")
+            mid = len(texts) // 2
+            return np.concatenate([
+                self._encode_with_split(texts[:mid]),
+                self._encode_with_split(texts[mid:])
+            ])
+
+    def _encode_batch(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Один вызов SentenceTransformer.encode."""
+        start = time.perf_counter()
+        embeddings = self.client.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=False,
+            show_progress_bar=False
+        )
+        _observe_batch(len(texts), time.perf_counter() - start)
+        # Модель может работать в fp16/bf16, наружу отдаем float32
+        return embeddings.astype(np.float32, copy=False)
+
+    def _encode_sorted_by_length(self, texts: List[str]) -> np.ndarray:
+        """
+        Кодирует тексты, предварительно отсортировав их по длине.
+
+        Соседние тексты в батче близки по длине, поэтому padding до самого
+        длинного текста батча почти не тратит вычислений. Порядок результата
+        совпадает с порядком texts.
+        """
+        lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+        order = np.argsort(lengths, kind='stable')
+        sorted_lengths = lengths[order]
+        sorted_texts = [texts[i] for i in order]
+        batch_size = self._tuner.current() if self._tuner else settings.embedding_batch_size
+        started = time.perf_counter()
+
+        if settings.embedding_length_bucketing:
+            parts = []
+            start = 0
+            for max_len, multiplier in _LENGTH_BUCKETS:
+                # Границы бакетов бинарным поиском по отсортированным длинам
+                end = int(np.searchsorted(sorted_lengths, max_len, side='right'))
+                if end > start:
+                    parts.append(self._encode_batch(sorted_texts[start:end], batch_size * multiplier))
+                    start = end
+            if start < len(sorted_texts):
+                parts.append(self._encode_batch(sorted_texts[start:], batch_size))
+            sorted_embeddings = np.concatenate(parts)
+        else:
+            sorted_embeddings = self._encode_batch(sorted_texts, batch_size)
+
+        if self._tuner:
+            self._tuner.record(batch_size, int(lengths.sum()), time.perf_counter() - started)
+
+        # Обратная перестановка: возвращаем исходный порядок
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+    async def get_text_embeddings_async(
+        self,
+        texts: List[str],
+        return_numpy: bool = False
+    ) -> Union[List[List[float]], np.ndarray]:
+        """Batch асинхронная генерация embeddings (return_numpy - как в get_text_embeddings)."""
+        if return_numpy:
+            return await self.get_text_embeddings_array_async(texts)
         if not texts:
             return []
 
         try:
-            if self.source in ('openai', 'openrouter', 'ollama'):
-                # OpenAI поддерживает batch
-                cleaned_texts = [t.replace("\n", " ") for t in texts]
-                if self.async_client:
-                    response = await self.async_client.embeddings.create(
-                        model=self.model_name,
-                        input=cleaned_texts
-                    )
-                    return [item.embedding for item in response.data]
-                else:
-                     try:
-                         loop = asyncio.get_running_loop()
-                     except RuntimeError:
-                         loop = asyncio.new_event_loop()
-                         asyncio.set_event_loop(loop)
-                     return await loop.run_in_executor(None, self.get_text_embeddings, texts)
-
-            elif self.source == 'huggingface':
-                # SentenceTransformer supports batch but is CPU bound
-                try:
-                    loop = asyncio.get_running_loop()
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                # Используем executor для CPU-bound задачи
-                return await loop.run_in_executor(_executor, self.get_text_embeddings, texts)
+            if self._cache is None:
+                return await self._compute_text_embeddings_async(texts)
 
-            else:
-                # Fallback
-                results = []
-                for t in texts:
-                    results.append(await self._generate_embedding_async(t))
-                return results
+            results, missing, keys = self._lookup_cached(texts)
+            if missing:
+                computed = await self._compute_text_embeddings_async([texts[i] for i in missing])
+                self._store_cached(results, missing, keys, computed)
+            return results
 
         except Exception as e:
             logger.error(f"Error generating async batch embeddings: {e}")
-            return [await self._generate_embedding_async(t) for t in texts]
+            raise
+
+    async def get_text_embeddings_array_async(self, texts: List[str]) -> np.ndarray:
+        """Асинхронный вариант get_text_embeddings_array."""
+        if self.source == 'huggingface':
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_executor, self.get_text_embeddings_array, texts)
+
+        if not texts:
+            return np.empty((0, self._dimension), dtype=np.float32)
+        return np.asarray(await self.get_text_embeddings_async(texts), dtype=np.float32)
+
+    def get_text_embeddings_iter(self, texts: List[str], chunk: int = 256) -> Iterator[List[float]]:
+        """
+        Потоковая batch генерация: embeddings отдаются по частям из chunk текстов.
+
+        Пиковая память O(chunk x D) вместо O(N x D); потребитель (запись в Qdrant)
+        может писать уже готовые части, пока считаются следующие.
+        """
+        for start in range(0, len(texts), chunk):
+            yield from self.get_text_embeddings(texts[start:start + chunk])
 
+    async def get_text_embeddings_aiter(self, texts: List[str], chunk: int = 256) -> AsyncIterator[List[float]]:
+        """Асинхронный вариант get_text_embeddings_iter."""
+        for start in range(0, len(texts), chunk):
+            for embedding in await self.get_text_embeddings_async(texts[start:start + chunk]):
+                yield embedding
 
     def get_embedding_dimension(self) -> int:
         return self._dimension
@@ -218,8 +842,8 @@ class UnifiedEmbeddingModel:
 
 
 def _determine_source() -> str:
-    """Определяет источник embedding."""
-    return settings.embedding_source
+    """Определяет источник embedding (кэшируется при загрузке модуля)."""
+    return _SOURCE
 
 
 def _init_openai_embedding(
@@ -235,13 +859,15 @@ def _init_openai_embedding(
             "Set it in .env or environment variables."
         )
 
-    from openai import OpenAI, AsyncOpenAI
+    if OpenAI is None:
+        raise ImportError("openai not installed. Install: pip install openai")
 
     if api_base and not api_base.endswith('/v1'):
         api_base = f"{api_base}/v1"
 
-    client = OpenAI(base_url=api_base, api_key=api_key)
-    async_client = AsyncOpenAI(base_url=api_base, api_key=api_key)
+    http_client, async_http_client = _build_http_clients()
+    client = OpenAI(base_url=api_base, api_key=api_key, http_client=http_client)
+    async_client = AsyncOpenAI(base_url=api_base, api_key=api_key, http_client=async_http_client)
 
     logger.info(f"Testing connection to {api_base} with model {model_name}...")
     try:
@@ -251,7 +877,10 @@ def _init_openai_embedding(
         logger.warning(f"Failed to test connection, using default dimension 1536: {e}")
         dim = 1536  # Fallback default
 
-    return UnifiedEmbeddingModel('openai', model_name, dim, client, async_client)
+    return UnifiedEmbeddingModel(
+        'openai', model_name, dim, client, async_client,
+        http_client=http_client, async_http_client=async_http_client
+    )
 
 
 def _init_ollama_embedding(
@@ -259,13 +888,15 @@ def _init_ollama_embedding(
     model_name: str
 ) -> UnifiedEmbeddingModel:
     """Инициализация Ollama embedding."""
-    from openai import OpenAI, AsyncOpenAI
+    if OpenAI is None:
+        raise ImportError("openai not installed. Install: pip install openai")
 
     if not api_base.endswith('/v1'):
         api_base = f"{api_base}/v1"
 
-    client = OpenAI(base_url=api_base, api_key="ollama")
-    async_client = AsyncOpenAI(base_url=api_base, api_key="ollama")
+    http_client, async_http_client = _build_http_clients()
+    client = OpenAI(base_url=api_base, api_key="ollama", http_client=http_client)
+    async_client = AsyncOpenAI(base_url=api_base, api_key="ollama", http_client=async_http_client)
 
     logger.info(f"Testing Ollama at {api_base} with model {model_name}...")
     try:
@@ -275,30 +906,189 @@ def _init_ollama_embedding(
         logger.warning(f"Failed to test Ollama connection, using default dimension 1024: {e}")
         dim = 1024  # Fallback default
 
-    return UnifiedEmbeddingModel('ollama', model_name, dim, client, async_client)
+    return UnifiedEmbeddingModel(
+        'ollama', model_name, dim, client, async_client,
+        http_client=http_client, async_http_client=async_http_client
+    )
+
+
+def _apply_hf_precision(client: Any) -> Any:
+    """
+    Переводит SentenceTransformer в half precision.
+
+    auto: float16 на CUDA, float32 на CPU (bf16 на CPU быстрее только при
+    наличии bf16 инструкций, поэтому включается явно через bf16).
+    """
+    import torch
+
+    precision = settings.embedding_precision.lower()
+    if precision == 'auto':
+        precision = 'fp16' if torch.cuda.is_available() else 'fp32'
+
+    try:
+        if precision == 'fp16':
+            if not torch.cuda.is_available():
+                logger.warning("fp16 embeddings require CUDA, keeping float32")
+                return client
+            client = client.half().to("cuda")
+        elif precision == 'bf16':
+            client = client.to(dtype=torch.bfloat16)
+        elif precision != 'fp32':
+            logger.warning(f"Unknown embedding precision '{precision}', keeping float32")
+            return client
+    except Exception as e:
+        logger.warning(f"Failed to switch embedding model to {precision}: {e}")
+        return client
+
+    logger.info(f"HuggingFace model precision: {precision}")
+    return client
+
+
+# Имя файла, который создает export_dynamic_quantized_onnx_model(..., "avx512_vnni", ...)
+_ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+def _onnx_cache_path(model_name: str) -> str:
+    """Каталог кэша экспортированных ONNX артефактов модели."""
+    return os.path.join(settings.embedding_onnx_cache_dir, model_name.replace('/', '__'))
+
+
+def _load_quantized_onnx(model_name: str) -> Any:
+    """
+    Загружает int8 ONNX модель, при первом запуске экспортирует ее на диск.
+
+    Последующие запуски читают готовый артефакт из кэша без повторного экспорта.
+    """
+    save_dir = _onnx_cache_path(model_name)
+    if not os.path.exists(os.path.join(save_dir, _ONNX_INT8_FILE)):
+        from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+        logger.info(f"Exporting int8 ONNX model to {save_dir} (one-time)...")
+        model = SentenceTransformer(model_name, backend='onnx')
+        model.save_pretrained(save_dir)
+        export_dynamic_quantized_onnx_model(model, "avx512_vnni", save_dir)
+
+    return SentenceTransformer(save_dir, backend='onnx', model_kwargs={"file_name": _ONNX_INT8_FILE})
+
+
+def _load_optimized_onnx(model_name: str, level: str) -> Any:
+    """
+    Загружает ONNX модель с графовыми оптимизациями optimum (O1-O4).
+
+    O1-O3 - fusion операторов для CPU/GPU, O4 дополнительно fp16 (только GPU).
+    Экспорт выполняется один раз и кэшируется, как и для int8.
+    """
+    file_name = f"onnx/model_{level}.onnx"
+    save_dir = _onnx_cache_path(model_name)
+    if not os.path.exists(os.path.join(save_dir, file_name)):
+        from sentence_transformers.backend import export_optimized_onnx_model
+
+        logger.info(f"Exporting {level}-optimized ONNX model to {save_dir} (one-time)...")
+        model = SentenceTransformer(model_name, backend='onnx')
+        model.save_pretrained(save_dir)
+        export_optimized_onnx_model(model, level, save_dir)
+
+    return SentenceTransformer(save_dir, backend='onnx', model_kwargs={"file_name": file_name})
+
+
+def _load_torch_sentence_transformer(model_name: str) -> Any:
+    """
+    Загружает torch модель из safetensors.
+
+    safetensors читаются через mmap, поэтому несколько worker процессов на одной
+    машине делят страницы весов в page cache ОС вместо отдельной копии в каждом.
+    """
+    if settings.embedding_use_safetensors:
+        try:
+            return SentenceTransformer(model_name, model_kwargs={"use_safetensors": True})
+        except Exception as e:
+            # Нет model.safetensors в репозитории модели или старый sentence-transformers
+            logger.warning(f"Failed to load safetensors weights, using default loader: {e}")
+    return SentenceTransformer(model_name)
+
+
+def _load_sentence_transformer(model_name: str) -> Any:
+    """Загружает SentenceTransformer с backend из settings (torch, onnx, openvino)."""
+    if SentenceTransformer is None:
+        raise ImportError("sentence-transformers not installed. Install: pip install sentence-transformers")
+
+    backend = settings.embedding_backend.lower()
+    if backend == 'torch':
+        return _load_torch_sentence_transformer(model_name)
+
+    if backend not in ('onnx', 'openvino'):
+        logger.warning(f"Unknown embedding backend '{backend}', using torch")
+        return SentenceTransformer(model_name)
+
+    try:
+        if backend == 'onnx' and settings.embedding_quantize == 'int8':
+            return _load_quantized_onnx(model_name)
+        if backend == 'onnx' and settings.embedding_onnx_optimization:
+            return _load_optimized_onnx(model_name, settings.embedding_onnx_optimization.upper())
+        return SentenceTransformer(model_name, backend=backend)
+    except Exception as e:
+        # backend= требует sentence-transformers>=3.2 и optimum/onnxruntime/openvino
+        logger.warning(f"Failed to load {backend} backend, falling back to torch: {e}")
+        return SentenceTransformer(model_name)
+
+
+def _configure_torch_threads() -> None:
+    """
+    Фиксирует число потоков torch: параллелизм внутри одного encode (OMP/MKL),
+    без inter-op пула поверх executor, чтобы потоки не конкурировали за ядра.
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+
+    num_threads = settings.embedding_torch_threads or os.cpu_count() or 4
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError as e:
+        # Можно вызвать только до первой параллельной операции torch
+        logger.debug(f"torch inter-op threads already initialized: {e}")
+    logger.info(f"torch threads: intra-op={num_threads}, inter-op=1")
 
 
 def _init_huggingface_embedding(model_name: str) -> UnifiedEmbeddingModel:
     """Инициализация HuggingFace embedding."""
-    from sentence_transformers import SentenceTransformer
+    logger.info(f"Loading HuggingFace model: {model_name} (backend={settings.embedding_backend})...")
+    _configure_torch_threads()
+    client = _load_sentence_transformer(model_name)
+    if getattr(client, 'backend', 'torch') == 'torch':
+        client = _apply_hf_precision(client)
+        if settings.embedding_torch_compile:
+            try:
+                import torch
+                client.forward = torch.compile(client.forward, mode="reduce-overhead")
+                logger.info("HuggingFace model forward compiled with torch.compile")
+            except Exception as e:
+                logger.warning(f"torch.compile unavailable, using eager mode: {e}")
+
+    # Attention O(L²): ограничиваем длину последовательности
+    max_seq_length = settings.embedding_max_seq_length
+    if max_seq_length and (client.max_seq_length is None or max_seq_length < client.max_seq_length):
+        client.max_seq_length = max_seq_length
 
-    logger.info(f"Loading HuggingFace model: {model_name}...")
-    client = SentenceTransformer(model_name)
     dim = client.get_sentence_embedding_dimension()
 
     # HuggingFace is sync-only, async_client is None
     return UnifiedEmbeddingModel('huggingface', model_name, dim, client, None)
 
 
+@functools.cache
 def get_embed_model() -> UnifiedEmbeddingModel:
     """
     Фабрика для получения модели embeddings.
+
+    Повторные вызовы обслуживает functools.cache без захвата lock;
+    lock нужен только для первой инициализации при конкурентных вызовах.
+    Исключения не кэшируются - следующий вызов повторит инициализацию.
     """
     global _embed_model
 
-    if _embed_model:
-        return _embed_model
-
     with _model_lock:
         if _embed_model:
             return _embed_model
@@ -340,6 +1130,33 @@ def get_embed_model() -> UnifiedEmbeddingModel:
             raise RuntimeError(f"Failed to initialize embedding model: {e}")
 
 
+def warmup(sample_texts: Tuple[str, ...] = ("warmup",) * 4) -> None:
+    """
+    Загружает модель и выполняет пробный encode.
+
+    Вызывается при старте сервера: загрузка весов и ленивая компиляция
+    (torch.compile, ONNX graph) происходят до первого пользовательского запроса.
+    """
+    start_time = time.time()
+    model = get_embed_model()
+    model.get_text_embeddings(list(sample_texts))
+    logger.info(f"✅ Embedding model warmed up in {time.time() - start_time:.2f}s")
+
+
+def _close_embed_model():
+    """Graceful shutdown for embedding HTTP pools."""
+    if _embed_model is not None:
+        _embed_model.close()
+
+atexit.register(_close_embed_model)
+
+
+async def aclose_embed_model() -> None:
+    """Закрывает HTTP пулы embedding модели из async shutdown сервера."""
+    if _embed_model is not None:
+        await _embed_model.aclose()
+
+
 def get_embedding_dimension() -> int:
     """Helper to get dimension."""
     model = get_embed_model()
@@ -357,12 +1174,18 @@ async def generate_query_embedding_async(query: str) -> List[float]:
     return await model.get_query_embedding_async(query)
 
 
-def generate_query_embeddings_batch(queries: List[str]) -> List[List[float]]:
+def generate_query_embeddings_batch(
+    queries: List[str],
+    return_numpy: bool = False
+) -> Union[List[List[float]], np.ndarray]:
     """Helper to generate batch embeddings."""
     model = get_embed_model()
-    return model.get_text_embeddings(queries)
+    return model.get_text_embeddings(queries, return_numpy=return_numpy)
 
-async def generate_query_embeddings_batch_async(queries: List[str]) -> List[List[float]]:
+async def generate_query_embeddings_batch_async(
+    queries: List[str],
+    return_numpy: bool = False
+) -> Union[List[List[float]], np.ndarray]:
     """Helper to generate batch embeddings async."""
     model = get_embed_model()
-    return await model.get_text_embeddings_async(queries)
+    return await model.get_text_embeddings_async(queries, return_numpy=return_numpy)
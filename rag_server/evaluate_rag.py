@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import asyncio
 from typing import List, Dict, Any
@@ -18,47 +19,50 @@ from rag_server.mcp_rag_secure import confluence_semantic_search
 if settings.openai_api_key:
     os.environ["OPENAI_API_KEY"] = settings.openai_api_key
 
-async def generate_rag_answers(questions: List[str]) -> List[Dict[str, Any]]:
+# Текст контекста после маркера 💬 до конца строки
+_CONTEXT_RE = re.compile(r"💬[^\S\n]*([^\n]*)")
+
+
+def _parse_contexts(search_result_text: str) -> List[str]:
+    """Парсит результаты поиска обратно (это текст), чтобы достать контексты."""
+    if "✅ Найдено" not in search_result_text:
+        return []
+    # Строки контекста имеют вид "    💬 {text_preview}" (см. format_search_results)
+    return [context.strip() for context in _CONTEXT_RE.findall(search_result_text)]
+
+
+async def generate_rag_answers(questions: List[str], concurrency: int = 16) -> List[Dict[str, Any]]:
     """
     Генерирует ответы используя текущий RAG pipeline.
+
+    Вопросы обрабатываются конкурентно (не более concurrency одновременно),
+    порядок результатов совпадает с порядком questions.
     """
-    results = []
-    for q in questions:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer_question(q: str) -> Dict[str, Any]:
         # Выполняем поиск через наш RAG
         # Используем mcp tool как интерфейс
-        search_result_text = await confluence_semantic_search(q, limit=5)
-        
+        async with semaphore:
+            search_result_text = await confluence_semantic_search(q, limit=5)
+
         # В реальном сценарии здесь должен быть вызов LLM для генерации ответа на основе search_result_text.
         # Для оценки retrieval metrics (context_recall, context_precision) нам достаточно контекста.
         # Для оценки generation metrics (faithfulness, answer_relevancy) нужен ответ LLM.
-        
-        # Эмуляция ответа LLM (или реальный вызов если есть integration)
-        # Пока используем простой placeholder или можно интегрировать вызов LLM если есть.
-        # Для целей данного скрипта, предположим мы оцениваем retrieval качество в основном.
-        
-        # Парсим результаты поиска обратно (это текст) чтобы достать контексты
-        contexts = []
-        if "✅ Найдено" in search_result_text:
-            # Простой парсинг текста результатов
-            lines = search_result_text.split('\n')
-            current_context = ""
-            for line in lines:
-                if "💬" in line:
-                    current_context = line.replace("💬", "").strip()
-                    contexts.append(current_context)
-        
+        contexts = _parse_contexts(search_result_text)
+
         # Заглушка для ответа, так как у нас только retrieval часть сейчас exposed через mcp tool явно.
         # В полноценном пайплайне тут был бы вызов generate_response(query, contexts)
-        answer = "Generated answer based on retrieved contexts." 
+        answer = "Generated answer based on retrieved contexts."
 
-        results.append({
+        return {
             "question": q,
             "answer": answer,
             "contexts": contexts,
             # Ground truth добавляется из датасета
-        })
-    
-    return results
+        }
+
+    return list(await asyncio.gather(*(answer_question(q) for q in questions)))
 
 def run_evaluation(golden_dataset_path: str = "data/golden_dataset.json"):
     """
@@ -8,9 +8,10 @@ Hallucination Detection для проверки ответов на соотве
 3. Confidence scoring - анализ уверенности модели
 """
 
+import re
 import numpy as np
 import logging
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Union
 
 # Pydantic config
 from rag_server.config import settings
@@ -27,6 +28,9 @@ class HallucinationDetector:
     MIN_GROUNDED_RATIO = 0.5  # Минимальный ratio для grounded sentence
     MIN_WORD_LENGTH = 3  # Минимальная длина слова для проверки
 
+    # Слова длиннее MIN_WORD_LENGTH из букв/цифр: токенизация одним C-проходом re.findall
+    _WORD_RE = re.compile(rf"[^\W_]{{{MIN_WORD_LENGTH + 1},}}")
+
     def __init__(
         self,
         similarity_threshold: float = 0.5,
@@ -70,14 +74,17 @@ class HallucinationDetector:
         response: str,
         retrieved_docs: List[str],
         response_embedding: Optional[np.ndarray],
-        docs_embeddings: Optional[List[np.ndarray]]
+        docs_embeddings: Optional[Union[List[np.ndarray], np.ndarray]]
     ) -> Tuple[Dict[str, float], List[str]]:
         """Вычисление всех detection scores."""
         scores = {}
         reasons = []
 
+        # Слова docs нужны и для keyword overlap, и для grounding: токенизируем один раз
+        docs_words = self._extract_docs_words(retrieved_docs)
+
         # 1. Semantic similarity
-        if response_embedding is not None and docs_embeddings:
+        if response_embedding is not None and docs_embeddings is not None and len(docs_embeddings):
             try:
                 semantic_score = self._check_semantic_similarity(
                     response_embedding,
@@ -94,7 +101,7 @@ class HallucinationDetector:
 
         # 2. Keyword overlap
         try:
-            keyword_score = self._check_keyword_overlap(response, retrieved_docs)
+            keyword_score = self._check_keyword_overlap(response, retrieved_docs, docs_words)
             scores['keyword_overlap'] = keyword_score
 
             if keyword_score < self.keyword_overlap_threshold:
@@ -106,7 +113,7 @@ class HallucinationDetector:
 
         # 3. Grounding check
         try:
-            grounded_ratio = self._check_grounding(response, retrieved_docs)
+            grounded_ratio = self._check_grounding(response, retrieved_docs, docs_words)
             scores['grounded_ratio'] = grounded_ratio
 
             if grounded_ratio < 0.5:  # Меньше половины контента grounded
@@ -141,7 +148,7 @@ class HallucinationDetector:
         response: str,
         retrieved_docs: List[str],
         response_embedding: Optional[np.ndarray] = None,
-        docs_embeddings: Optional[List[np.ndarray]] = None
+        docs_embeddings: Optional[Union[List[np.ndarray], np.ndarray]] = None
     ) -> Dict[str, Any]:
         """
         Detect hallucinations в response.
@@ -186,51 +193,51 @@ class HallucinationDetector:
     def _check_semantic_similarity(
         self,
         response_embedding: np.ndarray,
-        docs_embeddings: List[np.ndarray]
+        docs_embeddings: Union[List[np.ndarray], np.ndarray]
     ) -> float:
-        """Check semantic similarity между response и docs."""
+        """Check semantic similarity между response и docs (список векторов или матрица (N, D))."""
         try:
-            # Normalize embeddings
-            response_norm = np.linalg.norm(response_embedding)
+            response_vec = np.asarray(response_embedding, dtype=np.float32)
+            response_norm = np.linalg.norm(response_vec)
             if response_norm == 0:
                 return 0.0
-            response_norm = response_embedding / response_norm
 
-            similarities = []
-            for doc_emb in docs_embeddings:
-                doc_emb = np.array(doc_emb)
-                doc_norm = np.linalg.norm(doc_emb)
-                if doc_norm == 0:
-                    continue
-                doc_norm = doc_emb / doc_norm
-                sim = float(np.dot(response_norm, doc_norm))
-                similarities.append(sim)
+            # Все документы одной матрицей (N, D): один BLAS вызов вместо цикла
+            docs_matrix = np.ascontiguousarray(docs_embeddings, dtype=np.float32)
+            doc_norms = np.linalg.norm(docs_matrix, axis=1)
+            valid = doc_norms > 0
+            if not valid.any():
+                return 0.0
+
+            similarities = (docs_matrix[valid] @ response_vec) / (doc_norms[valid] * response_norm)
 
             # Return maximum similarity (best match)
-            return max(similarities) if similarities else 0.0
+            return float(similarities.max())
 
         except Exception as e:
             logger.error(f"Error in semantic similarity check: {e}")
             return 0.0
 
+    def _extract_docs_words(self, retrieved_docs: List[str]) -> set:
+        """Множество слов всех docs (общее для keyword overlap и grounding)."""
+        # Без ' '.join: не копируем весь контекст в одну строку
+        docs_words = set()
+        for doc in retrieved_docs:
+            docs_words.update(self._WORD_RE.findall(doc.lower()))
+        return docs_words
+
     def _check_keyword_overlap(
         self,
         response: str,
-        retrieved_docs: List[str]
+        retrieved_docs: List[str],
+        docs_words: Optional[set] = None
     ) -> float:
         """Check keyword overlap между response и docs."""
         try:
             # Extract keywords (simple: words > 3 chars)
-            response_words = set(
-                word.lower() for word in response.split()
-                if len(word) > 3 and word.isalnum()
-            )
-
-            docs_text = ' '.join(retrieved_docs)
-            docs_words = set(
-                word.lower() for word in docs_text.split()
-                if len(word) > 3 and word.isalnum()
-            )
+            response_words = set(self._WORD_RE.findall(response.lower()))
+            if docs_words is None:
+                docs_words = self._extract_docs_words(retrieved_docs)
 
             if not response_words:
                 return 0.0
@@ -248,37 +255,31 @@ class HallucinationDetector:
     def _check_grounding(
         self,
         response: str,
-        retrieved_docs: List[str]
+        retrieved_docs: List[str],
+        docs_words: Optional[set] = None
     ) -> float:
         """Check сколько контента из response присутствует в docs."""
         try:
             # Split response на sentences
-            sentences = [s.strip() for s in response.split('.') if s.strip()]
+            # Ответ приводится к нижнему регистру один раз, а не по каждому предложению
+            sentences = [s for s in response.lower().split('.') if s and not s.isspace()]
 
             if not sentences:
                 return 0.0
 
-            docs_text = ' '.join(retrieved_docs).lower()
-
             # Предварительно строим set для O(1) lookup (оптимизация)
-            docs_words_set = set(
-                w for w in docs_text.split()
-                if len(w) > HallucinationDetector.MIN_WORD_LENGTH
-            )
+            docs_words_set = docs_words if docs_words is not None else self._extract_docs_words(retrieved_docs)
 
             # Check сколько sentences grounded
             grounded_count = 0
             for sentence in sentences:
-                sentence_lower = sentence.lower()
                 # Простая проверка: есть ли 50%+ слов sentence в docs
-                words = [
-                    w for w in sentence_lower.split()
-                    if len(w) > HallucinationDetector.MIN_WORD_LENGTH
-                ]
+                words = self._WORD_RE.findall(sentence)
                 if not words:
                     continue
 
-                found_words = sum(1 for w in words if w in docs_words_set)
+                # map(set.__contains__) считает совпадения в C без генератора на каждое слово
+                found_words = sum(map(docs_words_set.__contains__, words))
                 if found_words / len(words) >= HallucinationDetector.MIN_GROUNDED_RATIO:
                     grounded_count += 1
 
@@ -297,7 +298,7 @@ def detect_hallucination(
     response: str,
     retrieved_docs: List[str],
     response_embedding: Optional[np.ndarray] = None,
-    docs_embeddings: Optional[List[np.ndarray]] = None
+    docs_embeddings: Optional[Union[List[np.ndarray], np.ndarray]] = None
 ) -> Tuple[bool, Dict[str, Any]]:
     """
     Convenience function для hallucination detection.
@@ -6,11 +6,28 @@ Hybrid Search: Vector + BM25 (full-text search)
 Это стандартный подход, используемый Google, OpenAI, Meta, Microsoft, AWS.
 """
 
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import unicodedata
 import logging
+import atexit
 import asyncio
-from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
-from collections import defaultdict
+import functools
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable, TYPE_CHECKING
+from collections import defaultdict, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, Future
 from enum import Enum
+from types import MappingProxyType
+from dataclasses import dataclass
+
+import numpy as np
 
 # Pydantic config
 from rag_server.config import settings
@@ -19,12 +36,50 @@ from rag_server.config import settings
 if TYPE_CHECKING:
     from rank_bm25 import BM25Okapi
 
+# bm25s: scores хранятся в sparse матрице, get_scores - векторизованный срез вместо Python цикла
+try:
+    import bm25s
+    HAS_BM25S = True
+except ImportError:
+    HAS_BM25S = False
+
+# numba: JIT ядро BM25 scoring для rank_bm25 backend
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# PyStemmer: Snowball стеммер на C (analyzer "stem", быстрее лемматизации pymorphy)
+try:
+    import Stemmer
+    HAS_STEMMER = True
+except ImportError:
+    HAS_STEMMER = False
+
 # Импортируем функцию для получения документов из Qdrant
 try:
-    from qdrant_storage import get_all_points
+    from qdrant_storage import (
+        iter_points_batches, init_qdrant_client, extract_text_from_payload,
+        has_sparse_bm25_vectors, BM25_SPARSE_VECTOR
+    )
 except ImportError:
     # Fallback для запуска из другой директории
-    from rag_server.qdrant_storage import get_all_points
+    from rag_server.qdrant_storage import (
+        iter_points_batches, init_qdrant_client, extract_text_from_payload,
+        has_sparse_bm25_vectors, BM25_SPARSE_VECTOR
+    )
+from qdrant_client.models import SparseVector, Filter, FieldCondition, MatchValue
+
+# Стоп-слова и лемматизация для BM25 analyzer
+try:
+    from utils.keyword_extraction import STOPWORDS
+    from utils.lemmatizer import get_morph_analyzer, lemmatize_word
+    from utils.micro_batcher import MicroBatcher
+except ImportError:
+    from rag_server.utils.keyword_extraction import STOPWORDS
+    from rag_server.utils.lemmatizer import get_morph_analyzer, lemmatize_word
+    from rag_server.utils.micro_batcher import MicroBatcher
 
 logger = logging.getLogger(__name__)
 
@@ -40,15 +95,137 @@ class QueryIntent(Enum):
     HOWTO = "howto"                # Инструкции (как сделать)
 
 
+@dataclass
+class BM25Node:
+    """
+    Документ BM25 корпуса.
+
+    __slots__ вместо dict: в памяти держится до BM25_MAX_DOCS экземпляров,
+    без __dict__ и хэш-таблицы ключей на каждый (slots=True требует Python 3.10).
+    """
+    __slots__ = ('id', 'payload', 'text')
+    id: str
+    payload: Dict[str, Any]
+    text: str
+
+
 # Глобальный BM25 индекс (ленивая инициализация)
 bm25_index = None
-bm25_corpus = []  # Список документов (текстов)
 bm25_nodes = []   # Список соответствующих nodes (метаданные)
+# Общие пустые метаданные (read-only): без нового {} на каждый документ/результат без метаданных
+_EMPTY_METADATA = MappingProxyType({})
+# space -> bool маска по bm25_nodes (фильтр space_filter до отбора top-k)
+_space_masks: Dict[str, np.ndarray] = {}
+# Один поток строит индекс, конкурентные первые запросы ждут его вместо повторной загрузки
+_bm25_init_lock = threading.Lock()
+
+# Отдельный executor для BM25 scoring: запросы не стоят в очереди default executor
+# за другими блокирующими вызовами процесса (numba ядро отпускает GIL)
+_bm25_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.bm25_workers),
+    thread_name_prefix="bm25"
+)
+
+
+def _shutdown_bm25_executor():
+    _bm25_executor.shutdown(wait=True)
+
+
+atexit.register(_shutdown_bm25_executor)
+
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(STOPWORDS)
+
+
+@functools.lru_cache(maxsize=1)
+def _bm25_analyzer() -> str:
+    """Analyzer BM25 из настроек; lemma/stem без зависимостей деградируют до stopwords."""
+    analyzer = settings.bm25_analyzer.lower()
+    if analyzer == "stem" and not HAS_STEMMER:
+        logger.warning("PyStemmer не установлен, BM25 analyzer: stem -> stopwords")
+        return "stopwords"
+    if analyzer == "lemma":
+        try:
+            get_morph_analyzer()
+        except ImportError:
+            logger.warning("pymorphy не установлен, BM25 analyzer: lemma -> stopwords")
+            return "stopwords"
+    return analyzer
+
+
+@functools.lru_cache(maxsize=1)
+def _stemmer():
+    """Русский Snowball стеммер (создается один раз, stemWords кэширует основы внутри)."""
+    return Stemmer.Stemmer("russian")
 
 
 def simple_tokenize(text: str) -> List[str]:
-    """Простая токенизация для BM25"""
-    return text.lower().split()
+    """
+    Токенизация для BM25 (одинаковая для индекса и запроса).
+
+    settings.bm25_analyzer: simple - split по пробелам; stopwords - слова без
+    стоп-слов и однобуквенных (короче postings); lemma - плюс лемматизация pymorphy;
+    stem - плюс Snowball стемминг PyStemmer (весь список за один вызов C).
+    """
+    analyzer = _bm25_analyzer()
+    if analyzer == "simple":
+        return text.lower().split()
+    tokens = [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+    if analyzer == "lemma":
+        tokens = [lemmatize_word(t) for t in tokens]
+    elif analyzer == "stem":
+        tokens = _stemmer().stemWords(tokens)
+    return tokens
+
+
+@functools.lru_cache(maxsize=1024)
+def _tokenize_query(query: str) -> Tuple[str, ...]:
+    """Токенизация запроса с кэшем (tuple: результат общий для всех вызывающих)."""
+    return tuple(simple_tokenize(query))
+
+
+class _BM25ResultCache:
+    """
+    Thread-safe LRU кэш результатов BM25 с TTL.
+
+    Ключ - (токены запроса, bm25_limit). Очищается при пересоздании индекса.
+    Возвращаемые списки общие для всех вызывающих и не должны изменяться.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: "OrderedDict[Tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, results = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return results
+
+    def put(self, key: Tuple, results: List[Dict[str, Any]]) -> None:
+        if self._maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, results)
+            self._data.move_to_end(key)
+            if len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_bm25_cache = _BM25ResultCache(settings.bm25_cache_size, settings.bm25_cache_ttl)
 
 
 # Ключевые слова для определения интента (в порядке приоритета)
@@ -59,7 +236,21 @@ INTENT_KEYWORDS = {
     QueryIntent.EXPLORATORY: ['какие', 'сравни', 'список', 'все', 'перечисли']
 }
 
+# Одна скомпилированная alternation на интент: поиск в C вместо ~30 проверок подстрок.
+# Общий regex на все интенты нашел бы самое левое совпадение, а не интент с высшим приоритетом
+_INTENT_PATTERNS = [
+    (intent, re.compile('|'.join(re.escape(kw) for kw in keywords)))
+    for intent, keywords in INTENT_KEYWORDS.items()
+]
 
+
+def _canonical_query(query: str) -> str:
+    """NFKC + lower: неразрывные пробелы, полноширинные символы и лигатуры приводятся к обычным."""
+    return unicodedata.normalize('NFKC', query).lower()
+
+
+# Запросы к RAG часто повторяются: 4096 записей по ~100 байт строки - сотни KB
+@functools.lru_cache(maxsize=4096)
 def detect_query_intent(query: str) -> QueryIntent:
     """
     Определить тип запроса для адаптивных весов.
@@ -72,100 +263,473 @@ def detect_query_intent(query: str) -> QueryIntent:
     Returns:
         QueryIntent enum
     """
-    query_lower = query.lower()
+    # Нормализация один раз на уникальный запрос (результат в lru_cache)
+    query_lower = _canonical_query(query)
 
     # Проверяем в порядке приоритета
-    for intent, keywords in INTENT_KEYWORDS.items():
-        if any(kw in query_lower for kw in keywords):
+    for intent, pattern in _INTENT_PATTERNS:
+        if pattern.search(query_lower):
             return intent
 
     # По умолчанию: Factual
     return QueryIntent.FACTUAL
 
 
+def _normalize_weights(vector_weight: float, bm25_weight: float) -> Tuple[float, float]:
+    # Нормализуем веса (сумма должна быть ~1.0)
+    total = vector_weight + bm25_weight
+    if total > 0:
+        return vector_weight / total, bm25_weight / total
+    return vector_weight, bm25_weight
+
+
+def refresh_adaptive_weights() -> None:
+    """Пересчитать нормализованные веса (после изменения settings во время работы)."""
+    global _NORMALIZED_WEIGHTS, _DEFAULT_WEIGHTS
+    _NORMALIZED_WEIGHTS = {
+        QueryIntent.NAVIGATIONAL: _normalize_weights(settings.hybrid_vector_weight_navigational, settings.hybrid_bm25_weight_navigational),
+        QueryIntent.EXPLORATORY: _normalize_weights(settings.hybrid_vector_weight_exploratory, settings.hybrid_bm25_weight_exploratory),
+        QueryIntent.FACTUAL: _normalize_weights(settings.hybrid_vector_weight_factual, settings.hybrid_bm25_weight_factual),
+        QueryIntent.HOWTO: _normalize_weights(settings.hybrid_vector_weight_howto, settings.hybrid_bm25_weight_howto),
+    }
+    _DEFAULT_WEIGHTS = _normalize_weights(settings.hybrid_vector_weight, settings.hybrid_bm25_weight)
+
+
 def get_adaptive_weights(query_intent: QueryIntent) -> Tuple[float, float]:
     """
     Получить адаптивные веса для Hybrid Search на основе типа запроса.
 
+    Нормализованные веса считаются один раз при импорте (refresh_adaptive_weights).
+
     Args:
         query_intent: Тип запроса
 
     Returns:
         Tuple[vector_weight, bm25_weight]
     """
-    weights = {
-        QueryIntent.NAVIGATIONAL: (settings.hybrid_vector_weight_navigational, settings.hybrid_bm25_weight_navigational),
-        QueryIntent.EXPLORATORY: (settings.hybrid_vector_weight_exploratory, settings.hybrid_bm25_weight_exploratory),
-        QueryIntent.FACTUAL: (settings.hybrid_vector_weight_factual, settings.hybrid_bm25_weight_factual),
-        QueryIntent.HOWTO: (settings.hybrid_vector_weight_howto, settings.hybrid_bm25_weight_howto),
-    }
+    return _NORMALIZED_WEIGHTS.get(query_intent, _DEFAULT_WEIGHTS)
 
-    vector_weight, bm25_weight = weights.get(query_intent, (settings.hybrid_vector_weight, settings.hybrid_bm25_weight))
 
-    # Нормализуем веса (сумма должна быть ~1.0)
-    total = vector_weight + bm25_weight
-    if total > 0:
-        vector_weight = vector_weight / total
-        bm25_weight = bm25_weight / total
+_NORMALIZED_WEIGHTS: Dict[QueryIntent, Tuple[float, float]] = {}
+_DEFAULT_WEIGHTS: Tuple[float, float] = (settings.hybrid_vector_weight, settings.hybrid_bm25_weight)
+refresh_adaptive_weights()
 
-    return vector_weight, bm25_weight
 
+def _prefetched(iterator):
+    """Следующий элемент iterator загружается в фоне, пока вызывающий обрабатывает текущий."""
+    future = _bm25_executor.submit(next, iterator, None)
+    while True:
+        item = future.result()
+        if item is None:
+            return
+        future = _bm25_executor.submit(next, iterator, None)
+        yield item
+
+
+def _load_bm25_nodes_from_qdrant(collection_name: str, limit: int) -> List[BM25Node]:
+    """
+    Загружает документы из Qdrant постранично и сразу превращает их в BM25Node.
 
-def _load_documents_from_qdrant(collection_name: str, limit: int) -> dict:
-    """Загружает документы из Qdrant."""
+    Страница scroll загружается в фоне, пока обрабатывается предыдущая;
+    общие списки ids/documents/metadatas на всю коллекцию не создаются.
+    """
     # Ограничиваем для предотвращения OOM
     actual_limit = min(limit, settings.bm25_max_docs)
 
     target_collection = collection_name or settings.qdrant_collection
     logger.info(f"Загрузка документов для BM25 из коллекции: {target_collection} (limit={actual_limit})")
 
-    all_data = get_all_points(limit=actual_limit)
+    nodes = []
+    for batch in _prefetched(iter_points_batches(limit=actual_limit)):
+        nodes.extend(_make_bm25_nodes(batch))
 
-    if not all_data or not all_data.get('ids'):
-        raise ValueError("Коллекция пуста или данные не получены")
+    if not nodes:
+        raise ValueError("Коллекция пуста или не найдено текстового контента для индексации")
+    return nodes
 
-    return all_data
 
+def _token_cache_path() -> Optional[str]:
+    if not settings.bm25_index_dir:
+        return None
+    return os.path.join(settings.bm25_index_dir, f"tokens-{_bm25_analyzer()}.pkl")
+
+
+def _load_token_cache() -> Dict[str, Tuple[bytes, List[str]]]:
+    """Токены документов с прошлой индексации: doc_id -> (хэш текста, токены)."""
+    path = _token_cache_path()
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить кэш токенов BM25 {path}: {e}")
+        return {}
 
-def _prepare_bm25_corpus(all_data: dict) -> Tuple[List, List]:
-    """Подготавливает корпус и nodes для BM25."""
-    corpus_tokens = []
-    nodes = []
-    doc_count = len(all_data['ids'])
 
-    logger.info(f"Подготовка {doc_count} документов для BM25...")
+def _save_token_cache(token_cache: Dict[str, Tuple[bytes, List[str]]]) -> None:
+    path = _token_cache_path()
+    if not path:
+        return
+    try:
+        os.makedirs(settings.bm25_index_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(token_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить кэш токенов BM25 {path}: {e}")
 
-    for idx in range(doc_count):
-        doc_id = all_data['ids'][idx]
-        doc_text = all_data['documents'][idx]
-        doc_metadata = all_data['metadatas'][idx]
 
+def _make_bm25_nodes(all_data: dict) -> List[BM25Node]:
+    """Nodes BM25 напрямую из чанков Qdrant (документы без текста пропускаются)."""
+    nodes = []
+    for doc_id, doc_text, doc_metadata in zip(all_data['ids'], all_data['documents'], all_data['metadatas']):
         if doc_text and isinstance(doc_text, str):
-            tokens = simple_tokenize(doc_text)
-            corpus_tokens.append(tokens)
-            # Сохраняем структуру, похожую на PointStruct для совместимости
-            nodes.append({
-                'id': doc_id,
-                'payload': doc_metadata or {},
-                'text': doc_text
-            })
+            # Интернированный id: один объект строки на документ во всех кэшах и результатах
+            # (хэш str вычисляется один раз и переиспользуется в dict RRF на каждом запросе)
+            if isinstance(doc_id, str):
+                doc_id = sys.intern(doc_id)
+            nodes.append(BM25Node(doc_id, doc_metadata or _EMPTY_METADATA, doc_text))
+    return nodes
+
+
+def _tokenize_bm25_corpus(nodes: List[BM25Node]) -> List[List[str]]:
+    """Токены документов для индекса (неизмененные документы не токенизируются повторно)."""
+    logger.info(f"Подготовка {len(nodes)} документов для BM25...")
+
+    cached_tokens = _load_token_cache()
+    token_cache = {}
+    corpus_tokens = []
+    tokenized = 0
+
+    for node in nodes:
+        text_hash = hashlib.blake2b(node.text.encode('utf-8'), digest_size=8).digest()
+        cached = cached_tokens.get(node.id)
+        if cached is not None and cached[0] == text_hash:
+            tokens = cached[1]
+        else:
+            tokens = simple_tokenize(node.text)
+            tokenized += 1
+        token_cache[node.id] = (text_hash, tokens)
+        corpus_tokens.append(tokens)
+
+    # Перезаписываем при новых/измененных/удаленных документах
+    if tokenized or len(token_cache) != len(cached_tokens):
+        _save_token_cache(token_cache)
+    logger.info(f"BM25: токенизировано {tokenized}, из кэша {len(corpus_tokens) - tokenized}")
+
+    return corpus_tokens
+
 
-    if not corpus_tokens:
+def _prepare_bm25_corpus(all_data: dict) -> Tuple[List, List[BM25Node]]:
+    """Подготавливает корпус и nodes для BM25."""
+    nodes = _make_bm25_nodes(all_data)
+    if not nodes:
         raise ValueError("Не найдено текстового контента для индексации")
+    return _tokenize_bm25_corpus(nodes), nodes
 
-    return corpus_tokens, nodes
 
+def _bm25_score_postings(term_ids, starts, docs, tfs, idf, len_norm, k1, n_docs):
+    """BM25 scores по postings: проходит только документы, содержащие термины запроса."""
+    scores = np.zeros(n_docs, dtype=np.float32)
+    for term in term_ids:
+        for j in range(starts[term], starts[term + 1]):
+            tf = tfs[j]
+            scores[docs[j]] += idf[term] * tf * (k1 + 1) / (tf + len_norm[docs[j]])
+    return scores
+
+
+def _bm25_score_postings_sharded(term_ids, starts, docs, tfs, idf, len_norm, k1, n_docs, n_shards):
+    """
+    BM25 scores с разбиением корпуса на n_shards диапазонов документов.
+
+    Postings термина отсортированы по doc id, поэтому каждый shard находит свой
+    диапазон через searchsorted и пишет только в свой срез scores - без гонок.
+    """
+    scores = np.zeros(n_docs, dtype=np.float32)
+    shard_size = (n_docs + n_shards - 1) // n_shards
+    for shard in numba.prange(n_shards):
+        doc_lo = shard * shard_size
+        doc_hi = min(n_docs, doc_lo + shard_size)
+        for term in term_ids:
+            begin = starts[term]
+            end = starts[term + 1]
+            j = begin + np.searchsorted(docs[begin:end], doc_lo)
+            while j < end and docs[j] < doc_hi:
+                tf = tfs[j]
+                scores[docs[j]] += idf[term] * tf * (k1 + 1) / (tf + len_norm[docs[j]])
+                j += 1
+    return scores
+
+
+# Число shards для параллельного scoring одного запроса (1 = без шардирования)
+_BM25_SHARDS = settings.bm25_shards or (os.cpu_count() or 1)
+
+if HAS_NUMBA:
+    # nogil: параллельные запросы из executor не сериализуются на GIL.
+    # prange по терминам не используется: документы терминов пересекаются (гонка на scores[doc])
+    _bm25_score_jit = numba.njit(nogil=True, fastmath=True, cache=True)(_bm25_score_postings)
+    # Шардирование по диапазонам документов: prange по shards, запись в непересекающиеся срезы
+    _bm25_score_sharded_jit = numba.njit(
+        parallel=True, nogil=True, fastmath=True, cache=True
+    )(_bm25_score_postings_sharded)
+
+
+class _PostingsBM25:
+    """
+    BM25Okapi (rank_bm25) в виде postings списков (CSR по терминам).
+
+    rank_bm25.get_scores для каждого термина проходит все документы в Python цикле;
+    здесь считаются только документы с термином - numba ядром или numpy по термину.
+    """
+
+    def __init__(self, okapi: 'BM25Okapi'):
+        self.k1 = okapi.k1
+        self.corpus_size = okapi.corpus_size
+        # k1 * (1 - b + b * dl / avgdl) не зависит от запроса - считаем один раз на документ
+        doc_len = np.asarray(okapi.doc_len, dtype=np.float32)
+        self.len_norm = (okapi.k1 * (1 - okapi.b + okapi.b * doc_len / okapi.avgdl)).astype(np.float32)
+
+        postings_docs = defaultdict(list)
+        postings_tfs = defaultdict(list)
+        for doc_id, freqs in enumerate(okapi.doc_freqs):
+            for token, tf in freqs.items():
+                postings_docs[token].append(doc_id)
+                postings_tfs[token].append(tf)
+
+        self.vocab = {}
+        starts = [0]
+        docs = []
+        tfs = []
+        idf = []
+        for token, token_docs in postings_docs.items():
+            self.vocab[token] = len(idf)
+            docs.extend(token_docs)
+            tfs.extend(postings_tfs[token])
+            starts.append(len(docs))
+            idf.append(okapi.idf.get(token, 0.0))
+
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.docs = np.asarray(docs, dtype=np.int32)
+        self.tfs = np.asarray(tfs, dtype=np.float32)
+        self.idf = np.asarray(idf, dtype=np.float32)
+
+        if settings.bm25_quantize:
+            # TF внутри чанка не превышает int16; вдвое меньше памяти на проход по postings.
+            # float16 idf/len_norm только для numpy пути: numba ядро на CPU считает в float32
+            self.tfs = np.minimum(self.tfs, np.iinfo(np.int16).max).astype(np.int16)
+            if not HAS_NUMBA:
+                self.idf = self.idf.astype(np.float16)
+                self.len_norm = self.len_norm.astype(np.float16)
+
+        if HAS_NUMBA:
+            # Компиляция ядра при построении индекса, а не на первом запросе
+            self.get_scores([])
+
+    _ARRAYS = ('starts', 'docs', 'tfs', 'idf', 'len_norm')
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        # Отдельные .npy (не npz): при загрузке отображаются в память через mmap
+        for name in self._ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "vocab.json"), 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'corpus_size': self.corpus_size, 'vocab': list(self.vocab)}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> '_PostingsBM25':
+        index = cls.__new__(cls)
+        with open(os.path.join(path, "vocab.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        index.k1 = meta['k1']
+        index.corpus_size = meta['corpus_size']
+        index.vocab = {token: token_id for token_id, token in enumerate(meta['vocab'])}
+        # mmap read-only: страницы подгружаются по мере scoring, page cache общий для процессов;
+        # asarray снимает подкласс memmap (без копии) для numba ядер
+        for name in cls._ARRAYS:
+            setattr(index, name, np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')))
+        if HAS_NUMBA:
+            index.get_scores([])
+        return index
+
+    def get_scores_batch(self, queries: List[List[str]]) -> np.ndarray:
+        """
+        Scores для нескольких запросов за один проход: вклад каждого термина
+        считается один раз и добавляется во все строки запросов, где он есть.
+        """
+        scores = np.zeros((len(queries), self.corpus_size), dtype=np.float32)
+        term_rows: Dict[int, List[int]] = defaultdict(list)
+        for row, query in enumerate(queries):
+            for token in query:
+                term = self.vocab.get(token)
+                if term is not None:
+                    term_rows[term].append(row)
+
+        for term, rows in term_rows.items():
+            span = slice(self.starts[term], self.starts[term + 1])
+            docs = self.docs[span]
+            tfs = self.tfs[span].astype(np.float32, copy=False)
+            contribution = float(self.idf[term]) * tfs * (self.k1 + 1) / (tfs + self.len_norm[docs])
+            for row in rows:
+                scores[row, docs] += contribution
+        return scores
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        term_ids = np.fromiter((self.vocab[t] for t in query if t in self.vocab), dtype=np.int64)
+        if HAS_NUMBA and _BM25_SHARDS > 1:
+            return _bm25_score_sharded_jit(
+                term_ids, self.starts, self.docs, self.tfs, self.idf,
+                self.len_norm, self.k1, self.corpus_size, _BM25_SHARDS
+            )
+        if HAS_NUMBA:
+            return _bm25_score_jit(
+                term_ids, self.starts, self.docs, self.tfs, self.idf,
+                self.len_norm, self.k1, self.corpus_size
+            )
+
+        # Накопление в float32 (при bm25_quantize массивы int16/float16)
+        scores = np.zeros(self.corpus_size, dtype=np.float32)
+        for term in term_ids:
+            span = slice(self.starts[term], self.starts[term + 1])
+            docs = self.docs[span]
+            tfs = self.tfs[span].astype(np.float32, copy=False)
+            scores[docs] += float(self.idf[term]) * tfs * (self.k1 + 1) / (tfs + self.len_norm[docs])
+        return scores
+
+
+def _sparse_token_index(token: str) -> int:
+    """Стабильный индекс токена в sparse векторе (hash() в Python рандомизирован между процессами)."""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest(), 'little') & 0x7FFFFFFF
+
+
+def bm25_sparse_vector(text: str) -> Tuple[List[int], List[float]]:
+    """
+    Sparse вектор документа для BM25 в Qdrant (settings.bm25_backend=qdrant).
+
+    Значения - TF с насыщением и нормализацией длины (k1, b); IDF добавляет Qdrant (Modifier.IDF).
+    """
+    tokens = simple_tokenize(text)
+    tf = Counter(_sparse_token_index(t) for t in tokens)
+    k1, b = settings.bm25_k1, settings.bm25_b
+    norm = k1 * (1 - b + b * len(tokens) / settings.bm25_avg_doc_length)
+    return list(tf), [freq * (k1 + 1) / (freq + norm) for freq in tf.values()]
+
+
+class _QdrantSparseBM25:
+    """BM25 поиск на стороне Qdrant по sparse вектору: корпус не хранится в памяти процесса."""
+
+    def search(self, query_tokens: Tuple[str, ...], limit: int, space_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        indices = sorted({_sparse_token_index(t) for t in query_tokens})
+        if not indices:
+            return []
+        response = init_qdrant_client().query_points(
+            collection_name=settings.qdrant_collection,
+            query=SparseVector(indices=indices, values=[1.0] * len(indices)),
+            using=BM25_SPARSE_VECTOR,
+            query_filter=Filter(
+                must=[FieldCondition(key="space", match=MatchValue(value=space_filter))]
+            ) if space_filter else None,
+            limit=limit,
+            with_payload=True
+        )
+        res = []
+        for point in response.points:
+            payload = point.payload or {}
+            res.append({
+                'id': str(point.id),
+                'score': point.score,
+                'payload': {k: v for k, v in payload.items() if k not in ('text', '_node_content')},
+                'text': extract_text_from_payload(payload)
+            })
+        return res
+
+
+def _use_bm25s() -> bool:
+    """Выбрать bm25s backend (settings.bm25_backend: auto, bm25s, rank_bm25)."""
+    backend = settings.bm25_backend.lower()
+    if backend == "rank_bm25":
+        return False
+    if not HAS_BM25S:
+        if backend == "bm25s":
+            logger.warning("bm25s не установлен (pip install bm25s), использую rank_bm25")
+        return False
+    return True
+
+
+def _corpus_fingerprint(nodes: List[BM25Node]) -> str:
+    """Отпечаток корпуса (id + текст + параметры BM25 и analyzer) для кэша индекса на диске."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{settings.bm25_k1}:{settings.bm25_b}:{_bm25_analyzer()}:{settings.bm25_quantize}".encode())
+    for node in nodes:
+        digest.update(str(node.id).encode())
+        digest.update(b"\0")
+        digest.update(node.text.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+_INDEX_PREFIXES = ("bm25s-", "postings-")
+
+
+def _persist_index(index, path: str) -> None:
+    """Сохраняет индекс атомарно (через временный каталог) и удаляет индексы прежних версий корпуса."""
+    tmp_path = f"{path}.tmp"
+    try:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        index.save(tmp_path)
+        os.replace(tmp_path, path)
+        for name in os.listdir(settings.bm25_index_dir):
+            stale = os.path.join(settings.bm25_index_dir, name)
+            if name.startswith(_INDEX_PREFIXES) and stale != path:
+                shutil.rmtree(stale, ignore_errors=True)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить BM25 индекс {path}: {e}")
+
+
+def _create_bm25_index(corpus_tokens: Optional[List], nodes: Optional[List[BM25Node]] = None):
+    """
+    Создает BM25 индекс (bm25s если установлен, иначе rank_bm25 postings).
+
+    Индекс сохраняется в settings.bm25_index_dir под отпечатком корпуса:
+    при неизменной коллекции следующий старт загружает его с диска.
+    corpus_tokens=None: документы nodes токенизируются только если индекса на диске нет.
+    """
+    use_bm25s = _use_bm25s()
+    path = None
+    if settings.bm25_index_dir and nodes:
+        prefix = "bm25s-" if use_bm25s else "postings-"
+        path = os.path.join(settings.bm25_index_dir, f"{prefix}{_corpus_fingerprint(nodes)}")
 
-def _create_bm25_index(corpus_tokens: List) -> 'BM25Okapi':
-    """Создает BM25 индекс."""
-    from rank_bm25 import BM25Okapi
     with timed_operation(BM25_LATENCY):
-        return BM25Okapi(corpus_tokens)
+        if path and os.path.isdir(path):
+            try:
+                index = bm25s.BM25.load(path, mmap=True) if use_bm25s else _PostingsBM25.load(path)
+                logger.info(f"BM25 индекс загружен с диска: {path}")
+                return index
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить BM25 индекс {path}: {e}, пересоздаю")
+
+        if corpus_tokens is None:
+            corpus_tokens = _tokenize_bm25_corpus(nodes)
+
+        if use_bm25s:
+            index = bm25s.BM25(k1=settings.bm25_k1, b=settings.bm25_b)
+            index.index(corpus_tokens, show_progress=False)
+        else:
+            from rank_bm25 import BM25Okapi
+            index = _PostingsBM25(BM25Okapi(corpus_tokens, k1=settings.bm25_k1, b=settings.bm25_b))
+
+    if path:
+        _persist_index(index, path)
+    return index
 
 
 def init_bm25_retriever(collection_name: str = None) -> bool:
     """
-    Инициализирует BM25 index из документов Qdrant используя rank_bm25.
+    Инициализирует BM25 index из документов Qdrant (bm25s / rank_bm25 / sparse векторы Qdrant).
+
+    Потокобезопасно: при конкурентных вызовах индекс строится один раз.
 
     Args:
         collection_name: Имя коллекции Qdrant
@@ -173,8 +737,6 @@ def init_bm25_retriever(collection_name: str = None) -> bool:
     Returns:
         True если успешно, False если ошибка
     """
-    global bm25_index, bm25_corpus, bm25_nodes
-
     if not settings.enable_hybrid_search:
         logger.info("Hybrid Search отключен (settings.enable_hybrid_search=false)")
         return False
@@ -182,17 +744,39 @@ def init_bm25_retriever(collection_name: str = None) -> bool:
     if bm25_index is not None:
         return True
 
-    try:
-        # 1. Загружаем документы
-        all_data = _load_documents_from_qdrant(collection_name, 50000)
+    with _bm25_init_lock:
+        # Индекс мог быть построен, пока ждали lock
+        if bm25_index is not None:
+            return True
+        return _init_bm25_locked(collection_name)
+
+
+def _init_bm25_locked(collection_name: Optional[str]) -> bool:
+    """Строит BM25 индекс (вызывается под _bm25_init_lock)."""
+    global bm25_index, bm25_nodes
+
+    if settings.bm25_backend.lower() == "qdrant":
+        if has_sparse_bm25_vectors():
+            bm25_index = _QdrantSparseBM25()
+            bm25_nodes = []
+            _bm25_cache.clear()
+            _space_masks.clear()
+            logger.info("✅ BM25: поиск по sparse векторам Qdrant, локальный индекс не строится")
+            return True
+        logger.warning(
+            f"В коллекции нет sparse вектора '{BM25_SPARSE_VECTOR}' (добавляется только при создании "
+            f"коллекции с BM25_BACKEND=qdrant), использую локальный BM25"
+        )
 
-        # 2. Подготавливаем корпус
-        corpus_tokens, nodes = _prepare_bm25_corpus(all_data)
+    try:
+        # 1. Загружаем документы постранично сразу в nodes (без повторного разбиения)
+        nodes = _load_bm25_nodes_from_qdrant(collection_name, 50000)
 
-        # 3. Создаем индекс
-        bm25_index = _create_bm25_index(corpus_tokens)
-        bm25_corpus = corpus_tokens
+        # 2. Создаем индекс (токенизация только если индекс не найден на диске)
+        bm25_index = _create_bm25_index(None, nodes)
         bm25_nodes = nodes
+        _bm25_cache.clear()
+        _space_masks.clear()
 
         logger.info(f"✅ BM25 индекс создан. Индексировано {len(nodes)} документов.")
         return True
@@ -205,17 +789,67 @@ def init_bm25_retriever(collection_name: str = None) -> bool:
         return False
 
 
+async def warmup_bm25(collection_name: str = None) -> bool:
+    """Построить BM25 индекс в отдельном потоке, не блокируя event loop."""
+    return await asyncio.to_thread(init_bm25_retriever, collection_name)
+
+
+def _single_list_rrf(
+    results: List[Dict[str, Any]],
+    weight: float,
+    k: int,
+    from_vector: bool,
+    limit: Optional[int]
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    RRF для одного непустого списка: порядок совпадает с рангами, сортировка не нужна.
+
+    None - в списке повторяются id (их scores суммируются общим путем).
+    """
+    formatted_results = []
+    seen = set()
+    for rank, result in enumerate(results, start=1):
+        doc_id = result.get('id')
+        if not doc_id:
+            continue
+        if doc_id in seen:
+            return None
+        seen.add(doc_id)
+        score = weight / (k + rank)
+        formatted_results.append({
+            'id': doc_id,
+            'text': result.get('text', ''),
+            'metadata': result.get('metadata', _EMPTY_METADATA) if from_vector else result.get('payload', _EMPTY_METADATA),
+            'distance': 1.0 - score,
+            'rrf_score': score,
+            'vector_rank': rank if from_vector else None,
+            'bm25_rank': None if from_vector else rank
+        })
+
+    if limit is not None and limit > 0:
+        return formatted_results[:limit]
+    return formatted_results
+
+
 def reciprocal_rank_fusion(
     vector_results: List[Dict[str, Any]],
     bm25_results: List[Dict[str, Any]],
     k: int = None,
     vector_weight: float = None,
-    bm25_weight: float = None
+    bm25_weight: float = None,
+    limit: Optional[int] = None
 ) -> List[Dict[str, Any]]:
     """
     Объединяет результаты векторного и BM25 поиска через Reciprocal Rank Fusion (RRF).
 
     RRF Score = SUM(weight * (1 / (k + rank))) для каждого результата
+
+    limit: вернуть только top-limit (частичный отбор вместо полной сортировки).
+    RRF точен только в пределах переданных списков: документы глубже входного среза
+    (limit * 3 у BM25) не участвуют, поэтому ранги глубже этого среза приближенные.
+
+    Текст и метаданные не копируются: результаты ссылаются на объекты входных списков
+    (вызывающие не должны их изменять).
     """
     if not vector_results and not bm25_results:
         return []
@@ -228,70 +862,231 @@ def reciprocal_rank_fusion(
     if bm25_weight is None:
         bm25_weight = settings.hybrid_bm25_weight
 
-    # Словарь для накопления RRF scores
-    rrf_scores = defaultdict(lambda: {
-        'id': None,
-        'text': '',
-        'metadata': {},
-        'vector_rank': None,
-        'bm25_rank': None,
-        'rrf_score': 0.0
-    })
-
-    # Обрабатываем результаты векторного поиска
-    for rank, result in enumerate(vector_results, start=1):
-        doc_id = result.get('id')
-        if doc_id:
-            rrf_scores[doc_id]['id'] = doc_id
-            rrf_scores[doc_id]['text'] = result.get('text', '')
-            rrf_scores[doc_id]['metadata'] = result.get('metadata', {})
-            rrf_scores[doc_id]['vector_rank'] = rank
-            # RRF формула: weight * (1 / (k + rank))
-            rrf_scores[doc_id]['rrf_score'] += vector_weight * (1.0 / (k + rank))
-
-    # Обрабатываем результаты BM25 поиска
-    for rank, result in enumerate(bm25_results, start=1):
-        doc_id = result.get('id')
-        if doc_id:
-            if doc_id not in rrf_scores:
-                # Новый результат из BM25
-                rrf_scores[doc_id] = {
-                    'id': doc_id,
-                    'text': result.get('text', ''),
-                    'metadata': result.get('payload', {}),  # payload = metadata
-                    'vector_rank': None,
-                    'bm25_rank': rank,
-                    'rrf_score': 0.0
-                }
+    # Один из списков пуст (BM25 упал, фильтр отсек все): слияние не нужно
+    if not bm25_results or not vector_results:
+        if vector_results:
+            single = _single_list_rrf(vector_results, vector_weight, k, True, limit)
+        else:
+            single = _single_list_rrf(bm25_results, bm25_weight, k, False, limit)
+        if single is not None:
+            return single
+
+    # Structure of arrays: позиция документа -> score и ранги (0 = отсутствует в списке).
+    # sources - ссылки на входные dict: при слиянии копируются только скаляры
+    sources: Dict[Any, Dict[str, Any]] = {}
+    id_to_idx: Dict[Any, int] = {}
+
+    def _positions(results: List[Dict[str, Any]], from_vector: bool) -> Tuple[List[int], List[int]]:
+        idx, ranks = [], []
+        for rank, result in enumerate(results, start=1):
+            doc_id = result.get('id')
+            if not doc_id:
+                continue
+            # Один поиск в dict на документ: позиция выдается при первом появлении
+            pos = id_to_idx.setdefault(doc_id, len(id_to_idx))
+            # Текст/метаданные берутся из векторного результата, если он есть
+            if from_vector:
+                sources[doc_id] = result
             else:
-                rrf_scores[doc_id]['bm25_rank'] = rank
-
-            # RRF формула: weight * (1 / (k + rank))
-            rrf_scores[doc_id]['rrf_score'] += bm25_weight * (1.0 / (k + rank))
-
-    # Сортируем по RRF score (убывание)
-    merged_results = sorted(
-        rrf_scores.values(),
-        key=lambda x: x['rrf_score'],
-        reverse=True
-    )
+                sources.setdefault(doc_id, result)
+            idx.append(pos)
+            ranks.append(rank)
+        return idx, ranks
+
+    vector_idx, vector_ranks = _positions(vector_results, True)
+    bm25_idx, bm25_ranks = _positions(bm25_results, False)
+
+    n_docs = len(id_to_idx)
+    rrf_scores = np.zeros(n_docs, dtype=np.float64)
+    vector_rank_arr = np.zeros(n_docs, dtype=np.int64)
+    bm25_rank_arr = np.zeros(n_docs, dtype=np.int64)
+
+    # RRF формула: weight * (1 / (k + rank)); bincount суммирует повторы id
+    # (векторизованный scatter-add, в разы быстрее небуферизованного np.add.at)
+    if vector_idx:
+        ranks = np.asarray(vector_ranks, dtype=np.float64)
+        rrf_scores += np.bincount(vector_idx, weights=vector_weight / (k + ranks), minlength=n_docs)
+        vector_rank_arr[vector_idx] = vector_ranks
+    if bm25_idx:
+        ranks = np.asarray(bm25_ranks, dtype=np.float64)
+        rrf_scores += np.bincount(bm25_idx, weights=bm25_weight / (k + ranks), minlength=n_docs)
+        bm25_rank_arr[bm25_idx] = bm25_ranks
+
+    # Сортируем по RRF score (убывание); при равенстве - порядок появления
+    if limit is not None and 0 < limit < n_docs:
+        # O(N) отбор top-limit, сортируется только он
+        candidates = np.argpartition(-rrf_scores, limit - 1)[:limit]
+        order = candidates[np.lexsort((candidates, -rrf_scores[candidates]))]
+    else:
+        order = np.argsort(-rrf_scores, kind='stable')
+    doc_ids = list(id_to_idx)
 
     # Преобразуем в формат, совместимый с существующим кодом
     formatted_results = []
-    for result in merged_results:
+    for i in order.tolist():
+        doc_id = doc_ids[i]
+        source = sources[doc_id]
+        from_vector = vector_rank_arr[i] > 0
+        score = float(rrf_scores[i])
         formatted_results.append({
-            'id': result['id'],
-            'text': result['text'],
-            'metadata': result['metadata'],
-            'distance': 1.0 - result['rrf_score'],  # Инвертируем для совместимости (меньше = лучше)
-            'rrf_score': result['rrf_score'],
-            'vector_rank': result['vector_rank'],
-            'bm25_rank': result['bm25_rank']
+            'id': doc_id,
+            'text': source.get('text', ''),
+            'metadata': source.get('metadata', _EMPTY_METADATA) if from_vector else source.get('payload', _EMPTY_METADATA),  # payload = metadata
+            'distance': 1.0 - score,  # Инвертируем для совместимости (меньше = лучше)
+            'rrf_score': score,
+            'vector_rank': int(vector_rank_arr[i]) if from_vector else None,
+            'bm25_rank': int(bm25_rank_arr[i]) or None
         })
 
     return formatted_results
 
 
+def _space_mask(space: str) -> np.ndarray:
+    """Маска документов индекса из пространства space (строится один раз на пространство)."""
+    mask = _space_masks.get(space)
+    if mask is None or len(mask) != len(bm25_nodes):
+        mask = np.fromiter(
+            (node.payload.get('space') == space for node in bm25_nodes),
+            dtype=bool, count=len(bm25_nodes)
+        )
+        _space_masks[space] = mask
+    return mask
+
+
+def _top_bm25_results(
+    doc_scores: np.ndarray,
+    bm25_limit: int,
+    space_filter: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Top bm25_limit документов с положительным score (только из space_filter, если задан)."""
+    if space_filter:
+        # Фильтр до отбора top-k: все bm25_limit кандидатов из нужного пространства
+        doc_scores = np.where(_space_mask(space_filter), doc_scores, 0.0)
+    # O(N) отбор top-k через argpartition, сортируется только top-k
+    if bm25_limit < len(doc_scores):
+        candidates = np.argpartition(-doc_scores, bm25_limit - 1)[:bm25_limit]
+    else:
+        candidates = np.arange(len(doc_scores))
+    top_indices = candidates[np.argsort(-doc_scores[candidates], kind='stable')]
+    top_indices = top_indices[doc_scores[top_indices] > 0]
+
+    res = []
+    for idx in top_indices.tolist():
+        node = bm25_nodes[idx]
+        # Dict только для top-k результатов (формат, совместимый с PointStruct)
+        res.append({
+            'id': node.id,
+            'score': float(doc_scores[idx]),
+            'payload': node.payload,
+            'text': node.text
+        })
+    return res
+
+
+def _run_bm25_sync(query: str, limit: int, space_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+    """BM25 поиск top (limit * 3) документов (CPU bound, выполняется в потоке вызывающего)."""
+    tokenized_query = _tokenize_query(query)
+    bm25_limit = limit * 3
+    cache_key = (tokenized_query, bm25_limit, space_filter)
+    cached = _bm25_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if isinstance(bm25_index, _QdrantSparseBM25):
+        with timed_operation(BM25_LATENCY):
+            res = bm25_index.search(tokenized_query, bm25_limit, space_filter)
+        _bm25_cache.put(cache_key, res)
+        return res
+
+    with timed_operation(BM25_LATENCY):
+        doc_scores = np.asarray(bm25_index.get_scores(list(tokenized_query)))
+
+    res = _top_bm25_results(doc_scores, bm25_limit, space_filter)
+    _bm25_cache.put(cache_key, res)
+    return res
+
+
+def _bm25_scores_batch(queries: List[Tuple[str, ...]]):
+    """Scores нескольких токенизированных запросов (один проход по postings, если индекс умеет)."""
+    queries = [list(tokens) for tokens in queries]
+    # Batch API есть только у postings backend (bm25s считает запросы по одному)
+    get_scores_batch = getattr(bm25_index, 'get_scores_batch', None)
+    with timed_operation(BM25_LATENCY):
+        if get_scores_batch is not None:
+            return get_scores_batch(queries)
+        return [np.asarray(bm25_index.get_scores(q)) for q in queries]
+
+
+def _score_bm25_batch(items: List[Tuple[Tuple[str, ...], int, Optional[str]]]) -> List[List[Dict[str, Any]]]:
+    """Один проход get_scores_batch по запросам батча, результаты кладутся в кэш."""
+    scores = _bm25_scores_batch([tokens for tokens, _, _ in items])
+    results = []
+    for row, (tokens, limit, space_filter) in zip(scores, items):
+        res = _top_bm25_results(row, limit, space_filter)
+        _bm25_cache.put((tokens, limit, space_filter), res)
+        results.append(res)
+    return results
+
+
+class _BM25Batcher(MicroBatcher):
+    """
+    Micro-batching BM25 запросов.
+
+    Запросы, пришедшие одновременно, собираются в окне max_wait_ms (до max_batch)
+    и считаются одним проходом get_scores_batch: общие термины не пересчитываются.
+    """
+
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        super().__init__(_score_bm25_batch, max_batch, max_wait_ms, name="bm25-batcher")
+
+    def submit(self, tokens: Tuple[str, ...], bm25_limit: int, space_filter: Optional[str] = None) -> Future:
+        return super().submit((tokens, bm25_limit, space_filter))
+
+
+_bm25_batcher = _BM25Batcher(
+    settings.bm25_dynamic_batch_max_size,
+    settings.bm25_dynamic_batch_wait_ms
+) if settings.bm25_dynamic_batch else None
+
+
+def _submit_bm25(query: str, limit: int, space_filter: Optional[str] = None) -> Future:
+    """BM25 поиск в фоне: через batcher (если включен) или выделенный executor."""
+    if _bm25_batcher is None or isinstance(bm25_index, _QdrantSparseBM25):
+        return _bm25_executor.submit(_run_bm25_sync, query, limit, space_filter)
+
+    tokenized_query = _tokenize_query(query)
+    cached = _bm25_cache.get((tokenized_query, limit * 3, space_filter))
+    if cached is not None:
+        future: Future = Future()
+        future.set_result(cached)
+        return future
+    return _bm25_batcher.submit(tokenized_query, limit * 3, space_filter)
+
+
+def _fuse_results(
+    query_intent: QueryIntent,
+    vector_results: List[Dict[str, Any]],
+    bm25_results: List[Dict[str, Any]],
+    vector_weight: float,
+    bm25_weight: float,
+    limit: int
+) -> List[Dict[str, Any]]:
+    """Объединение через RRF (CPU bound, достаточно быстро для вызова в event loop)."""
+    with timed_operation(RRF_LATENCY):
+        merged_results = reciprocal_rank_fusion(
+            vector_results,
+            bm25_results,
+            k=settings.hybrid_rrf_k,
+            vector_weight=vector_weight,
+            bm25_weight=bm25_weight,
+            limit=limit
+        )
+
+    logger.info(f"Hybrid Search ({query_intent.value}): Vector={len(vector_results)}, BM25={len(bm25_results)}, Merged={len(merged_results)}")
+
+    return merged_results[:limit]
+
+
 def hybrid_search(
     query: str,
     collection_name: str,
@@ -300,90 +1095,149 @@ def hybrid_search(
     limit: int = 20
 ) -> List[Dict[str, Any]]:
     """
-    Выполняет Hybrid Search: объединяет Vector + BM25 результаты через RRF. (Sync wrapper)
+    Выполняет Hybrid Search: объединяет Vector + BM25 результаты через RRF. (Sync)
+
+    BM25 выполняется в потоке вызывающего, без создания event loop
+    (можно вызывать и из кода, уже работающего внутри event loop).
     """
-    # Для обратной совместимости
-    return asyncio.run(hybrid_search_async(query, collection_name, vector_results, space_filter, limit))
+    if not settings.enable_hybrid_search:
+        return vector_results[:limit]
+
+    query_intent = detect_query_intent(query)
+    vector_weight, bm25_weight = get_adaptive_weights(query_intent)
+
+    if bm25_weight <= 0.01:
+        return vector_results[:limit]
+
+    try:
+        if bm25_index is None and not init_bm25_retriever(collection_name):
+            return vector_results[:limit]
+
+        with tracer.start_as_current_span("hybrid_search_bm25"):
+            bm25_results = _run_bm25_sync(query, limit, space_filter)
+            return _fuse_results(query_intent, vector_results, bm25_results, vector_weight, bm25_weight, limit)
+
+    except Exception as e:
+        logger.warning(f"Ошибка BM25 поиска: {e}, возвращаю только векторные результаты")
+        return vector_results[:limit]
 
 
 async def hybrid_search_async(
     query: str,
     collection_name: str,
-    vector_results: List[Dict[str, Any]],
+    vector_results: Optional[List[Dict[str, Any]]] = None,
     space_filter: Optional[str] = None,
-    limit: int = 20
+    limit: int = 20,
+    vector_retriever: Optional[Callable[[str, int], Awaitable[List[Dict[str, Any]]]]] = None
 ) -> List[Dict[str, Any]]:
     """
     Выполняет Hybrid Search: объединяет Vector + BM25 результаты через RRF. (Async)
+
+    Вместо готовых vector_results можно передать vector_retriever(query, top_k):
+    векторный поиск тогда выполняется параллельно с BM25 (latency = max, а не сумма).
     """
+    async def _vector_search(top_k: int) -> List[Dict[str, Any]]:
+        if vector_results is not None or vector_retriever is None:
+            return vector_results or []
+        return await vector_retriever(query, top_k)
+
     if not settings.enable_hybrid_search:
-        return vector_results[:limit]
+        return (await _vector_search(limit))[:limit]
 
-    # Определяем интент запроса для весов
+    # Определяем интент запроса для весов (lru_cache, до старта векторного поиска)
     query_intent = detect_query_intent(query)
     vector_weight, bm25_weight = get_adaptive_weights(query_intent)
 
-    # Если BM25 вес 0, возвращаем только векторный поиск
+    # Если BM25 вес 0, возвращаем только векторный поиск (без запаса кандидатов для RRF)
     if bm25_weight <= 0.01:
-        return vector_results[:limit]
+        return (await _vector_search(limit))[:limit]
+
+    # Векторный поиск стартует сразу и идет параллельно с инициализацией и поиском BM25
+    vector_task = asyncio.ensure_future(_vector_search(limit * 3))
 
     try:
         # Инициализируем BM25 если еще нет (ленивая загрузка)
         if bm25_index is None:
-            # BM25 init is sync and fast if using cached points, but slow if loading from DB.
-            # Assuming it's already initialized or fast enough.
-            # Ideally init_bm25_retriever should be run at startup.
-            success = init_bm25_retriever(collection_name)
+            # Обычно индекс строится при старте сервера; иначе строим в потоке,
+            # не блокируя event loop (конкурентные запросы ждут один и тот же lock)
+            success = await warmup_bm25(collection_name)
             if not success:
-                return vector_results[:limit]
+                return (await vector_task)[:limit]
 
         with tracer.start_as_current_span("hybrid_search_bm25"):
-            # 1. BM25 Поиск (CPU bound, run in executor)
-            try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-            def _run_bm25():
-                tokenized_query = simple_tokenize(query)
-                bm25_limit = limit * 3
-                with timed_operation(BM25_LATENCY):
-                    doc_scores = bm25_index.get_scores(tokenized_query)
-                top_indices = sorted(range(len(doc_scores)), key=lambda i: doc_scores[i], reverse=True)[:bm25_limit]
-
-                res = []
-                for idx in top_indices:
-                    score = doc_scores[idx]
-                    if score <= 0: continue
-                    point = bm25_nodes[idx]
-                    res.append({
-                        'id': point['id'],
-                        'score': score,
-                        'payload': point['payload'],
-                        'text': point['text']
-                    })
-                return res
-
-            bm25_results = await loop.run_in_executor(None, _run_bm25)
-
-            # 2. Объединение через RRF (CPU bound, fast enough to run in thread or sync)
-            with timed_operation(RRF_LATENCY):
-                merged_results = reciprocal_rank_fusion(
-                    vector_results,
-                    bm25_results,
-                    k=settings.hybrid_rrf_k,
-                    vector_weight=vector_weight,
-                    bm25_weight=bm25_weight
-                )
-
-        logger.info(f"Hybrid Search ({query_intent.value}): Vector={len(vector_results)}, BM25={len(bm25_results)}, Merged={len(merged_results)}")
-
-        return merged_results[:limit]
+            # BM25 поиск (CPU bound) в executor/batcher, параллельно с векторным поиском
+            vector_hits, bm25_results = await asyncio.gather(
+                vector_task, asyncio.wrap_future(_submit_bm25(query, limit, space_filter))
+            )
+            return _fuse_results(query_intent, vector_hits, bm25_results, vector_weight, bm25_weight, limit)
 
     except Exception as e:
         logger.warning(f"Ошибка BM25 поиска: {e}, возвращаю только векторные результаты")
-        return vector_results[:limit]
+        # Ошибка самого векторного поиска пробрасывается из vector_task
+        return (await vector_task)[:limit]
+
+
+def hybrid_search_batch(
+    queries: List[str],
+    collection_name: str,
+    vector_results_batch: List[List[Dict[str, Any]]],
+    space_filter: Optional[str] = None,
+    limit: int = 20
+) -> List[List[Dict[str, Any]]]:
+    """
+    Hybrid Search для нескольких запросов (query expansion, переформулировки). (Sync)
+
+    BM25 scores всех запросов без кэша считаются одним вызовом get_scores_batch;
+    RRF выполняется для каждого запроса отдельно. Результаты в порядке queries.
+    """
+    if not settings.enable_hybrid_search:
+        return [vector_results[:limit] for vector_results in vector_results_batch]
+
+    intents = [detect_query_intent(query) for query in queries]
+    weights = [get_adaptive_weights(intent) for intent in intents]
+    bm25_rows = [i for i, (_, bm25_weight) in enumerate(weights) if bm25_weight > 0.01]
+
+    try:
+        if bm25_rows and bm25_index is None and not init_bm25_retriever(collection_name):
+            bm25_rows = []
+
+        bm25_limit = limit * 3
+        bm25_results: Dict[int, List[Dict[str, Any]]] = {}
+        pending: Dict[Tuple[str, ...], List[int]] = {}
+        for i in bm25_rows:
+            tokens = _tokenize_query(queries[i])
+            cached = _bm25_cache.get((tokens, bm25_limit, space_filter))
+            if cached is not None:
+                bm25_results[i] = cached
+            else:
+                # Одинаковые запросы в пачке считаются один раз
+                pending.setdefault(tokens, []).append(i)
+
+        if pending:
+            with tracer.start_as_current_span("hybrid_search_bm25_batch"):
+                if isinstance(bm25_index, _QdrantSparseBM25):
+                    with timed_operation(BM25_LATENCY):
+                        rows = [bm25_index.search(tokens, bm25_limit, space_filter) for tokens in pending]
+                else:
+                    scores = _bm25_scores_batch(list(pending))
+                    rows = [_top_bm25_results(np.asarray(row), bm25_limit, space_filter) for row in scores]
+            for (tokens, indices), res in zip(pending.items(), rows):
+                _bm25_cache.put((tokens, bm25_limit, space_filter), res)
+                for i in indices:
+                    bm25_results[i] = res
+
+    except Exception as e:
+        logger.warning(f"Ошибка BM25 поиска: {e}, возвращаю только векторные результаты")
+        bm25_results = {}
+
+    merged = []
+    for i, vector_results in enumerate(vector_results_batch):
+        if i not in bm25_results:
+            merged.append(vector_results[:limit])
+            continue
+        vector_weight, bm25_weight = weights[i]
+        merged.append(_fuse_results(intents[i], vector_results, bm25_results[i], vector_weight, bm25_weight, limit))
+    return merged
 
 
 def get_hybrid_search_stats() -> Dict[str, Any]:
@@ -396,5 +1250,9 @@ def get_hybrid_search_stats() -> Dict[str, Any]:
         'bm25_weight': settings.hybrid_bm25_weight,
         'rrf_k': settings.hybrid_rrf_k,
         'bm25_initialized': bm25_index is not None,
-        'bm25_documents': len(bm25_corpus) if bm25_corpus else 0
+        'bm25_backend': (
+            'qdrant' if isinstance(bm25_index, _QdrantSparseBM25)
+            else 'rank_bm25' if isinstance(bm25_index, _PostingsBM25) else 'bm25s'
+        ) if bm25_index is not None else None,
+        'bm25_documents': len(bm25_nodes)
     }
@@ -3,14 +3,21 @@ MCP сервер для семантического поиска по Confluenc
 Предоставляет инструменты для Open WebUI через Model Context Protocol.
 """
 from typing import Any, List, Dict
+from hashlib import blake2b
 import logging
 import os
 import re
 import sys
 import time
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
 
+import numpy as np
 from fastmcp import FastMCP
 from qdrant_client import QdrantClient
+from qdrant_client.http import models
 
 # Настройка логирования из ENV
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -30,19 +37,23 @@ from rag_server.config import settings
 
 # Импортируем унифицированный модуль embeddings
 from embeddings import (
-    get_embedding_dimension
+    get_embedding_dimension,
+    warmup as warmup_embeddings,
+    aclose_embed_model
 )
 
 # Импортируем новые модули для продвинутого поиска
 from synonyms_manager import get_synonyms_manager
 
-from advanced_search import extract_keywords
+from advanced_search import extract_keywords, keyword_set
 from query_rewriter import cached_rewrite_query, get_rewriter_stats
 from observability import setup_observability
 from hybrid_search import init_bm25_retriever
 
 # Глобальная переменная для reranker (ленивая инициализация)
 reranker = None
+# Модель загружается одним потоком, конкурентные вызовы ждут ее вместо повторной загрузки
+_reranker_lock = threading.Lock()
 
 
 def init_reranker():
@@ -56,7 +67,14 @@ def init_reranker():
     Модель можно изменить через переменную окружения RE_RANKER_MODEL.
     """
     global reranker
-    if reranker is None:
+    if reranker is not None:
+        logger.debug("Переиспользование кэшированного CrossEncoder")
+        return reranker
+
+    with _reranker_lock:
+        # Модель могла быть загружена, пока ждали lock
+        if reranker is not None:
+            return reranker
         try:
             start_time = time.time()
             from sentence_transformers import CrossEncoder
@@ -103,8 +121,6 @@ def init_reranker():
         except Exception as e:
             logger.warning(f"Не удалось инициализировать reranker: {e}")
             reranker = None
-    else:
-        logger.debug("Переиспользование кэшированного CrossEncoder")
     return reranker
 
 def _get_max_variants(query: str) -> int:
@@ -116,7 +132,27 @@ def _get_max_variants(query: str) -> int:
         return 3
     return 2
 
-def _expand_with_semantic_log(query: str, current_queries: list, max_variants: int):
+class _QueryVariants:
+    """Упорядоченные варианты запроса с O(1) проверкой вхождения (список + set)."""
+
+    __slots__ = ('items', '_seen')
+
+    def __init__(self, first: str):
+        self.items = [first]
+        self._seen = {first}
+
+    def append(self, variant: str) -> None:
+        if variant not in self._seen:
+            self._seen.add(variant)
+            self.items.append(variant)
+
+    def __contains__(self, variant: str) -> bool:
+        return variant in self._seen
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+def _expand_with_semantic_log(query: str, current_queries: _QueryVariants, max_variants: int):
     """Источник 1: Semantic Query Log."""
     if len(current_queries) >= max_variants:
         return
@@ -135,7 +171,18 @@ def _expand_with_semantic_log(query: str, current_queries: list, max_variants: i
     except Exception as e:
         logger.debug(f"Semantic Query Log недоступен: {e}")
 
-def _expand_with_synonyms(query: str, current_queries: list, max_variants: int):
+def _replace_spans(text: str, spans: list, replacement: str) -> str:
+    """Заменяет непересекающиеся отрезки (start, end) текста на replacement."""
+    parts = []
+    prev = 0
+    for start, end in spans:
+        parts.append(text[prev:start])
+        parts.append(replacement)
+        prev = end
+    parts.append(text[prev:])
+    return ''.join(parts)
+
+def _expand_with_synonyms(query: str, current_queries: _QueryVariants, max_variants: int):
     """Источник 2-4: SynonymsManager."""
     if len(current_queries) >= max_variants:
         return
@@ -144,15 +191,27 @@ def _expand_with_synonyms(query: str, current_queries: list, max_variants: int):
         synonyms_manager = get_synonyms_manager()
         from synonyms_manager import TERM_BLACKLIST
 
-        keywords = extract_keywords(query)
+        keywords = [
+            keyword.lower() for keyword in extract_keywords(query)[:3]
+            if keyword.lower() not in TERM_BLACKLIST
+        ]
+        if not keywords:
+            return
         query_lower = query.lower().strip()
 
-        for keyword in keywords[:3]:
+        # Один проход по запросу находит вхождения всех ключевых слов,
+        # варианты собираются нарезкой вместо re.sub на каждую пару (слово, синоним)
+        alternation = '|'.join(re.escape(k) for k in sorted(set(keywords), key=len, reverse=True))
+        spans = defaultdict(list)
+        for match in re.finditer(r'\b(?:' + alternation + r')\b', query_lower):
+            spans[match.group(0)].append(match.span())
+
+        for keyword in dict.fromkeys(keywords):
             if len(current_queries) >= max_variants:
                 break
 
-            keyword_lower = keyword.lower()
-            if keyword_lower in TERM_BLACKLIST:
+            keyword_spans = spans.get(keyword)
+            if not keyword_spans:
                 continue
 
             synonyms = synonyms_manager.get_synonyms(keyword, max_synonyms=2)
@@ -160,8 +219,7 @@ def _expand_with_synonyms(query: str, current_queries: list, max_variants: int):
                 continue
 
             for synonym in synonyms:
-                pattern = r'\b' + re.escape(keyword_lower) + r'\b'
-                expanded = re.sub(pattern, synonym.lower(), query_lower, flags=re.IGNORECASE)
+                expanded = _replace_spans(query_lower, keyword_spans, synonym.lower())
 
                 if expanded != query_lower and expanded not in current_queries:
                     current_queries.append(expanded)
@@ -170,7 +228,7 @@ def _expand_with_synonyms(query: str, current_queries: list, max_variants: int):
     except Exception as e:
         logger.warning(f"Ошибка при расширении запроса через SynonymsManager: {e}")
 
-def _expand_with_rewriting(query: str, current_queries: list, max_variants: int):
+def _expand_with_rewriting(query: str, current_queries: _QueryVariants, max_variants: int):
     """Источник 5: Query Rewriting."""
     if len(current_queries) >= max_variants:
         return
@@ -187,28 +245,75 @@ def _expand_with_rewriting(query: str, current_queries: list, max_variants: int)
     except Exception as e:
         logger.warning(f"Query rewriting failed: {e}")
 
+# LRU кэш expand_query: ключ (нормализованный запрос, space) -> (варианты, timestamp)
+_expand_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_expand_cache_lock = threading.Lock()
+
+
 def expand_query(query: str, space: str = "") -> list[str]:
     """
     Умное расширение запроса с использованием множественных источников синонимов.
+
+    Результат кэшируется (LRU + TTL) по (query.strip(), space): регистр не
+    нормализуется, так как варианты (space, 1С -> 1C) строятся из исходного текста.
+    Повторные запросы не обходят заново Semantic Query Log, синонимы и rewriting.
     """
-    queries = [query]
+    cache_size = settings.query_expansion_cache_size
+    if cache_size <= 0:
+        return _expand_query_uncached(query, space)
+
+    key = (query.strip(), space)
+    now = time.time()
+    with _expand_cache_lock:
+        cached = _expand_cache.get(key)
+        if cached is not None and now - cached[1] < settings.query_expansion_cache_ttl:
+            _expand_cache.move_to_end(key)
+            cached_variants = cached[0]
+        else:
+            cached_variants = None
+
+    if cached_variants is not None:
+        # Первым вариантом идет исходный запрос в том виде, как его прислали
+        # (может отличаться пробелами по краям); совпадающие варианты отбрасываются
+        variants = _QueryVariants(query)
+        for variant in cached_variants[1:]:
+            variants.append(variant)
+        return variants.items[:len(cached_variants)]
+
+    result = _expand_query_uncached(query, space)
+
+    with _expand_cache_lock:
+        _expand_cache[key] = (tuple(result), now)
+        _expand_cache.move_to_end(key)
+        while len(_expand_cache) > cache_size:
+            _expand_cache.popitem(last=False)
+    return result
+
+
+def _expand_query_uncached(query: str, space: str = "") -> list[str]:
+    """Расширение запроса без кэша (все источники вариантов)."""
+    # Дубликаты отсекаются при добавлении, итоговая дедупликация не нужна
+    queries = _QueryVariants(query)
     max_variants = _get_max_variants(query)
+    if max_variants <= 1:
+        return [query]
 
-    # Источник 1: Semantic Query Log
-    _expand_with_semantic_log(query, queries, max_variants)
+    # Источники от дешевых к дорогим: каждый следующий вызывается,
+    # только если бюджет вариантов еще не заполнен
 
-    # Источник 2-4: SynonymsManager
+    # Источник 2-4: SynonymsManager (словари в памяти)
     _expand_with_synonyms(query, queries, max_variants)
 
-    # Источник 5: Query Rewriting
+    # Источник 1: Semantic Query Log (поиск по индексу запросов)
+    _expand_with_semantic_log(query, queries, max_variants)
+
+    # Источник 5: Query Rewriting (LLM вызов - самый дорогой)
     _expand_with_rewriting(query, queries, max_variants)
 
     # Дополнительная обработка (стоп-слова, space, 1С)
     keywords = extract_keywords(query)
     if len(keywords) >= 2:
-        clean_query = ' '.join(keywords)
-        if clean_query not in queries:
-            queries.append(clean_query)
+        queries.append(' '.join(keywords))
 
     query_lower = query.lower()
     if space and len(query_lower.split()) <= 5:
@@ -216,11 +321,11 @@ def expand_query(query: str, space: str = "") -> list[str]:
 
     if any(term in query_lower for term in ['1с', '1c', 'конфигурация']):
         normalized = query.replace('1С', '1C').replace('1с', '1c')
-        if normalized != query and normalized not in queries:
+        if normalized != query:
             queries.append(normalized)
 
-    # Итоговая дедупликация и обрезка
-    result = list(dict.fromkeys(queries))[:max_variants]
+    # Итоговая обрезка
+    result = queries.items[:max_variants]
 
     if len(result) < len(queries):
         logger.debug(
@@ -252,26 +357,56 @@ def calculate_optimal_candidate_limit(query: str, limit: int) -> int:
 
     return min(limit * multiplier, 50)  # Максимум 50 кандидатов
 
+# Паттерн разбиения на предложения (компилируется один раз, вызывается на каждый результат)
+_RE_SENT_SPLIT = re.compile(r'[.!?]+')
+
+_LIST_BULLETS = ('*', '-', '•')
+_DIGITS = '0123456789'
+
+def _is_list_line(line: str) -> bool:
+    """Строка начинается с маркера списка (*, -, •) или номера (1. / 1))."""
+    stripped = line.lstrip()
+    if not stripped:
+        return False
+    if stripped[0] in _LIST_BULLETS:
+        marker_end = stripped[1:2]
+        return not marker_end or marker_end == ')' or marker_end.isspace()
+    head = stripped[:8]
+    rest = head.lstrip(_DIGITS)
+    return len(rest) < len(head) and rest[:1] in ('.', ')')
+
 def detect_content_type(text: str) -> str:
     """
     Определяет тип контента в тексте.
 
+    Один проход по строкам (str методы на C) вместо трех regex по всему тексту.
+
     Returns:
         'table' | 'list' | 'code' | 'plain'
     """
-    import re
-
-    # Таблицы: | col1 | col2 | или строки с табуляцией
-    if re.search(r'\|.*\|.*\|', text) or text.count('\t') > 5:
+    # Таблицы: строки с табуляцией
+    if text.count('\t') > 5:
         return 'table'
 
-    # Списки: 3+ строк начинающихся с *, -, •, цифр
-    list_lines = re.findall(r'^\s*[\*\-•][\s\)]|^\s*\d+[\.\)]', text, re.MULTILINE)
-    if len(list_lines) >= 3:
+    list_lines = 0
+    indent_lines = 0
+    for line in text.splitlines():
+        # Таблицы: | col1 | col2 | - высший приоритет, можно выходить сразу
+        if line.count('|') >= 3:
+            return 'table'
+        # Списки: строки начинающиеся с *, -, •, цифр
+        if _is_list_line(line):
+            list_lines += 1
+        # Код: строки с отступом 4+ пробельных символа
+        if len(line) >= 4 and line[:4].isspace():
+            indent_lines += 1
+
+    # Списки: 3+ строк
+    if list_lines >= 3:
         return 'list'
 
     # Код: ```code``` или 5+ строк с отступами
-    if '```' in text or len(re.findall(r'^\s{4,}', text, re.MULTILINE)) >= 5:
+    if '```' in text or indent_lines >= 5:
         return 'code'
 
     return 'plain'
@@ -361,8 +496,6 @@ def extract_relevant_snippet(text: str, query: str, max_length: int = 400) -> st
     if len(text) <= max_length:
         return text
 
-    import re
-
     # НОВОЕ: Определяем тип контента
     content_type = detect_content_type(text)
 
@@ -385,21 +518,27 @@ def extract_relevant_snippet(text: str, query: str, max_length: int = 400) -> st
 
     # Для обычного текста - стандартная логика
     # Разбиваем на предложения (по точкам, вопросам, восклицаниям)
-    sentences = re.split(r'[.!?]+', text)
+    sentences = _RE_SENT_SPLIT.split(text)
     sentences = [s.strip() for s in sentences if s.strip()]
 
     if not sentences:
         return text[:max_length] + "..."
 
-    # Ключевые слова из запроса
-    query_words = set(extract_keywords(query))
+    # Ключевые слова из запроса. Слово не может совпасть с токеном предложения,
+    # если его нет в тексте даже как подстроки: такие слова отбрасываем сразу (str.find в C)
+    text_lower = text.lower()
+    query_words = frozenset(w for w in keyword_set(query) if w in text_lower)
 
     # Находим предложение с максимальным overlap
     best_idx = 0
     best_score = 0
 
-    for idx, sent in enumerate(sentences):
-        sent_words = set(extract_keywords(sent))
+    # Нет ни одного слова запроса в тексте - overlap везде 0, берем начало текста
+    for idx, sent in enumerate(sentences if query_words else ()):
+        sent_lower = sent.lower()
+        if not any(w in sent_lower for w in query_words):
+            continue
+        sent_words = keyword_set(sent)
         overlap = len(query_words & sent_words)
 
         if overlap > best_score:
@@ -417,6 +556,46 @@ def extract_relevant_snippet(text: str, query: str, max_length: int = 400) -> st
 
     return snippet
 
+_RE_WHITESPACE = re.compile(r'\s+')
+
+
+def _dedup_signature(text: str) -> bytes:
+    """
+    Сигнатура для дедупликации: первые 200 символов после NFKC и схлопывания пробелов.
+
+    NFKC приводит NBSP и совместимые символы к каноническому виду, поэтому
+    "Привет " и "Привет\u00A0" считаются одним текстом. Ключ - 8-байтный blake2b
+    (стабилен между процессами, в отличие от hash()).
+    """
+    signature = _RE_WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text[:200])).strip()
+    return blake2b(signature.encode('utf-8', 'ignore'), digest_size=8).digest()
+
+
+def _simhash(tokens: list) -> int:
+    """64-битный SimHash по 3-словным шинглам (для коротких текстов - по словам)."""
+    if len(tokens) >= 3:
+        features = [' '.join(tokens[i:i + 3]) for i in range(len(tokens) - 2)]
+    else:
+        features = tokens
+
+    # Хэши шинглов -> матрица бит (n, 64); голос бита = (#единиц - #нулей)
+    hashes = np.frombuffer(
+        b''.join(blake2b(f.encode('utf-8'), digest_size=8).digest() for f in features),
+        dtype='>u8'
+    )
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(-1, 64)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(features)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), 'big')
+
+
+if sys.version_info >= (3, 10):
+    def _hamming_distance(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+else:  # Python 3.9: int.bit_count недоступен
+    def _hamming_distance(a: int, b: int) -> int:
+        return bin(a ^ b).count('1')
+
+
 def deduplicate_results(results: list) -> list:
     """
     Удаляет дубликаты результатов на основе схожести текста.
@@ -430,18 +609,32 @@ def deduplicate_results(results: list) -> list:
     if len(results) <= 1:
         return results
 
-    # Дедупликация по hash первых 200 символов
+    # 1. Точные дубликаты: digest первых 200 символов
+    # 2. Почти дубликаты (copy-paste с правками): SimHash, расстояние Хэмминга <= порога
+    max_distance = settings.dedup_simhash_max_distance
     seen_signatures = set()
+    kept_fingerprints = []
     unique_results = []
 
     for r in results:
-        # Берем первые 200 символов как сигнатуру
         text = r.get('text', '')
-        signature = text[:200].strip()
-        text_hash = hash(signature)
+        text_hash = _dedup_signature(text)
+        is_duplicate = text_hash in seen_signatures
+
+        fingerprint = None
+        if not is_duplicate and max_distance > 0:
+            tokens = extract_keywords(text[:500])
+            if tokens:
+                fingerprint = _simhash(tokens)
+                is_duplicate = any(
+                    _hamming_distance(fingerprint, kept) <= max_distance
+                    for kept in kept_fingerprints
+                )
 
-        if text_hash not in seen_signatures:
+        if not is_duplicate:
             seen_signatures.add(text_hash)
+            if fingerprint is not None:
+                kept_fingerprints.append(fingerprint)
             unique_results.append(r)
         else:
             logger.debug(f"Удален дубликат: {r['metadata'].get('title', 'Unknown')}")
@@ -462,78 +655,110 @@ def expand_context_window(result: dict, window_size: int = 1) -> dict:
     Returns:
         Результат с расширенным контекстом
     """
+    expand_context_windows_batch([result], window_size)
+    return result
+
+def expand_context_windows_batch(results: list, window_size: int = 1) -> list:
+    """
+    Расширяет контекст нескольких результатов одним запросом к Qdrant.
+
+    Окна всех результатов объединяются в один фильтр $or (один scroll вместо
+    запроса на каждый результат), соседи группируются по page_id.
+
+    Args:
+        results: Найденные результаты (изменяются на месте)
+        window_size: Количество чанков до/после (1 = ±1 чанк)
+
+    Returns:
+        Те же результаты с expanded_text / context_chunks
+    """
     global qdrant_client
 
     if qdrant_client is None:
-        return result
+        return results
 
     try:
-        if not result or not isinstance(result, dict):
-            return result
+        # (result, page_id, min_chunk, max_chunk) для результатов с page_id
+        windows = []
+        for result in results:
+            if not result or not isinstance(result, dict):
+                continue
 
-        metadata = result.get('metadata')
-        if not metadata or not isinstance(metadata, dict):
-            return result
+            metadata = result.get('metadata')
+            if not metadata or not isinstance(metadata, dict):
+                continue
 
-        chunk_num = metadata.get('chunk', 0)
-        page_id = metadata.get('page_id')
+            page_id = metadata.get('page_id')
+            if not page_id:
+                continue
 
-        if not page_id:
-            return result
+            chunk_num = metadata.get('chunk', 0)
+            windows.append((result, page_id, max(0, chunk_num - window_size), chunk_num + window_size))
 
-        # Запрашиваем соседние чанки из той же страницы
-        min_chunk = max(0, chunk_num - window_size)
-        max_chunk = chunk_num + window_size
+        if not windows:
+            return results
 
-        # Получаем чанки в диапазоне
+        # Получаем чанки всех окон одним запросом (сразу нативный Filter, без разбора dict)
         from qdrant_storage import get_points_by_filter
         neighbors_raw = get_points_by_filter(
-            where_filter={
-                '$and': [
-                    {'page_id': page_id},
-                    {'chunk': {'$gte': min_chunk}},
-                    {'chunk': {'$lte': max_chunk}}
+            where_filter=models.Filter(
+                should=[
+                    models.Filter(must=[
+                        models.FieldCondition(key='page_id', match=models.MatchValue(value=page_id)),
+                        models.FieldCondition(key='chunk', range=models.Range(gte=min_chunk, lte=max_chunk))
+                    ])
+                    for _, page_id, min_chunk, max_chunk in windows
                 ]
-            },
-            limit=100,
-            collection=settings.qdrant_collection
+            ),
+            limit=len(windows) * (2 * window_size + 1),
+            collection=settings.qdrant_collection,
+            # Только поля для склейки окна (_node_content - текст в формате LlamaIndex)
+            with_payload=['text', '_node_content', 'page_id', 'chunk']
         )
-        neighbors = {
-            'documents': [r.get('text', '') for r in neighbors_raw],
-            'metadatas': [r.get('metadata', {}) for r in neighbors_raw]
-        }
 
-        # Безопасная проверка: neighbors может быть None или содержать None поля
-        if (neighbors and
-            neighbors.get('documents') and
-            neighbors.get('metadatas') and
-            len(neighbors['documents']) == len(neighbors['metadatas'])):
+        # page_id -> [(chunk_num, text)]
+        page_chunks = defaultdict(list)
+        for r in neighbors_raw:
+            chunk_meta = r.get('metadata')
+            if chunk_meta and isinstance(chunk_meta, dict):
+                page_chunks[chunk_meta.get('page_id')].append((chunk_meta.get('chunk', 0), r.get('text') or ''))
+
+        for result, page_id, min_chunk, max_chunk in windows:
             # Сортируем по chunk_num
-            chunk_data = []
-            for i, doc in enumerate(neighbors['documents']):
-                if i < len(neighbors['metadatas']):
-                    chunk_meta = neighbors['metadatas'][i]
-                    if chunk_meta and isinstance(chunk_meta, dict):
-                        chunk_data.append({
-                            'chunk_num': chunk_meta.get('chunk', 0),
-                            'text': doc if doc else ''
-                        })
-
-            chunk_data.sort(key=lambda x: x['chunk_num'])
-
-            # Объединяем тексты
-            expanded_text = '\n\n'.join([c['text'] for c in chunk_data])
-            result['expanded_text'] = expanded_text
-            result['context_chunks'] = len(chunk_data)
-
-            logger.debug(f"Context expanded: chunk {chunk_num} + {len(chunk_data)-1} neighbors")
-        else:
-            result['expanded_text'] = result.get('text', '')
-            result['context_chunks'] = 1
+            chunk_data = sorted(
+                (c for c in page_chunks.get(page_id, ()) if min_chunk <= c[0] <= max_chunk),
+                key=lambda c: c[0]
+            )
+            if chunk_data:
+                # Объединяем тексты
+                result['expanded_text'] = '\n\n'.join(text for _, text in chunk_data)
+                result['context_chunks'] = len(chunk_data)
+                logger.debug(f"Context expanded: page {page_id} chunks {min_chunk}-{max_chunk} -> {len(chunk_data)}")
+            else:
+                result['expanded_text'] = result.get('text', '')
+                result['context_chunks'] = 1
 
     except Exception as e:
         logger.warning(f"Context expansion failed: {e}")
 
+    return results
+
+# Ключевые слова в названии страницы (порядок важен: берется первое совпадение)
+_IMPORTANT_TITLE_KEYWORDS = (
+    ('общая информация', 0.3),
+    ('главная', 0.3),
+    ('readme', 0.3),
+    ('getting started', 0.3),
+    ('начало работы', 0.3),
+    ('обзор', 0.2),
+    ('документация', 0.2),
+    ('руководство', 0.2),
+)
+# УЛУЧШЕНИЕ: Metadata Boosting - дополнительный буст для технических меток
+_TECHNICAL_LABELS = ('api', 'technical', 'архитектура', 'development',
+                     'разработка', 'интеграция', 'configuration', 'настройка')
+
+
 def calculate_hierarchy_boost(metadata: dict) -> float:
     """
     Hierarchy Boost - техника из Elasticsearch и Pinecone для учета
@@ -554,18 +779,7 @@ def calculate_hierarchy_boost(metadata: dict) -> float:
 
     # 2. Ключевые слова в названии страницы
     title = metadata.get('title', '').lower()
-    important_keywords = {
-        'общая информация': 0.3,
-        'главная': 0.3,
-        'readme': 0.3,
-        'getting started': 0.3,
-        'начало работы': 0.3,
-        'обзор': 0.2,
-        'документация': 0.2,
-        'руководство': 0.2,
-    }
-
-    for keyword, value in important_keywords.items():
+    for keyword, value in _IMPORTANT_TITLE_KEYWORDS:
         if keyword in title:
             boost += value
             logger.debug(f"Title keyword boost: +{value} for '{keyword}'")
@@ -581,11 +795,7 @@ def calculate_hierarchy_boost(metadata: dict) -> float:
     # 4. Наличие меток (labeled pages обычно важнее)
     labels_str = metadata.get('labels', '').lower()
     if labels_str:
-        # УЛУЧШЕНИЕ: Metadata Boosting - дополнительный буст для технических меток
-        technical_labels = ['api', 'technical', 'архитектура', 'development',
-                           'разработка', 'интеграция', 'configuration', 'настройка']
-
-        has_technical_label = any(label in labels_str for label in technical_labels)
+        has_technical_label = any(label in labels_str for label in _TECHNICAL_LABELS)
         if has_technical_label:
             boost += 0.3  # Увеличенный буст для технических страниц
             logger.debug(f"Technical label boost: +0.3 for labels '{labels_str}'")
@@ -611,8 +821,9 @@ def calculate_breadcrumb_match_score(query: str, breadcrumb: str) -> float:
     if not breadcrumb:
         return 0.0
 
-    query_words = set(extract_keywords(query))
-    breadcrumb_words = set(extract_keywords(breadcrumb))
+    # breadcrumb повторяется у всех чанков одной страницы: множества берутся из кэша
+    query_words = keyword_set(query)
+    breadcrumb_words = keyword_set(breadcrumb)
 
     if not query_words or not breadcrumb_words:
         return 0.0
@@ -1249,6 +1460,10 @@ def enrich_result_with_context(result: dict) -> dict:
 
     return result
 
+_RE_INTENT_NAVIGATIONAL = re.compile(r'\b(где|найди|покажи|страница|документ)\b')
+_RE_INTENT_HOWTO = re.compile(r'\b(как|инструкция|настроить|установить|запустить|сделать)\b')
+_RE_INTENT_FACTUAL = re.compile(r'\b(какой|какая|какие|что|когда|кто|сколько)\b')
+
 def classify_query_intent(query: str) -> dict:
     """
     Классифицирует намерение пользователя для адаптации стратегии поиска.
@@ -1261,12 +1476,10 @@ def classify_query_intent(query: str) -> dict:
             'diversity': int          # Лимит чанков с одной страницы
         }
     """
-    import re
-
     query_lower = query.lower()
 
     # 1. Навигационные запросы: "где", "найди страницу", "покажи"
-    if re.search(r'\b(где|найди|покажи|страница|документ)\b', query_lower):
+    if _RE_INTENT_NAVIGATIONAL.search(query_lower):
         return {
             'type': 'navigational',
             'boost_hierarchy': True,   # Важны корневые страницы
@@ -1275,7 +1488,7 @@ def classify_query_intent(query: str) -> dict:
         }
 
     # 2. How-to запросы: "как", "инструкция", "настроить"
-    if re.search(r'\b(как|инструкция|настроить|установить|запустить|сделать)\b', query_lower):
+    if _RE_INTENT_HOWTO.search(query_lower):
         return {
             'type': 'howto',
             'boost_hierarchy': False,  # Не важна иерархия
@@ -1284,7 +1497,7 @@ def classify_query_intent(query: str) -> dict:
         }
 
     # 3. Фактические запросы: "какой", "что", "когда", "кто"
-    if re.search(r'\b(какой|какая|какие|что|когда|кто|сколько)\b', query_lower):
+    if _RE_INTENT_FACTUAL.search(query_lower):
         return {
             'type': 'factual',
             'boost_hierarchy': False,  # Не важна иерархия
@@ -1362,12 +1575,27 @@ try:
 except Exception as e:
     logger.warning(f"⚠️ Не удалось предзагрузить reranker модель: {e}. Модель загрузится при первом запросе.")
 
+# Прогрев embedding модели (пробный encode), чтобы первый запрос не ждал компиляции
+if settings.embedding_warmup:
+    try:
+        warmup_embeddings()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прогреть embedding модель: {e}")
+
 # Initialize SearchPipeline
 from search_pipeline import SearchPipeline, SearchParams
 search_pipeline = SearchPipeline(qdrant_client, settings.qdrant_collection, reranker)
 logger.info("✅ SearchPipeline initialized")
 
-mcp = FastMCP("Confluence RAG")
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    """Закрывает keep-alive пулы embedding API в том же event loop при остановке сервера."""
+    try:
+        yield
+    finally:
+        await aclose_embed_model()
+
+mcp = FastMCP("Confluence RAG", lifespan=_lifespan)
 
 def _extract_space_from_query(query: str, current_space: str) -> tuple[str, str]:
     """Извлечь название space из текста запроса."""
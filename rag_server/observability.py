@@ -69,6 +69,23 @@ try:
         buckets=[0.05, 0.1, 0.3, 0.5, 1.0, 2.0]
     )
 
+    EMBEDDING_BATCH_SIZE = Histogram(
+        'confluence_embedding_batch_size',
+        'Number of texts per embedding batch call',
+        buckets=[1, 8, 16, 32, 64, 128, 256, 512]
+    )
+
+    EMBEDDING_BATCH_LATENCY = Histogram(
+        'confluence_embedding_batch_latency_seconds',
+        'Latency of a single embedding batch call (encode / embeddings.create)',
+        buckets=[0.01, 0.05, 0.1, 0.3, 0.5, 1.0, 2.0, 5.0]
+    )
+
+    EMBEDDING_QUEUE_DEPTH = Gauge(
+        'confluence_embedding_queue_depth',
+        'Pending single-text requests in the embedding dynamic batcher'
+    )
+
     RRF_LATENCY = Histogram(
         'confluence_rrf_latency_seconds',
         'RRF merge latency in seconds',
@@ -148,8 +165,9 @@ except ImportError:
     # Dummy metrics
     class DummyMetric:
         def observe(self, value: float) -> None: pass
-        def inc(self) -> None: pass
+        def inc(self, amount: float = 1) -> None: pass
         def dec(self) -> None: pass
+        def set(self, value: float) -> None: pass
         def labels(self, **kwargs) -> 'DummyMetric': return self
         def info(self, info: dict) -> None: pass
 
@@ -163,6 +181,10 @@ except ImportError:
     BM25_LATENCY = DummyMetric()
     VECTOR_LATENCY = DummyMetric()
     EMBEDDING_LATENCY = DummyMetric()
+    EMBEDDING_BATCH_SIZE = DummyMetric()
+    EMBEDDING_BATCH_LATENCY = DummyMetric()
+    EMBEDDING_QUEUE_DEPTH = DummyMetric()
+    EMBEDDING_CACHE_HITS = DummyMetric()
     RRF_LATENCY = DummyMetric()
     CACHE_HITS = DummyMetric()
     CACHE_MISSES = DummyMetric()
@@ -6,9 +6,15 @@ import os
 import logging
 import json
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
 from qdrant_client import QdrantClient, AsyncQdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, Range, PayloadSchemaType
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, Range, PayloadSchemaType,
+    SparseVectorParams, SparseVector, Modifier,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    BinaryQuantization, BinaryQuantizationConfig,
+    SearchParams, QuantizationSearchParams
+)
 
 # Инициализация logger (должен быть до использования)
 logger = logging.getLogger(__name__)
@@ -53,6 +59,43 @@ from rag_server.config import settings
 qdrant_client = None
 async_qdrant_client = None
 
+# Имя sparse вектора для серверного BM25 (settings.bm25_backend=qdrant)
+BM25_SPARSE_VECTOR = "bm25"
+
+
+def _use_qdrant_bm25() -> bool:
+    return settings.enable_hybrid_search and settings.bm25_backend.lower() == "qdrant"
+
+
+def has_sparse_bm25_vectors(client: Optional[QdrantClient] = None) -> bool:
+    """Есть ли в коллекции sparse вектор для BM25 (добавляется только при создании коллекции)."""
+    client = client or init_qdrant_client()
+    try:
+        sparse_vectors = client.get_collection(settings.qdrant_collection).config.params.sparse_vectors
+        return bool(sparse_vectors) and BM25_SPARSE_VECTOR in sparse_vectors
+    except Exception as e:
+        logger.warning(f"Не удалось проверить sparse векторы коллекции: {e}")
+        return False
+
+def _grpc_client_kwargs() -> Dict[str, Any]:
+    """Параметры gRPC транспорта (QDRANT_PREFER_GRPC): один долгоживущий канал с keepalive."""
+    if not settings.qdrant_prefer_grpc:
+        return {}
+    return {
+        'prefer_grpc': True,
+        'grpc_port': settings.qdrant_grpc_port,
+        'grpc_options': {
+            'grpc.keepalive_time_ms': 30000,
+            'grpc.keepalive_timeout_ms': 10000,
+            'grpc.keepalive_permit_without_calls': 1,
+        },
+    }
+
+def _transport_port() -> str:
+    if settings.qdrant_prefer_grpc:
+        return f"{settings.qdrant_grpc_port} (gRPC)"
+    return str(settings.qdrant_port)
+
 def init_qdrant_client() -> QdrantClient:
     """Инициализировать синхронный Qdrant клиент."""
     global qdrant_client
@@ -62,9 +105,10 @@ def init_qdrant_client() -> QdrantClient:
                 host=settings.qdrant_host, 
                 port=settings.qdrant_port, 
                 timeout=30,
-                api_key=settings.qdrant_api_key
+                api_key=settings.qdrant_api_key,
+                **_grpc_client_kwargs()
             )
-            logger.info(f"✅ Qdrant client initialized: {settings.qdrant_host}:{settings.qdrant_port}")
+            logger.info(f"✅ Qdrant client initialized: {settings.qdrant_host}:{_transport_port()}")
         except Exception as e:
             logger.error(f"Ошибка инициализации Qdrant client: {e}")
             raise
@@ -79,14 +123,46 @@ def init_async_qdrant_client() -> AsyncQdrantClient:
                 host=settings.qdrant_host, 
                 port=settings.qdrant_port, 
                 timeout=30,
-                api_key=settings.qdrant_api_key
+                api_key=settings.qdrant_api_key,
+                **_grpc_client_kwargs()
             )
-            logger.info(f"✅ AsyncQdrant client initialized: {settings.qdrant_host}:{settings.qdrant_port}")
+            logger.info(f"✅ AsyncQdrant client initialized: {settings.qdrant_host}:{_transport_port()}")
         except Exception as e:
             logger.error(f"Ошибка инициализации AsyncQdrant client: {e}")
             raise
     return async_qdrant_client
 
+def _quantization_config():
+    """Конфигурация квантизации для новой коллекции (QDRANT_QUANTIZATION)."""
+    mode = (settings.qdrant_quantization or "").lower()
+    if not mode:
+        return None
+    if mode == "int8":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+        )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    logger.warning(f"Неизвестный QDRANT_QUANTIZATION={settings.qdrant_quantization}, квантизация отключена")
+    return None
+
+def build_search_params() -> Optional[SearchParams]:
+    """
+    Параметры dense поиска из настроек: hnsw_ef и поиск по квантованным векторам.
+
+    None, если ничего не задано (используются значения коллекции).
+    """
+    quantization = None
+    if settings.qdrant_quantization:
+        quantization = QuantizationSearchParams(
+            rescore=settings.qdrant_quantization_rescore,
+            oversampling=settings.qdrant_quantization_oversampling
+        )
+    hnsw_ef = settings.qdrant_hnsw_ef or None
+    if hnsw_ef is None and quantization is None:
+        return None
+    return SearchParams(hnsw_ef=hnsw_ef, quantization=quantization)
+
 def init_qdrant_collection(embedding_dim: int) -> bool:
     """
     Инициализировать коллекцию Qdrant с индексами для метаданных.
@@ -104,7 +180,12 @@ def init_qdrant_collection(embedding_dim: int) -> bool:
                 vectors_config=VectorParams(
                     size=embedding_dim,
                     distance=Distance.COSINE
-                )
+                ),
+                # BM25 на стороне Qdrant: IDF считает сервер, TF-насыщение - клиент при индексации
+                sparse_vectors_config={
+                    BM25_SPARSE_VECTOR: SparseVectorParams(modifier=Modifier.IDF)
+                } if _use_qdrant_bm25() else None,
+                quantization_config=_quantization_config()
             )
             logger.info(f"✅ Created Qdrant collection: {settings.qdrant_collection} (dim={embedding_dim})")
             collection_created = True
@@ -395,7 +476,8 @@ def _search_common(client, query_embedding, limit, where_filter, space, author,
             limit=search_limit,
             query_filter=qdrant_filter,
             with_payload=True,
-            with_vectors=with_vectors
+            with_vectors=with_vectors,
+            search_params=build_search_params()
         )
 
         # 3. Форматирование
@@ -440,7 +522,8 @@ async def _search_common_async(client, query_embedding, limit, where_filter, spa
             limit=search_limit,
             query_filter=qdrant_filter,
             with_payload=True,
-            with_vectors=with_vectors
+            with_vectors=with_vectors,
+            search_params=build_search_params()
         )
 
         # 3. Форматирование
@@ -473,17 +556,33 @@ def get_qdrant_count() -> int:
         logger.error(f"Ошибка получения количества документов: {e}")
         return 0
 
-def get_all_points(limit: int = 10000, include_payload: bool = True) -> Dict[str, Any]:
-    """Получить все точки из Qdrant."""
+def iter_points_batches(
+    limit: int = 10000,
+    include_payload: bool = True,
+    batch_size: Optional[int] = None
+):
+    """
+    Точки коллекции постранично (scroll по next_page_offset), не более limit.
+
+    Yields: dict {'ids', 'documents', 'metadatas'} на каждую страницу:
+    вызывающий обрабатывает страницу и освобождает ее до загрузки всей коллекции.
+    """
     client = init_qdrant_client()
-    try:
-        scroll_result = client.scroll(
+    batch_size = batch_size or settings.qdrant_scroll_batch_size
+    offset = None
+    remaining = limit
+
+    while remaining > 0:
+        points, offset = client.scroll(
             collection_name=settings.qdrant_collection,
-            limit=limit,
+            limit=min(batch_size, remaining),
+            offset=offset,
             with_payload=include_payload,
             with_vectors=False
         )
-        points, _ = scroll_result
+        if not points:
+            break
+        remaining -= len(points)
 
         ids = []
         documents = []
@@ -500,11 +599,24 @@ def get_all_points(limit: int = 10000, include_payload: bool = True) -> Dict[str
                 documents.append("")
                 metadatas.append({})
 
-        return {
+        yield {
             'ids': ids,
             'documents': documents,
             'metadatas': metadatas
         }
+
+        if offset is None:
+            break
+
+
+def get_all_points(limit: int = 10000, include_payload: bool = True) -> Dict[str, Any]:
+    """Получить все точки из Qdrant (постранично, не более limit)."""
+    result = {'ids': [], 'documents': [], 'metadatas': []}
+    try:
+        for batch in iter_points_batches(limit, include_payload):
+            for key in result:
+                result[key].extend(batch[key])
+        return result
     except Exception as e:
         logger.error(f"Ошибка получения всех точек: {e}")
         return {'ids': [], 'documents': [], 'metadatas': []}
@@ -515,6 +627,14 @@ def insert_chunks_batch_to_qdrant(client: QdrantClient, chunks_data: List[Dict[s
     success_count = 0
     error_count = 0
 
+    with_sparse = _use_qdrant_bm25() and has_sparse_bm25_vectors(client)
+    if with_sparse:
+        # Ленивый импорт: hybrid_search импортирует этот модуль
+        try:
+            from hybrid_search import bm25_sparse_vector
+        except ImportError:
+            from rag_server.hybrid_search import bm25_sparse_vector
+
     for i in range(0, len(chunks_data), batch_size):
         batch = chunks_data[i:i + batch_size]
         points = []
@@ -522,9 +642,13 @@ def insert_chunks_batch_to_qdrant(client: QdrantClient, chunks_data: List[Dict[s
         for chunk in batch:
             try:
                 payload = {**chunk['metadata'], "text": chunk['text']}
+                vector = chunk['embedding']
+                if with_sparse:
+                    indices, values = bm25_sparse_vector(chunk['text'])
+                    vector = {"": vector, BM25_SPARSE_VECTOR: SparseVector(indices=indices, values=values)}
                 point = PointStruct(
                     id=chunk['point_id'],
-                    vector=chunk['embedding'],
+                    vector=vector,
                     payload=payload
                 )
                 points.append(point)
@@ -581,17 +705,20 @@ def delete_points_by_page_ids(page_ids: List[str], chunk_size: int = 500) -> int
     return total_deleted
 
 def get_points_by_filter(
-    where_filter: Dict,
+    where_filter: Union[Dict, Filter],
     limit: int = 100,
-    collection: Optional[str] = None
+    collection: Optional[str] = None,
+    with_payload: Union[bool, List[str]] = True
 ) -> List[Dict[str, Any]]:
     """
     Получить точки из Qdrant по фильтру метаданных.
     
     Args:
         where_filter: Фильтр в формате {'$and': [{'page_id': 'xxx'}, {'chunk': {'$gte': 1}}]}
+            либо готовый qdrant Filter (передается как есть)
         limit: Максимальное количество результатов
         collection: Имя коллекции (по умолчанию из settings)
+        with_payload: True или список полей payload, которые нужно вернуть
     
     Returns:
         Список документов с text и metadata
@@ -601,7 +728,9 @@ def get_points_by_filter(
     
     # Парсим фильтр
     must_conditions = []
-    if '$and' in where_filter:
+    if isinstance(where_filter, Filter):
+        pass
+    elif '$and' in where_filter:
         for condition in where_filter['$and']:
             for key, value in condition.items():
                 if isinstance(value, dict):
@@ -644,12 +773,17 @@ def get_points_by_filter(
                     FieldCondition(key=key, match=MatchValue(value=value))
                 )
     
+    if isinstance(where_filter, Filter):
+        scroll_filter = where_filter
+    else:
+        scroll_filter = Filter(must=must_conditions) if must_conditions else None
+
     try:
         scroll_result = client.scroll(
             collection_name=collection_name,
-            scroll_filter=Filter(must=must_conditions) if must_conditions else None,
+            scroll_filter=scroll_filter,
             limit=limit,
-            with_payload=True,
+            with_payload=with_payload,
             with_vectors=False
         )
         points, _ = scroll_result
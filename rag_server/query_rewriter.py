@@ -17,6 +17,7 @@ Features:
 import os
 import time
 import logging
+import functools
 from typing import List, Dict, Any, Optional
 import requests
 from openai import OpenAI
@@ -28,6 +29,9 @@ logger = logging.getLogger(__name__)
 # ========================================
 
 _rewrite_cache: Dict[str, tuple] = {}  # {query: (result, timestamp)}
+# Keep-alive сессия для Ollama: соединение переиспользуется между запросами
+_http_session = requests.Session()
+
 _rewrite_stats: Dict[str, int] = {
     'total_requests': 0,
     'cache_hits': 0,
@@ -72,7 +76,7 @@ def rewrite_query_with_ollama(query: str) -> Optional[List[str]]:
     try:
         logger.debug(f"🔄 Ollama rewriting (model: {ollama_model})")
 
-        response = requests.post(
+        response = _http_session.post(
             f"{ollama_url}/api/generate",
             json={
                 "model": ollama_model,
@@ -125,6 +129,17 @@ def rewrite_query_with_ollama(query: str) -> Optional[List[str]]:
 # OPENROUTER REWRITING
 # ========================================
 
+@functools.lru_cache(maxsize=4)
+def _get_openai_client(api_key: str, api_base: str) -> OpenAI:
+    """
+    OpenAI client, общий для всех вызовов с теми же api_key/api_base.
+
+    Клиент держит пул соединений httpx: без кэша каждый rewrite заново
+    открывал TCP/TLS соединение.
+    """
+    return OpenAI(api_key=api_key, base_url=api_base)
+
+
 def rewrite_query_with_openrouter(query: str, examples: Optional[List[str]] = None) -> Optional[List[str]]:
     """
     Переписать запрос используя OpenRouter (облачный API)
@@ -165,7 +180,7 @@ def rewrite_query_with_openrouter(query: str, examples: Optional[List[str]] = No
     try:
         logger.debug(f"🔄 OpenRouter rewriting (model: {model})")
 
-        client = OpenAI(api_key=api_key, base_url=api_base)
+        client = _get_openai_client(api_key, api_base)
 
         response = client.chat.completions.create(
             model=model,
@@ -2,6 +2,8 @@ import os
 import logging
 import time
 import asyncio
+import functools
+import heapq
 from typing import List, Dict, Optional, Any, Set
 from dataclasses import dataclass, field
 from concurrent.futures import ThreadPoolExecutor
@@ -10,6 +12,8 @@ from qdrant_client import QdrantClient, AsyncQdrantClient
 from qdrant_client.http import models
 
 from embeddings import generate_query_embeddings_batch, generate_query_embeddings_batch_async
+from qdrant_storage import build_search_params
+from rag_server.config import settings
 from observability import tracer
 # Metrics will be imported from observability once added there
 try:
@@ -115,13 +119,13 @@ class SearchPipeline:
 
                 # 5. Reranking (Async/Threaded)
                 if params.use_reranking and self.reranker and unique_results:
-                    unique_results = await self._rerank_async(params.query, unique_results)
+                    final_results = await self._rerank_async(params.query, unique_results, top_k=params.limit)
                 else:
-                    # Sort by vector score if no reranking
-                    unique_results.sort(key=lambda x: x.get("score", 0), reverse=True)
+                    # Top-k by vector score if no reranking (partial selection, no full sort)
+                    final_results = heapq.nlargest(params.limit, unique_results, key=lambda x: x.get("score", 0))
 
                 # 6. Final Filtering
-                final_results = unique_results[:params.limit]
+                final_results = final_results[:params.limit]
 
                 if SEARCH_LATENCY:
                     SEARCH_LATENCY.observe(time.time() - start_time)
@@ -149,6 +153,16 @@ class SearchPipeline:
         start_time = time.time()
         
         with tracer.start_as_current_span("parallel_search_async") as span:
+            if self.async_qdrant_client:
+                # Все варианты запроса одним search_batch: один запрос, сервер ищет параллельно
+                try:
+                    all_results = await self._batch_search_async(queries, embeddings, params)
+                    if VECTOR_SEARCH_LATENCY:
+                        VECTOR_SEARCH_LATENCY.observe(time.time() - start_time)
+                    return all_results
+                except Exception as e:
+                    logger.warning(f"Batch search failed, searching variants separately: {e}")
+
             # Create tasks for all queries
             tasks = [
                 self._single_search_async(queries[i], embeddings[i], params)
@@ -170,22 +184,69 @@ class SearchPipeline:
 
             return all_results
 
+    @staticmethod
+    def _build_filter(params: SearchParams) -> Optional[models.Filter]:
+        """Qdrant filter по space (общий для всех вариантов запроса)"""
+        if not params.space:
+            return None
+        return models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="space",
+                    match=models.MatchValue(value=params.space)
+                )
+            ]
+        )
+
+    @staticmethod
+    def _points_to_results(points, query_text: str) -> List[Dict[str, Any]]:
+        results = []
+        for point in points:
+            payload = point.payload or {}
+            results.append({
+                "text": payload.get("text", ""),
+                "metadata": payload,
+                "score": point.score,
+                "id": point.id,
+                "query_variant": query_text
+            })
+        return results
+
+    async def _batch_search_async(self, queries: List[str], embeddings: List[List[float]], params: SearchParams) -> List[Dict[str, Any]]:
+        """Vector search всех вариантов запроса одним search_batch (Async)"""
+        query_filter = self._build_filter(params)
+        search_limit = params.limit * 3 if params.use_reranking else params.limit
+        search_params = build_search_params()
+        requests = [
+            models.SearchRequest(
+                vector=embedding,
+                filter=query_filter,
+                limit=search_limit,
+                score_threshold=params.threshold if not params.use_reranking else 0.0,
+                with_payload=True,
+                params=search_params
+            )
+            for embedding in embeddings
+        ]
+
+        batch_points = await self.async_qdrant_client.search_batch(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+
+        all_results = []
+        for query_text, points in zip(queries, batch_points):
+            all_results.extend(self._points_to_results(points, query_text))
+        return all_results
+
     async def _single_search_async(self, query_text: str, embedding: List[float], params: SearchParams) -> List[Dict[str, Any]]:
         """Single vector search execution (Async)"""
         # Build filter
-        query_filter = None
-        if params.space:
-            query_filter = models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="space",
-                        match=models.MatchValue(value=params.space)
-                    )
-                ]
-            )
+        query_filter = self._build_filter(params)
 
         # Search limit (fetch more for reranking)
         search_limit = params.limit * 3 if params.use_reranking else params.limit
+        search_params = build_search_params()
 
         try:
             if not self.async_qdrant_client:
@@ -199,7 +260,8 @@ class SearchPipeline:
                         query_vector=embedding,
                         query_filter=query_filter,
                         limit=search_limit,
-                        score_threshold=params.threshold if not params.use_reranking else 0.0
+                        score_threshold=params.threshold if not params.use_reranking else 0.0,
+                        search_params=search_params
                      )
                  )
             else:
@@ -208,20 +270,11 @@ class SearchPipeline:
                     query_vector=embedding,
                     query_filter=query_filter,
                     limit=search_limit,
-                    score_threshold=params.threshold if not params.use_reranking else 0.0
+                    score_threshold=params.threshold if not params.use_reranking else 0.0,
+                    search_params=search_params
                 )
 
-            results = []
-            for point in points:
-                payload = point.payload or {}
-                results.append({
-                    "text": payload.get("text", ""),
-                    "metadata": payload,
-                    "score": point.score,
-                    "id": point.id,
-                    "query_variant": query_text
-                })
-            return results
+            return self._points_to_results(points, query_text)
 
         except Exception as e:
             if QDRANT_CONNECTION_ERRORS:
@@ -239,25 +292,40 @@ class SearchPipeline:
                 unique_results.append(r)
         return unique_results
 
-    async def _rerank_async(self, query: str, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Rerank results using CrossEncoder (Async wrapper for CPU bound task)"""
+    async def _rerank_async(self, query: str, results: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rerank results using CrossEncoder (Async wrapper for CPU bound task)
+
+        top_k: вернуть только k лучших (частичный отбор вместо полной сортировки)
+        """
         if not results:
             return []
 
         start_time = time.time()
         with tracer.start_as_current_span("rerank_results_async") as span:
             try:
-                pairs = [(query, r["text"]) for r in results]
-                
+                # Все кандидаты (со всех вариантов запроса) - одним predict.
+                # Пары отсортированы по длине текста: в batch тексты близкой длины, меньше padding
+                order = sorted(range(len(results)), key=lambda i: len(results[i]["text"]))
+                pairs = [(query, results[i]["text"]) for i in order]
+                predict = functools.partial(
+                    self.reranker.predict,
+                    pairs,
+                    batch_size=settings.reranker_batch_size,
+                    show_progress_bar=False
+                )
+
                 # CrossEncoder is CPU bound, run in executor
                 loop = asyncio.get_event_loop()
-                scores = await loop.run_in_executor(None, self.reranker.predict, pairs)
+                scores = await loop.run_in_executor(None, predict)
 
-                for i, score in enumerate(scores):
+                for i, score in zip(order, scores):
                     results[i]["rerank_score"] = float(score)
                     results[i]["boosted_score"] = float(score) # Alias
 
-                results.sort(key=lambda x: x["rerank_score"], reverse=True)
+                if top_k is not None and top_k < len(results):
+                    results = heapq.nlargest(top_k, results, key=lambda x: x["rerank_score"])
+                else:
+                    results.sort(key=lambda x: x["rerank_score"], reverse=True)
 
                 if RERANK_LATENCY:
                     RERANK_LATENCY.observe(time.time() - start_time)
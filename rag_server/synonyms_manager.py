@@ -13,6 +13,7 @@ import json
 import re
 import logging
 import time
+import threading
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -428,11 +429,14 @@ class SynonymsManager:
 
 # Глобальный экземпляр
 _synonyms_manager = None
+_synonyms_manager_lock = threading.Lock()
 
 def get_synonyms_manager(data_dir: str = "./data") -> SynonymsManager:
-    """Получает глобальный экземпляр SynonymsManager."""
+    """Получает глобальный экземпляр SynonymsManager (создается один раз при конкурентных вызовах)."""
     global _synonyms_manager
     if _synonyms_manager is None:
-        _synonyms_manager = SynonymsManager(data_dir)
+        with _synonyms_manager_lock:
+            if _synonyms_manager is None:
+                _synonyms_manager = SynonymsManager(data_dir)
     return _synonyms_manager
 
@@ -4,6 +4,7 @@
 Модули:
 - keyword_extraction: Извлечение ключевых слов из запросов и текста
 - intent_config: Конфигурация для классификации намерений запросов
+- micro_batcher: Dynamic micro-batching одиночных запросов в фоновом потоке
 """
 
 from .keyword_extraction import (
@@ -22,6 +23,8 @@ from .intent_config import (
     get_adaptive_context_window
 )
 
+from .micro_batcher import MicroBatcher
+
 __all__ = [
     # keyword_extraction
     'extract_keywords',
@@ -35,5 +38,7 @@ __all__ = [
     'get_intent_config',
     'get_adaptive_rerank_threshold',
     'get_adaptive_context_window',
+    # micro_batcher
+    'MicroBatcher',
 ]
 
@@ -0,0 +1,97 @@
+"""
+Dynamic micro-batching для одиночных запросов.
+
+Запросы, пришедшие одновременно из разных обработчиков, собираются в окне
+max_wait_ms (до max_batch штук) и обрабатываются одним вызовом process_fn
+в отдельном daemon потоке. Используется для embeddings и BM25 scoring.
+"""
+
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Собирает элементы в батчи и обрабатывает их одним вызовом process_fn.
+
+    process_fn(items) возвращает результаты в том же порядке, что и items.
+    Future, отмененные до начала обработки (например, await отменен по таймауту),
+    пропускаются. Ошибка доставки результата одному Future не останавливает worker:
+    иначе все последующие submit зависали бы навсегда.
+    """
+
+    def __init__(
+        self,
+        process_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch: int,
+        max_wait_ms: float,
+        name: str = "micro-batcher"
+    ):
+        self._process_fn = process_fn
+        self._max_batch = max(1, max_batch)
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Ставит элемент в очередь, во Future придет его результат process_fn."""
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _collect_batch(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                logger.error(f"Micro-batcher: необработанная ошибка батча: {e}")
+
+    def _process_batch(self, batch: List[Tuple[Any, Future]]) -> None:
+        # Отмененные Future не обрабатываем; оставшиеся переходят в RUNNING и больше не отменяются
+        live = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+
+        try:
+            results = self._process_fn([item for item, _ in live])
+            if len(results) != len(live):
+                raise ValueError(f"process_fn вернул {len(results)} результатов на {len(live)} элементов")
+        except Exception as e:
+            for _, future in live:
+                _deliver(future.set_exception, e)
+            return
+
+        for (_, future), result in zip(live, results):
+            _deliver(future.set_result, result)
+
+
+def _deliver(setter: Callable[[Any], None], value: Any) -> None:
+    """Передает результат в Future; сбой одного Future не должен ронять worker."""
+    try:
+        setter(value)
+    except Exception as e:
+        logger.warning(f"Micro-batcher: не удалось передать результат: {e}")
@@ -111,3 +111,64 @@ async def test_search_pipeline_error_handling(mock_qdrant):
             mock_emb.side_effect = Exception("Embedding error")
             await pipeline.execute_async(params)
 
+
+@pytest.mark.asyncio
+async def test_search_pipeline_rerank_single_batched_call(mock_qdrant):
+    """Кандидаты всех вариантов запроса скорятся одним predict, scores возвращаются своим документам"""
+    reranker = Mock()
+    # Пары приходят отсортированными по длине текста: 'Doc' раньше 'Long document'
+    reranker.predict = Mock(return_value=[0.1, 0.9])
+    pipeline = SearchPipeline(mock_qdrant, "test", reranker)
+    points = [
+        Mock(id='1', score=0.9, payload={'text': 'Long document'}),
+        Mock(id='2', score=0.8, payload={'text': 'Doc'}),
+    ]
+    pipeline.async_qdrant_client = AsyncMock()
+    pipeline.async_qdrant_client.search_batch = AsyncMock(return_value=[points, points])
+
+    params = SearchParams(query="main query", expanded_queries=["variant"], limit=5)
+
+    with patch('rag_server.search_pipeline.generate_query_embeddings_batch_async') as mock_emb:
+        mock_emb.return_value = [[0.1] * 384] * 2
+        results = await pipeline.execute_async(params)
+
+    reranker.predict.assert_called_once()
+    assert reranker.predict.call_args.args[0] == [("main query", "Doc"), ("main query", "Long document")]
+    assert [(r['id'], r['rerank_score']) for r in results] == [('1', 0.9), ('2', 0.1)]
+
+@pytest.mark.asyncio
+async def test_search_pipeline_variants_use_single_search_batch(mock_qdrant):
+    """Варианты запроса ищутся одним search_batch, результаты помечены своим вариантом"""
+    pipeline = SearchPipeline(mock_qdrant, "test")
+    pipeline.async_qdrant_client = AsyncMock()
+    pipeline.async_qdrant_client.search_batch = AsyncMock(return_value=[
+        [Mock(id='1', score=0.9, payload={'text': 'Doc 1'})],
+        [Mock(id='2', score=0.8, payload={'text': 'Doc 2'})],
+    ])
+
+    params = SearchParams(query="main query", expanded_queries=["variant"], limit=5, use_reranking=False)
+
+    with patch('rag_server.search_pipeline.generate_query_embeddings_batch_async') as mock_emb:
+        mock_emb.return_value = [[0.1] * 384] * 2
+        results = await pipeline.execute_async(params)
+
+    pipeline.async_qdrant_client.search_batch.assert_awaited_once()
+    pipeline.async_qdrant_client.search.assert_not_called()
+    assert [(r['id'], r['query_variant']) for r in results] == [('1', 'main query'), ('2', 'variant')]
+
+
+@pytest.mark.asyncio
+async def test_search_pipeline_rerank_top_k(mock_qdrant):
+    """После rerank возвращаются только limit лучших по rerank_score"""
+    reranker = Mock()
+    reranker.predict = Mock(return_value=[0.2, 0.7, 0.5])
+    pipeline = SearchPipeline(mock_qdrant, "test", reranker)
+
+    results = [
+        {'id': '1', 'text': 'a', 'score': 0.9},
+        {'id': '2', 'text': 'bb', 'score': 0.8},
+        {'id': '3', 'text': 'ccc', 'score': 0.7},
+    ]
+    top = await pipeline._rerank_async("q", results, top_k=2)
+
+    assert [r['id'] for r in top] == ['2', '3']
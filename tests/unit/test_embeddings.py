@@ -93,3 +93,320 @@ async def test_mock_embedding_model(mock_get_model):
     assert len(embedding) == 384
     mock_model.get_query_embedding_async.assert_called_once()
 
+
+def _length_encoder():
+    """Mock SentenceTransformer: embedding = [длина текста]"""
+    client = Mock()
+    client.encode.side_effect = lambda texts, **kwargs: np.array([[float(len(t))] for t in texts])
+    return client
+
+def test_hf_batch_sorted_by_length_keeps_order():
+    """Тест: сортировка по длине не меняет порядок результата"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, _length_encoder())
+    embeddings = model.get_text_embeddings(["ccc", "a", "bb"])
+
+    assert embeddings == [[3.0], [1.0], [2.0]]
+
+def test_hf_batch_length_buckets():
+    """Тест: бакеты по длине кодируются отдельными вызовами encode"""
+    from rag_server.config import settings
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = _length_encoder()
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, client)
+    texts = ["x" * 600, "short", "y" * 200]
+
+    original = settings.embedding_length_bucketing
+    settings.embedding_length_bucketing = True
+    try:
+        embeddings = model.get_text_embeddings(texts)
+    finally:
+        settings.embedding_length_bucketing = original
+
+    assert embeddings == [[600.0], [5.0], [200.0]]
+    assert client.encode.call_count == 3
+
+def test_dynamic_batcher_coalesces_requests():
+    """Тест: одновременные одиночные запросы объединяются в один encode"""
+    from rag_server.embeddings import _EmbeddingBatcher
+
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[float(len(t))] for t in texts])
+
+    batcher = _EmbeddingBatcher(encode, max_batch=8, max_wait_ms=50)
+    futures = [batcher.submit(t) for t in ["a", "bb", "ccc"]]
+
+    assert [f.result(timeout=5).tolist() for f in futures] == [[1.0], [2.0], [3.0]]
+    assert sum(len(c) for c in calls) == 3
+    assert len(calls) < 3
+
+@pytest.mark.asyncio
+async def test_dynamic_batcher_survives_cancelled_awaiter():
+    """Тест: отмененный await не убивает worker batcher, следующий submit выполняется"""
+    import asyncio
+    import threading
+    from rag_server.embeddings import _EmbeddingBatcher
+
+    release = threading.Event()
+
+    def encode(texts):
+        release.wait(timeout=5)
+        return np.array([[float(len(t))] for t in texts])
+
+    batcher = _EmbeddingBatcher(encode, max_batch=8, max_wait_ms=1)
+    first = batcher.submit("a")
+    # worker занят первым батчем, второй запрос ждет в очереди и отменяется там
+    await asyncio.sleep(0.05)
+    cancelled = asyncio.ensure_future(asyncio.wrap_future(batcher.submit("bb")))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    release.set()
+
+    assert first.result(timeout=5).tolist() == [1.0]
+    second = await asyncio.wait_for(asyncio.wrap_future(batcher.submit("ccc")), timeout=5)
+    assert second.tolist() == [3.0]
+
+def test_api_batch_failure_retries_only_failed_halves():
+    """Тест: упавший батч делится пополам, порядок результата сохраняется"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    calls = []
+
+    def create(model, input):
+        calls.append(list(input))
+        if len(input) > 2:
+            raise ValueError("payload too large")
+        return Mock(data=[Mock(embedding=[float(len(t))]) for t in input])
+
+    client = Mock()
+    client.embeddings.create.side_effect = create
+    model = UnifiedEmbeddingModel('openai', 'mock', 1, client)
+
+    embeddings = model.get_text_embeddings(["a", "bb", "ccc", "dddd"])
+
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0]]
+    assert calls == [["a", "bb", "ccc", "dddd"], ["a", "bb"], ["ccc", "dddd"]]
+
+def test_api_batch_non_size_error_not_split():
+    """Тест: ошибка, не зависящая от размера батча (auth), пробрасывается без деления"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = Mock()
+    client.embeddings.create.side_effect = PermissionError("401 invalid api key")
+    model = UnifiedEmbeddingModel('openai', 'mock', 1, client)
+
+    with pytest.raises(PermissionError):
+        model._embed_with_split(["a", "bb", "ccc", "dddd"])
+    assert client.embeddings.create.call_count == 1
+
+def test_hf_batch_array_keeps_order():
+    """Тест: array API возвращает матрицу float32 в исходном порядке"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, _length_encoder())
+    embeddings = model.get_text_embeddings_array(["ccc", "a", "bb"])
+
+    assert isinstance(embeddings, np.ndarray)
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (3, 1)
+    assert embeddings[:, 0].tolist() == [3.0, 1.0, 2.0]
+    assert model.get_text_embeddings_array([]).shape == (0, 1)
+
+def test_hf_batch_array_uses_cache():
+    """Тест: array API берет повторные тексты из LRU кэша и не вызывает encode повторно"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    encoder = _length_encoder()
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, encoder)
+    model.get_text_embeddings_array(["ccc", "a"])
+    embeddings = model.get_text_embeddings_array(["a", "bb", "ccc"])
+
+    assert embeddings.dtype == np.float32
+    assert embeddings[:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert encoder.encode.call_count == 2
+    assert encoder.encode.call_args[0][0] == ["bb"]
+
+def test_api_batch_split_by_provider_max_batch():
+    """Тест: большой batch режется на запросы не длиннее embedding_provider_max_batch"""
+    from rag_server.config import settings
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = Mock()
+    client.embeddings.create.side_effect = lambda model, input: Mock(
+        data=[Mock(embedding=[float(len(t))]) for t in input]
+    )
+    model = UnifiedEmbeddingModel('openai', 'mock', 1, client)
+    texts = ["x" * i for i in range(1, 6)]
+
+    original = settings.embedding_provider_max_batch
+    settings.embedding_provider_max_batch = 2
+    try:
+        embeddings = model.get_text_embeddings(texts)
+    finally:
+        settings.embedding_provider_max_batch = original
+
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert client.embeddings.create.call_count == 3
+
+def test_batch_size_tuner_picks_fastest_candidate():
+    """Тест: после измерения всех кандидатов выбирается самый быстрый batch_size"""
+    from rag_server.embeddings import _BatchSizeTuner
+
+    tuner = _BatchSizeTuner(32, interval=3)
+    assert tuner.candidates == (16, 32, 64)
+
+    throughput = {16: 100.0, 32: 300.0, 64: 200.0}
+    for _ in range(3):
+        batch_size = tuner.current()
+        tuner.record(batch_size, int(throughput[batch_size]), 1.0)
+
+    assert tuner.current() == 32
+
+def test_hf_batch_iter_streams_in_chunks():
+    """Тест: потоковая генерация кодирует по chunk текстов и сохраняет порядок"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = _length_encoder()
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, client)
+    embeddings = list(model.get_text_embeddings_iter(["a", "bbb", "cc", "dddd", "e"], chunk=2))
+
+    assert embeddings == [[1.0], [3.0], [2.0], [4.0], [1.0]]
+    assert client.encode.call_count == 3
+
+@pytest.mark.asyncio
+async def test_dynamic_batch_coalesces_api_requests():
+    """Тест: конкурентные одиночные запросы к API объединяются в один embeddings.create"""
+    import asyncio
+    from rag_server.config import settings
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = Mock()
+    client.embeddings.create.side_effect = lambda model, input: Mock(
+        data=[Mock(embedding=[float(len(t))]) for t in input]
+    )
+
+    original = (settings.embedding_dynamic_batch, settings.embedding_dynamic_batch_wait_ms)
+    settings.embedding_dynamic_batch, settings.embedding_dynamic_batch_wait_ms = True, 50
+    try:
+        model = UnifiedEmbeddingModel('openai', 'mock', 1, client)
+    finally:
+        settings.embedding_dynamic_batch, settings.embedding_dynamic_batch_wait_ms = original
+
+    embeddings = await asyncio.gather(*(model.get_query_embedding_async(t) for t in ["a", "bb", "ccc"]))
+
+    assert embeddings == [[1.0], [2.0], [3.0]]
+    assert client.embeddings.create.call_count < 3
+
+@pytest.mark.asyncio
+async def test_dynamic_batch_api_survives_cancelled_request():
+    """Тест: отмена одного запроса к API через batcher не блокирует последующие"""
+    import asyncio
+    import threading
+    from rag_server.config import settings
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    release = threading.Event()
+
+    def create(model, input):
+        release.wait(timeout=5)
+        return Mock(data=[Mock(embedding=[float(len(t))]) for t in input])
+
+    client = Mock()
+    client.embeddings.create.side_effect = create
+
+    original = (settings.embedding_dynamic_batch, settings.embedding_dynamic_batch_wait_ms)
+    settings.embedding_dynamic_batch, settings.embedding_dynamic_batch_wait_ms = True, 1
+    try:
+        model = UnifiedEmbeddingModel('openai', 'mock', 1, client)
+    finally:
+        settings.embedding_dynamic_batch, settings.embedding_dynamic_batch_wait_ms = original
+
+    first = asyncio.ensure_future(model.get_query_embedding_async("a"))
+    await asyncio.sleep(0.05)
+    cancelled = asyncio.ensure_future(model.get_query_embedding_async("bb"))
+    await asyncio.sleep(0.01)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    release.set()
+
+    assert await asyncio.wait_for(first, timeout=5) == [1.0]
+    assert await asyncio.wait_for(model.get_query_embedding_async("ccc"), timeout=5) == [3.0]
+
+def test_api_batch_return_numpy():
+    """Тест: return_numpy=True возвращает матрицу float32 и для API источника"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = Mock()
+    client.embeddings.create.side_effect = lambda model, input: Mock(
+        data=[Mock(embedding=[float(len(t)), 0.0]) for t in input]
+    )
+    model = UnifiedEmbeddingModel('openai', 'mock', 2, client)
+
+    embeddings = model.get_text_embeddings(["a", "bb"], return_numpy=True)
+
+    assert isinstance(embeddings, np.ndarray)
+    assert embeddings.dtype == np.float32
+    assert embeddings.tolist() == [[1.0, 0.0], [2.0, 0.0]]
+
+def test_embedding_cache_encodes_only_missing_texts():
+    """Тест: повторные тексты берутся из кэша, кодируются только новые"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = _length_encoder()
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, client)
+
+    assert model.get_text_embeddings(["a", "bb"]) == [[1.0], [2.0]]
+    assert model.get_text_embeddings(["bb", "ccc", "a"]) == [[2.0], [3.0], [1.0]]
+
+    encoded = [list(call.args[0]) for call in client.encode.call_args_list]
+    assert encoded == [["a", "bb"], ["ccc"]]
+
+def test_hf_batch_failure_splits_batch():
+    """Тест: при ошибке encode батч делится пополам, а не кодируется по одному"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    def encode(texts, **kwargs):
+        if len(texts) > 2:
+            raise RuntimeError("CUDA out of memory")
+        return np.array([[float(len(t))] for t in texts])
+
+    client = Mock()
+    client.encode.side_effect = encode
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, client)
+
+    assert model.get_text_embeddings(["dddd", "a", "ccc", "bb"]) == [[4.0], [1.0], [3.0], [2.0]]
+    assert client.encode.call_count == 3
+
+def test_hf_non_oom_error_not_split():
+    """Тест: ошибка encode, не связанная с памятью, пробрасывается без деления батча"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    client = Mock()
+    client.encode.side_effect = TypeError("bad input")
+    model = UnifiedEmbeddingModel('huggingface', 'mock', 1, client)
+
+    with pytest.raises(TypeError):
+        model._encode_with_split(["dddd", "a", "ccc", "bb"])
+    assert client.encode.call_count == 1
+
+@pytest.mark.asyncio
+async def test_close_inside_running_loop_defers_to_aclose():
+    """Тест: close() внутри event loop не трогает async пул, aclose() его закрывает"""
+    from rag_server.embeddings import UnifiedEmbeddingModel
+
+    async_http = AsyncMock()
+    model = UnifiedEmbeddingModel('openai', 'mock', 1, Mock(), async_http_client=async_http)
+    model.close()
+    async_http.aclose.assert_not_awaited()
+    assert model.async_http_client is async_http
+    await model.aclose()
+    async_http.aclose.assert_awaited_once()
+    assert model.async_http_client is None
@@ -105,3 +105,26 @@ def test_detect_hallucination_helper(sample_docs):
     
     assert isinstance(is_hallucination, bool)
     assert isinstance(details, dict)
+
+def test_check_semantic_similarity_matrix(detector):
+    """Тест: docs_embeddings матрицей (N, D), нулевые векторы пропускаются"""
+    response = np.array([1.0, 0.0])
+    docs = np.array([[0.0, 0.0], [0.0, 1.0], [2.0, 0.0]])
+
+    score = detector._check_semantic_similarity(response, docs)
+    assert score == pytest.approx(1.0)
+
+    score = detector._check_semantic_similarity(response, np.zeros((2, 2)))
+    assert score == 0.0
+
+def test_semantic_similarity_half_precision_input(detector):
+    """Тест: docs embeddings в float16 приводятся к float32 и дают ту же similarity"""
+    docs = np.array([[0.9, 0.1], [0.0, 1.0]], dtype=np.float16)
+
+    score = detector._check_semantic_similarity(np.array([1.0, 0.0]), docs)
+    assert score == pytest.approx(0.9939, abs=1e-3)
+
+def test_keyword_overlap_ignores_punctuation(detector, sample_docs):
+    """Тест: слова с пунктуацией ("language.") учитываются как обычные"""
+    score = detector._check_keyword_overlap("Python programming language!", sample_docs)
+    assert score == pytest.approx(1.0)
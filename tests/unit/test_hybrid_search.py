@@ -8,6 +8,7 @@ from rag_server.hybrid_search import (
     hybrid_search_async,
     init_bm25_retriever,
     QueryIntent,
+    BM25Node,
 )
 
 def test_detect_query_intent_navigational():
@@ -20,6 +21,11 @@ def test_detect_query_intent_howto():
     assert detect_query_intent("как настроить систему") == QueryIntent.HOWTO
     assert detect_query_intent("инструкция по установке") == QueryIntent.HOWTO
 
+def test_detect_query_intent_normalizes_unicode():
+    """Неразрывные пробелы и полноширинные символы не мешают определению интента"""
+    assert detect_query_intent("ｕｒｌ сервиса") == QueryIntent.NAVIGATIONAL
+    assert detect_query_intent("Где\u00a0найти") == QueryIntent.NAVIGATIONAL
+
 def test_detect_query_intent_factual():
     """Тест определения factual запроса"""
     assert detect_query_intent("что такое API") == QueryIntent.FACTUAL
@@ -59,6 +65,21 @@ def test_reciprocal_rank_fusion_vector_only():
     assert len(result) == 2
     assert result[0]['id'] == '1'  # Лучший score первым
 
+def test_reciprocal_rank_fusion_single_list_fast_path():
+    """Один пустой список: ранги и scores как у общего пути, повторы id суммируются"""
+    bm25_results = [{'id': 'a', 'text': 'A', 'payload': {'space': 'X'}}, {'id': 'b', 'text': 'B', 'payload': {}}]
+
+    result = reciprocal_rank_fusion([], bm25_results, k=60, vector_weight=0.5, bm25_weight=0.5, limit=1)
+
+    assert [r['id'] for r in result] == ['a']
+    assert result[0]['metadata'] == {'space': 'X'}
+    assert result[0]['bm25_rank'] == 1 and result[0]['vector_rank'] is None
+    assert result[0]['rrf_score'] == pytest.approx(0.5 / 61)
+
+    duplicated = [{'id': 'a', 'text': ''}, {'id': 'b', 'text': ''}, {'id': 'b', 'text': ''}]
+    result = reciprocal_rank_fusion(duplicated, [], k=60, vector_weight=1.0, bm25_weight=0.0)
+    assert [r['id'] for r in result] == ['b', 'a']
+
 def test_reciprocal_rank_fusion_merge():
     """Тест RRF слияния vector + BM25"""
     vector_results = [
@@ -133,3 +154,362 @@ def test_init_bm25_retriever():
     # Можно skip если нет тестовой DB
     pytest.skip("Requires Qdrant test instance")
 
+
+def test_create_bm25_index_uses_bm25s_when_available():
+    """bm25s backend используется если установлен"""
+    from rag_server import hybrid_search
+    from rag_server.config import settings
+
+    fake_bm25s = Mock()
+    original_dir = settings.bm25_index_dir
+    settings.bm25_index_dir = ""
+    try:
+        with patch.object(hybrid_search, 'HAS_BM25S', True), \
+             patch.object(hybrid_search, 'bm25s', fake_bm25s, create=True):
+            index = hybrid_search._create_bm25_index([['a', 'b'], ['c']])
+    finally:
+        settings.bm25_index_dir = original_dir
+
+    assert index is fake_bm25s.BM25.return_value
+    fake_bm25s.BM25.assert_called_once_with(k1=settings.bm25_k1, b=settings.bm25_b)
+    index.index.assert_called_once_with([['a', 'b'], ['c']], show_progress=False)
+
+def test_postings_bm25_matches_rank_bm25():
+    """Postings scoring совпадает с rank_bm25.get_scores"""
+    import numpy as np
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    from rag_server.hybrid_search import _PostingsBM25
+
+    corpus = [['api', 'rest', 'api'], ['docker', 'api'], ['kafka', 'topic', 'partition']]
+    okapi = rank_bm25.BM25Okapi(corpus)
+    index = _PostingsBM25(okapi)
+
+    for query in (['api'], ['docker', 'api', 'unknown'], ['api', 'api']):
+        np.testing.assert_allclose(index.get_scores(query), okapi.get_scores(query), rtol=1e-4)
+
+def test_postings_bm25_quantized_close_to_full_precision():
+    """Квантизованные postings дают близкие scores"""
+    import numpy as np
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    from rag_server import hybrid_search
+    from rag_server.config import settings
+
+    corpus = [['api', 'rest', 'api'], ['docker', 'api'], ['kafka', 'topic', 'partition']]
+    okapi = rank_bm25.BM25Okapi(corpus)
+    original = settings.bm25_quantize
+    settings.bm25_quantize = True
+    try:
+        index = hybrid_search._PostingsBM25(okapi)
+    finally:
+        settings.bm25_quantize = original
+
+    assert index.tfs.dtype == np.int16
+    scores = index.get_scores(['api', 'docker'])
+    assert scores.dtype == np.float32
+    np.testing.assert_allclose(scores, okapi.get_scores(['api', 'docker']), rtol=1e-2, atol=1e-3)
+
+@pytest.mark.asyncio
+async def test_hybrid_search_async_runs_vector_retriever():
+    """vector_retriever выполняется вместе с BM25 и результаты объединяются"""
+    vector_retriever = AsyncMock(return_value=[{'id': 'v', 'text': 'vec', 'metadata': {}}])
+    nodes = [BM25Node('b', {}, 'bm25')]
+
+    with patch('rag_server.hybrid_search.bm25_index') as mock_index, \
+         patch('rag_server.hybrid_search.bm25_nodes', nodes):
+        mock_index.get_scores.return_value = [1.0]
+        result = await hybrid_search_async(
+            query="test query",
+            collection_name="test",
+            limit=10,
+            vector_retriever=vector_retriever
+        )
+
+    vector_retriever.assert_awaited_once_with("test query", 30)
+    assert {r['id'] for r in result} == {'v', 'b'}
+
+@pytest.mark.asyncio
+async def test_hybrid_search_async_disabled_fetches_only_limit():
+    """Без BM25 vector_retriever не запрашивает запас кандидатов для RRF"""
+    vector_retriever = AsyncMock(return_value=[{'id': 'v', 'text': 'vec', 'metadata': {}}])
+
+    with patch('rag_server.hybrid_search.settings') as mock_settings:
+        mock_settings.enable_hybrid_search = False
+        result = await hybrid_search_async(
+            query="test query",
+            collection_name="test",
+            limit=10,
+            vector_retriever=vector_retriever
+        )
+
+    vector_retriever.assert_awaited_once_with("test query", 10)
+    assert [r['id'] for r in result] == ['v']
+
+@pytest.mark.asyncio
+async def test_hybrid_search_async_caches_bm25_results():
+    """Повторный запрос не пересчитывает BM25 scores"""
+    from rag_server.hybrid_search import _bm25_cache
+
+    nodes = [BM25Node('b', {}, 'bm25')]
+    vector_results = [{'id': 'v', 'text': 'vec', 'metadata': {}}]
+    _bm25_cache.clear()
+    try:
+        with patch('rag_server.hybrid_search.bm25_index') as mock_index, \
+             patch('rag_server.hybrid_search.bm25_nodes', nodes):
+            mock_index.get_scores.return_value = [1.0]
+            first = await hybrid_search_async("кэш запрос", "test", vector_results, limit=5)
+            second = await hybrid_search_async("кэш запрос", "test", vector_results, limit=5)
+    finally:
+        _bm25_cache.clear()
+
+    assert mock_index.get_scores.call_count == 1
+    assert [r['id'] for r in first] == [r['id'] for r in second]
+
+def test_reciprocal_rank_fusion_ranks_and_metadata():
+    """RRF сохраняет ранги и берет метаданные BM25 из payload"""
+    vector_results = [{'id': '1', 'text': 'doc1', 'metadata': {'src': 'vec'}}]
+    bm25_results = [
+        {'id': '3', 'text': 'doc3', 'payload': {'src': 'bm25'}},
+        {'id': '1', 'text': 'doc1 bm25', 'payload': {'src': 'bm25'}},
+    ]
+
+    result = reciprocal_rank_fusion(vector_results, bm25_results, k=60, vector_weight=0.5, bm25_weight=0.5)
+    by_id = {r['id']: r for r in result}
+
+    assert result[0]['id'] == '1'
+    assert by_id['1']['vector_rank'] == 1 and by_id['1']['bm25_rank'] == 2
+    assert by_id['1']['metadata'] == {'src': 'vec'}
+    assert by_id['3']['vector_rank'] is None and by_id['3']['bm25_rank'] == 1
+    assert by_id['3']['metadata'] == {'src': 'bm25'}
+    assert by_id['1']['rrf_score'] == pytest.approx(0.5 / 61 + 0.5 / 62)
+
+def test_reciprocal_rank_fusion_limit():
+    """RRF с limit возвращает тот же top, что и полная сортировка"""
+    vector_results = [{'id': str(i), 'text': '', 'metadata': {}} for i in range(20)]
+    bm25_results = [{'id': str(i), 'text': '', 'payload': {}} for i in range(19, 4, -1)]
+
+    full = reciprocal_rank_fusion(vector_results, bm25_results, k=60)
+    top = reciprocal_rank_fusion(vector_results, bm25_results, k=60, limit=5)
+
+    assert [r['id'] for r in top] == [r['id'] for r in full[:5]]
+
+def test_simple_tokenize_stopwords_analyzer():
+    """stopwords analyzer убирает стоп-слова, пунктуацию и однобуквенные токены"""
+    from rag_server.hybrid_search import simple_tokenize
+
+    with patch('rag_server.hybrid_search._bm25_analyzer', return_value='stopwords'):
+        assert simple_tokenize("Как настроить API, и Docker в k8s?") == ['настроить', 'api', 'docker', 'k8s']
+    with patch('rag_server.hybrid_search._bm25_analyzer', return_value='simple'):
+        assert simple_tokenize("Как настроить API,") == ['как', 'настроить', 'api,']
+
+def test_simple_tokenize_stem_analyzer():
+    """stem analyzer приводит словоформы к одной основе"""
+    pytest.importorskip("Stemmer")
+    from rag_server.hybrid_search import simple_tokenize
+
+    with patch('rag_server.hybrid_search._bm25_analyzer', return_value='stem'):
+        assert simple_tokenize("настройка") == simple_tokenize("настройки")
+
+def test_prepare_bm25_corpus_reuses_cached_tokens(tmp_path):
+    """Неизмененные документы берут токены из кэша, измененные токенизируются заново"""
+    from rag_server import hybrid_search
+    from rag_server.config import settings
+
+    all_data = {'ids': ['1', '2'], 'documents': ['alpha beta', 'gamma delta'], 'metadatas': [{}, {}]}
+    original = settings.bm25_index_dir
+    settings.bm25_index_dir = str(tmp_path)
+    try:
+        hybrid_search._prepare_bm25_corpus(all_data)
+        all_data['documents'][1] = 'gamma epsilon'
+        with patch.object(hybrid_search, 'simple_tokenize', wraps=hybrid_search.simple_tokenize) as tokenize:
+            corpus_tokens, nodes = hybrid_search._prepare_bm25_corpus(all_data)
+    finally:
+        settings.bm25_index_dir = original
+
+    tokenize.assert_called_once_with('gamma epsilon')
+    assert corpus_tokens[0] == hybrid_search.simple_tokenize('alpha beta')
+    assert [n.id for n in nodes] == ['1', '2']
+
+def test_bm25_nodes_share_empty_metadata():
+    """Документы без метаданных ссылаются на один общий read-only mapping"""
+    from rag_server.hybrid_search import _make_bm25_nodes, _EMPTY_METADATA
+
+    nodes = _make_bm25_nodes({'ids': ['1', '2', '3'], 'documents': ['a', None, 'c'], 'metadatas': [None, None, {}]})
+
+    assert [n.id for n in nodes] == ['1', '3']
+    assert nodes[0].payload is _EMPTY_METADATA and nodes[1].payload is _EMPTY_METADATA
+
+def test_create_bm25_index_skips_tokenization_when_persisted(tmp_path):
+    """Индекс с диска загружается без токенизации документов"""
+    pytest.importorskip("rank_bm25")
+    from rag_server import hybrid_search
+    from rag_server.config import settings
+
+    nodes = [BM25Node('1', {}, 'alpha beta'), BM25Node('2', {}, 'gamma delta')]
+    original = settings.bm25_index_dir
+    settings.bm25_index_dir = str(tmp_path)
+    try:
+        with patch.object(hybrid_search, '_use_bm25s', return_value=False):
+            hybrid_search._create_bm25_index(None, nodes)
+            with patch.object(hybrid_search, '_tokenize_bm25_corpus') as tokenize:
+                index = hybrid_search._create_bm25_index(None, nodes)
+    finally:
+        settings.bm25_index_dir = original
+
+    tokenize.assert_not_called()
+    assert index.corpus_size == 2
+
+
+def test_postings_bm25_save_load_roundtrip(tmp_path):
+    """Postings индекс загружается с диска с теми же scores"""
+    import numpy as np
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    from rag_server.hybrid_search import _PostingsBM25
+
+    index = _PostingsBM25(rank_bm25.BM25Okapi([['api', 'rest'], ['docker', 'api'], ['kafka']]))
+    index.save(str(tmp_path / "postings"))
+    loaded = _PostingsBM25.load(str(tmp_path / "postings"))
+
+    np.testing.assert_allclose(loaded.get_scores(['api', 'kafka']), index.get_scores(['api', 'kafka']))
+    # Массивы отображены с диска (mmap read-only), а не скопированы в память
+    assert not loaded.docs.flags.writeable
+
+def test_bm25_sparse_vector_is_stable_and_saturated():
+    """Sparse вектор: стабильные индексы токенов, TF с насыщением"""
+    from rag_server.hybrid_search import bm25_sparse_vector
+
+    with patch('rag_server.hybrid_search._bm25_analyzer', return_value='simple'):
+        indices, values = bm25_sparse_vector("kafka kafka topic")
+        again, _ = bm25_sparse_vector("kafka topic kafka")
+
+    assert len(indices) == 2
+    assert sorted(indices) == sorted(again)
+    assert all(0 <= i < 2 ** 31 for i in indices)
+    by_index = dict(zip(indices, values))
+    kafka_value, topic_value = sorted(by_index.values(), reverse=True)
+    assert topic_value < kafka_value < 2 * topic_value
+
+def test_detect_query_intent_keeps_priority_over_position():
+    """Интент с более высоким приоритетом выигрывает у более раннего совпадения"""
+    assert detect_query_intent("что это и где найти") == QueryIntent.NAVIGATIONAL
+    assert detect_query_intent("список: как установить") == QueryIntent.HOWTO
+
+@pytest.mark.asyncio
+async def test_hybrid_search_sync_inside_running_loop():
+    """Sync hybrid_search работает внутри event loop (без asyncio.run)"""
+    from rag_server.hybrid_search import hybrid_search, _bm25_cache
+
+    nodes = [BM25Node('b', {}, 'bm25')]
+    _bm25_cache.clear()
+    try:
+        with patch('rag_server.hybrid_search.bm25_index') as mock_index, \
+             patch('rag_server.hybrid_search.bm25_nodes', nodes):
+            mock_index.get_scores.return_value = [1.0]
+            result = hybrid_search("sync запрос", "test", [{'id': 'v', 'text': 'vec', 'metadata': {}}], limit=5)
+    finally:
+        _bm25_cache.clear()
+
+    assert {r['id'] for r in result} == {'v', 'b'}
+
+def test_postings_bm25_batch_scores_match_single():
+    """get_scores_batch совпадает с get_scores для каждого запроса"""
+    import numpy as np
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    from rag_server.hybrid_search import _PostingsBM25
+
+    index = _PostingsBM25(rank_bm25.BM25Okapi([['api', 'rest'], ['docker', 'api'], ['kafka', 'api']]))
+    queries = [['api'], ['docker', 'api'], ['unknown'], ['kafka', 'kafka']]
+
+    batch = index.get_scores_batch(queries)
+
+    assert batch.shape == (4, 3)
+    for row, query in zip(batch, queries):
+        np.testing.assert_allclose(row, index.get_scores(query), rtol=1e-5)
+
+def test_hybrid_search_batch_scores_queries_in_one_call():
+    """hybrid_search_batch считает BM25 всех запросов одним get_scores_batch"""
+    import numpy as np
+    from rag_server.hybrid_search import hybrid_search_batch, _bm25_cache
+
+    _bm25_cache.clear()
+    nodes = [BM25Node('b', {}, 'bm25')]
+    vector_batch = [[{'id': 'v1', 'text': '', 'metadata': {}}], [{'id': 'v2', 'text': '', 'metadata': {}}]]
+
+    with patch('rag_server.hybrid_search.bm25_index') as mock_index, \
+         patch('rag_server.hybrid_search.bm25_nodes', nodes):
+        mock_index.get_scores_batch.return_value = np.array([[1.0], [0.0]])
+        result = hybrid_search_batch(["первый запрос", "второй запрос"], "test", vector_batch, limit=10)
+    _bm25_cache.clear()
+
+    mock_index.get_scores_batch.assert_called_once()
+    assert {r['id'] for r in result[0]} == {'v1', 'b'}
+    assert [r['id'] for r in result[1]] == ['v2']
+
+def test_bm25_space_filter_applied_before_top_k():
+    """space_filter отсекает документы других пространств до отбора top-k"""
+    import numpy as np
+    from rag_server import hybrid_search
+
+    nodes = [BM25Node('a', {'space': 'DEV'}, 'a'), BM25Node('b', {'space': 'OPS'}, 'b'), BM25Node('c', {'space': 'OPS'}, 'c')]
+    with patch('rag_server.hybrid_search.bm25_nodes', nodes), \
+         patch.dict('rag_server.hybrid_search._space_masks', clear=True):
+        res = hybrid_search._top_bm25_results(np.array([3.0, 2.0, 1.0]), 1, space_filter='OPS')
+
+    assert [r['id'] for r in res] == ['b']
+
+def test_reciprocal_rank_fusion_does_not_copy_payloads():
+    """RRF ссылается на текст и метаданные входных результатов без копирования"""
+    metadata = {'space': 'DOC'}
+    vector_results = [{'id': '1', 'text': 'doc1', 'metadata': metadata}]
+
+    result = reciprocal_rank_fusion(vector_results, [], k=60)
+
+    assert result[0]['metadata'] is metadata
+
+def test_refresh_adaptive_weights_picks_up_settings():
+    """refresh_adaptive_weights пересчитывает веса после изменения settings"""
+    from rag_server.config import settings
+    from rag_server.hybrid_search import refresh_adaptive_weights
+
+    original = settings.hybrid_bm25_weight_howto
+    settings.hybrid_bm25_weight_howto = settings.hybrid_vector_weight_howto
+    try:
+        refresh_adaptive_weights()
+        v_weight, bm25_weight = get_adaptive_weights(QueryIntent.HOWTO)
+    finally:
+        settings.hybrid_bm25_weight_howto = original
+        refresh_adaptive_weights()
+
+    assert v_weight == pytest.approx(0.5) and bm25_weight == pytest.approx(0.5)
+
+@pytest.mark.asyncio
+async def test_bm25_batcher_survives_cancelled_search():
+    """Отмененный BM25 запрос в очереди batcher не останавливает worker"""
+    import asyncio
+    import threading
+    import numpy as np
+    from rag_server.hybrid_search import _BM25Batcher, _bm25_cache
+
+    release = threading.Event()
+
+    def scores_batch(queries):
+        release.wait(timeout=5)
+        return np.zeros((len(queries), 1))
+
+    _bm25_cache.clear()
+    with patch('rag_server.hybrid_search._bm25_scores_batch', side_effect=scores_batch), \
+         patch('rag_server.hybrid_search._top_bm25_results', side_effect=lambda row, limit, space: [{'id': str(limit)}]):
+        batcher = _BM25Batcher(max_batch=8, max_wait_ms=1)
+        first = batcher.submit(('a',), 1)
+        await asyncio.sleep(0.05)
+        cancelled = asyncio.ensure_future(asyncio.wrap_future(batcher.submit(('b',), 2)))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        release.set()
+
+        assert first.result(timeout=5) == [{'id': '1'}]
+        second = await asyncio.wait_for(asyncio.wrap_future(batcher.submit(('c',), 3)), timeout=5)
+    _bm25_cache.clear()
+
+    assert second == [{'id': '3'}]
@@ -1,11 +1,14 @@
 """Unit tests для Qdrant storage"""
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
+from qdrant_client.models import Filter, FieldCondition, MatchValue
 from rag_server.qdrant_storage import (
     init_qdrant_client,
     init_async_qdrant_client,
     search_in_qdrant,
     search_in_qdrant_async,
+    get_all_points,
+    get_points_by_filter,
 )
 
 def test_init_qdrant_client():
@@ -52,3 +55,34 @@ async def test_search_with_mmr():
     """Тест поиска с MMR диверсификацией"""
     pytest.skip("Requires Qdrant test instance")
 
+
+def test_get_all_points_paginates_scroll():
+    """get_all_points проходит страницы scroll по next_page_offset до limit"""
+    client = Mock()
+    client.scroll.side_effect = [
+        ([Mock(id=1, payload={'text': 'a', 'space': 'DEV'}), Mock(id=2, payload={'text': 'b'})], 2),
+        ([Mock(id=3, payload={'text': 'c'})], None),
+    ]
+
+    with patch('rag_server.qdrant_storage.init_qdrant_client', return_value=client), \
+         patch('rag_server.qdrant_storage.settings.qdrant_scroll_batch_size', 2):
+        result = get_all_points(limit=10)
+
+    assert result['ids'] == ['1', '2', '3']
+    assert result['documents'] == ['a', 'b', 'c']
+    assert result['metadatas'][0] == {'space': 'DEV'}
+    assert client.scroll.call_args_list[1].kwargs['offset'] == 2
+
+
+def test_get_points_by_filter_passes_native_filter():
+    """Готовый Filter передается в scroll как есть, with_payload ограничивает поля"""
+    client = Mock()
+    client.scroll.return_value = ([Mock(id=1, payload={'text': 'a', 'page_id': 'p1', 'chunk': 2})], None)
+    native = Filter(must=[FieldCondition(key='page_id', match=MatchValue(value='p1'))])
+
+    with patch('rag_server.qdrant_storage.init_qdrant_client', return_value=client):
+        result = get_points_by_filter(native, limit=5, with_payload=['text', 'page_id', 'chunk'])
+
+    assert client.scroll.call_args.kwargs['scroll_filter'] is native
+    assert client.scroll.call_args.kwargs['with_payload'] == ['text', 'page_id', 'chunk']
+    assert result == [{'text': 'a', 'metadata': {'page_id': 'p1', 'chunk': 2}}]